@@ -0,0 +1,98 @@
+# Measures InMemoryDeviceCache lookup latency and memory per device after
+# loading a synthetic hub through HubitatCachingClient.
+#
+#   python -m benchmarks.device_cache_benchmark [num_devices] [num_lookups]
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import requests_mock
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+
+
+HOST = 'http://hub.local'
+APP_ID = '1'
+ACCESS_TOKEN = 'token'
+
+NUM_ROOMS = 20
+CAPABILITIES = ['Switch', 'PowerMeter', 'Battery', 'ContactSensor', 'Refresh', 'Actuator', 'Sensor']
+
+
+def make_devices(num_devices: int) -> list[dict]:
+    return [
+        {
+            'id': str(i),
+            'label': f'Device {i}',
+            'room': f'Room {i % NUM_ROOMS}',
+            'capabilities': CAPABILITIES,
+            'attributes': {
+                'switch': 'on' if i % 2 else 'off',
+                'power': str(i % 2000),
+                'battery': str(i % 100),
+                'contact': 'open' if i % 3 else 'closed',
+            },
+            'date': '2019-12-07T03:57:07+0000',
+        }
+        for i in range(num_devices)
+    ]
+
+
+def load_client(num_devices: int) -> HubitatCachingClient:
+    prefix = f'{HOST}/apps/api/{APP_ID}'
+    with requests_mock.mock() as req_mock:
+        req_mock.get(f'{prefix}/devices/all', text=json.dumps(make_devices(num_devices)))
+        req_mock.get(f'{prefix}/modes', text=json.dumps([{'active': True, 'id': 1, 'name': 'Day'}]))
+        req_mock.get(f'{prefix}/hsm', text=json.dumps({'hsm': 'disarmed'}))
+        return HubitatCachingClient(
+            HubitatAPIClient(app_id=APP_ID, access_token=ACCESS_TOKEN, host=HOST),
+            InMemoryDeviceCache(),
+        )
+
+
+def lookup_latency_ns(lookup, args: list[tuple]) -> float:
+    start = time.perf_counter_ns()
+    for a in args:
+        lookup(*a)
+    return (time.perf_counter_ns() - start) / len(args)
+
+
+def main(num_devices: int, num_lookups: int) -> None:
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    client = load_client(num_devices)
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    device_cache = client.device_cache
+    rng = random.Random(0)
+
+    # Half of the room and attribute lookups miss, which used to grow the cache
+    rooms = [f'Room {rng.randrange(NUM_ROOMS * 2)}' for _ in range(num_lookups)]
+    switch_values = [rng.choice(['on', 'off', 'unknown', 'idle']) for _ in range(num_lookups)]
+    aliases = [f'Device {rng.randrange(num_devices)}' for _ in range(num_lookups)]
+
+    print(f'{num_devices} devices, {num_lookups} lookups')
+    print(f'  memory: {(after - before) / num_devices:8.0f} bytes/device (client and cache)')
+    for name, lookup, args in [
+        ('by capability', device_cache.get_devices_by_capability, [('Switch',)] * num_lookups),
+        ('by room', device_cache.get_devices_by_capability_and_room, [('Switch', r) for r in rooms]),
+        ('by attribute', device_cache.get_devices_by_capability_and_attribute, [('Switch', 'switch', v) for v in switch_values]),
+        ('by range', device_cache.get_devices_by_attribute_range, [('Battery', 'battery', None, 10)] * num_lookups),
+        ('last value', device_cache.get_last_device_attr_value, [('Switch', a, 'switch') for a in aliases]),
+    ]:
+        print(f'  {name:14} {lookup_latency_ns(lookup, args):10.0f} ns/lookup')
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+    )
@@ -0,0 +1,67 @@
+# Compares peak and retained memory of building a DeviceSnapshot from a
+# fully decoded /devices/all response against streaming it device by device.
+# The hub runs in a child process so its allocations aren't counted.
+#
+#   python -m benchmarks.devices_all_benchmark [num_devices ...]
+import gc
+import multiprocessing
+import sys
+import tracemalloc
+from multiprocessing.connection import Connection
+from typing import Callable
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.client import DeviceSnapshot
+from hubitat_maker_api_client.emulator import DEFAULT_ACCESS_TOKEN
+from hubitat_maker_api_client.emulator import DEFAULT_APP_ID
+from hubitat_maker_api_client.emulator import HubEmulator
+from hubitat_maker_api_client.emulator import make_emulated_devices
+
+
+def make_devices(num_devices: int) -> list[dict]:
+    # Adds the commands and attribute metadata a real hub includes
+    devices = make_emulated_devices(num_devices)
+    for device in devices:
+        device['model'] = None
+        device['manufacturer'] = None
+        device['commands'] = [{'command': c} for c in ['configure', 'off', 'on', 'refresh', 'setLevel', 'startLevelChange', 'stopLevelChange']]
+        device['attributes']['dataType'] = 'ENUM'
+        device['attributes']['values'] = ['on', 'off']
+    return devices
+
+
+def serve(num_devices: int, conn: Connection) -> None:
+    with HubEmulator(devices=make_devices(num_devices)) as hub:
+        conn.send(hub.host)
+        conn.recv()
+
+
+def measure(build: Callable[[], DeviceSnapshot]) -> tuple[int, int]:
+    gc.collect()
+    tracemalloc.start()
+    snapshot = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del snapshot
+    return peak, retained
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [500, 2000, 8000]
+    print(f'{"devices":>8} {"decoded peak":>14} {"streamed peak":>14} {"decoded kept":>14} {"streamed kept":>14}')
+    for num_devices in sizes:
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=serve, args=(num_devices, child_conn), daemon=True)
+        process.start()
+        with HubitatAPIClient(app_id=DEFAULT_APP_ID, access_token=DEFAULT_ACCESS_TOKEN, host=conn.recv()) as api_client:
+            # Warm up the connection so it isn't counted
+            api_client.get_modes()
+            decoded_peak, decoded_kept = measure(lambda: DeviceSnapshot(api_client.get_devices(), 'label'))
+            streamed_peak, streamed_kept = measure(lambda: DeviceSnapshot(api_client.iter_devices(), 'label'))
+        conn.send('stop')
+        process.join()
+        print(f'{num_devices:>8} {decoded_peak / 1e6:>12.1f}MB {streamed_peak / 1e6:>12.1f}MB {decoded_kept / 1e6:>12.1f}MB {streamed_kept / 1e6:>12.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
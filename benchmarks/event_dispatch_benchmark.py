@@ -0,0 +1,156 @@
+# Measures how many eventsocket events per second HubitatCachingClient can
+# turn into cache mutations, and apply to an InMemoryDeviceCache, against the
+# previous dispatch that scanned SUPPORTED_ACCESSOR_ATTRS and asked the cache
+# for the device's capabilities on every event. Both write the same
+# mutations. Per-event cost should not depend on hub size, so the run fails
+# when dispatch at the largest hub is more than --max-slowdown times slower
+# than at the smallest.
+#
+#   python -m benchmarks.event_dispatch_benchmark [--devices N ...] [--events N]
+import argparse
+import json
+import random
+import sys
+import time
+
+import mock
+import requests_mock
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.caching_client import ATTR_KEYS_WITH_NUMERIC_VALS
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.caching_client import SUPPORTED_ACCESSOR_ATTRS
+from hubitat_maker_api_client.client import to_number
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+HOST = 'http://hub.local'
+APP_ID = '1'
+ACCESS_TOKEN = 'token'
+
+CAPABILITIES = ['Switch', 'PowerMeter', 'EnergyMeter', 'Refresh', 'Actuator', 'Sensor']
+
+
+def make_devices(num_devices: int) -> list[dict]:
+    return [
+        {
+            'id': str(i),
+            'label': f'Device {i}',
+            'room': f'Room {i % 20}',
+            'capabilities': CAPABILITIES,
+            'attributes': {'switch': 'off', 'power': '0', 'energy': '0'},
+            'date': '2019-12-07T03:57:07+0000',
+        }
+        for i in range(num_devices)
+    ]
+
+
+def make_events(num_devices: int, num_events: int) -> list[HubitatEvent]:
+    rng = random.Random(0)
+    events = []
+    for _ in range(num_events):
+        i = rng.randrange(num_devices)
+        attr_key, attr_value = rng.choice([
+            ('switch', rng.choice(['on', 'off'])),
+            ('power', str(rng.randrange(2000))),
+            ('energy', str(rng.randrange(100))),
+        ])
+        events.append(HubitatEvent({
+            'deviceId': str(i),
+            'displayName': f'Device {i}',
+            'name': attr_key,
+            'value': attr_value,
+            'source': 'DEVICE',
+        }))
+    return events
+
+
+def scan_event_to_cache_mutations(device_cache, event, event_key):
+    # Keep in step with hubitat_event_to_cache_mutations, so both paths do
+    # the same cache writes and only the dispatch differs
+    mutations = []
+    alias = getattr(event, event_key)
+
+    capabilities = device_cache.get_capabilities_for_device_id(event.device_id) or {None}
+
+    for capability in capabilities:
+        for cap, k, v in SUPPORTED_ACCESSOR_ATTRS:
+            if cap == capability and k == event.attr_key:
+                if v == event.attr_value:
+                    mutations.append(('add_device_for_capability_and_attribute', capability, k, v, alias))
+                else:
+                    mutations.append(('remove_device_for_capability_and_attribute', capability, k, v, alias))
+
+        mutations.append(('set_last_device_attr_value', capability, alias, event.attr_key, event.attr_value))
+        if event.attr_key in ATTR_KEYS_WITH_NUMERIC_VALS:
+            mutations.append(('set_last_device_attr_timestamp', capability, alias, event.attr_key, None, event.timestamp))
+        else:
+            mutations.append(('set_last_device_attr_timestamp', capability, alias, event.attr_key, event.attr_value, event.timestamp))
+    if event.attr_key in ATTR_KEYS_WITH_NUMERIC_VALS and capabilities != {None}:
+        mutations.append(('set_device_attr_number', alias, event.attr_key, to_number(event.attr_value)))
+    return mutations
+
+
+def events_per_second(apply_event, events: list[HubitatEvent]) -> float:
+    start = time.perf_counter()
+    for event in events:
+        apply_event(event)
+    return len(events) / (time.perf_counter() - start)
+
+
+def bench(num_devices: int, num_events: int) -> float:
+    # Returns the dispatch path's update_from_hubitat_event events/sec
+    prefix = f'{HOST}/apps/api/{APP_ID}'
+    with requests_mock.mock() as req_mock:
+        req_mock.get(f'{prefix}/devices/all', text=json.dumps(make_devices(num_devices)))
+        req_mock.get(f'{prefix}/modes', text=json.dumps([{'active': True, 'id': 1, 'name': 'Day'}]))
+        req_mock.get(f'{prefix}/hsm', text=json.dumps({'hsm': 'disarmed'}))
+        client = HubitatCachingClient(
+            HubitatAPIClient(app_id=APP_ID, access_token=ACCESS_TOKEN, host=HOST),
+            InMemoryDeviceCache(),
+        )
+
+    events = make_events(num_devices, num_events)
+
+    def scan_mutations(event, device_cache, device_id_to_capabilities):
+        return scan_event_to_cache_mutations(device_cache, event, client.event_key)
+
+    def dispatch_mutations(event):
+        return client._event_to_cache_mutations(event, client.device_cache, client._device_id_to_capabilities)
+
+    print(f'{num_devices} devices, {num_events} events')
+    print('  building mutations:')
+    scan = events_per_second(lambda e: scan_mutations(e, client.device_cache, None), events)
+    dispatch = events_per_second(dispatch_mutations, events)
+    print(f'    scan:     {scan:10.0f} events/sec')
+    print(f'    dispatch: {dispatch:10.0f} events/sec ({dispatch / scan:.2f}x)')
+
+    print('  update_from_hubitat_event:')
+    with mock.patch.object(client, '_event_to_cache_mutations', scan_mutations):
+        scan = events_per_second(client.update_from_hubitat_event, events)
+    dispatch = events_per_second(client.update_from_hubitat_event, events)
+    print(f'    scan:     {scan:10.0f} events/sec')
+    print(f'    dispatch: {dispatch:10.0f} events/sec ({dispatch / scan:.2f}x)')
+    return dispatch
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, nargs='+', default=[500, 8000])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--max-slowdown', type=float, default=2.0, help='allowed events/sec ratio between the smallest and largest hub')
+    args = parser.parse_args()
+
+    sizes = sorted(args.devices)
+    rates = [bench(num_devices, args.events) for num_devices in sizes]
+    slowdown = rates[0] / rates[-1]
+    print(f'{sizes[-1]} devices are {slowdown:.2f}x slower per event than {sizes[0]}')
+    if slowdown > args.max_slowdown:
+        print(f'REGRESSION per-event cost grows with hub size (allowed {args.max_slowdown:g}x)')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# Load benchmarks against a local HubEmulator: load_cache wall time, query
+# latency percentiles, commands/sec and eventsocket events/sec. Results can
+# be saved with --json and compared against a saved run with --baseline,
+# which exits non-zero when a metric is worse by more than --tolerance.
+#
+#   python -m benchmarks.load_benchmark --devices 500 --latency 0.005
+#   python -m benchmarks.load_benchmark --json baseline.json
+#   python -m benchmarks.load_benchmark --baseline baseline.json
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Callable
+
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.emulator import HubEmulator
+from hubitat_maker_api_client.event_socket_emulator import EventSocketEmulator
+from hubitat_maker_api_client.event_socket_listener import EventSocketListener
+
+
+# Metrics where a larger value is an improvement; all others are durations
+HIGHER_IS_BETTER = ('commands_per_sec', 'events_per_sec', 'batched_events_per_sec')
+
+
+def time_call(call: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    call()
+    return time.perf_counter() - start
+
+
+def percentiles_us(call: Callable[[], object], num_calls: int) -> dict[str, float]:
+    samples = sorted(time_call(call) * 1e6 for _ in range(num_calls))
+    quantiles = statistics.quantiles(samples, n=100)
+    return {'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98]}
+
+
+def bench_load(hub: HubEmulator, results: dict) -> HubitatCachingClient:
+    api_client = hub.make_api_client()
+    start = time.perf_counter()
+    client = HubitatCachingClient(api_client, InMemoryDeviceCache())
+    results['load_cache_s'] = time.perf_counter() - start
+    results['client_first_read_s'] = time_call(lambda: HubitatClient(hub.make_api_client()).get_switches())
+    return client
+
+
+def bench_queries(hub: HubEmulator, client: HubitatCachingClient, num_queries: int, results: dict) -> None:
+    room = hub.devices[0]['room']
+    alias = hub.devices[0]['label']
+    snapshot_client = HubitatClient(hub.make_api_client())
+    # Fetches /devices/{id} on every call
+    device_client = HubitatClient(hub.make_api_client(), device_attributes_ttl=0)
+    for name, call in [
+        ('caching.get_on_switches', client.get_on_switches),
+        ('caching.by_room', lambda: client.get_devices_by_capability_and_room('Switch', room)),
+        ('caching.query', lambda: client.query('ContactSensor', room=room, attrs={'battery': (None, 50)})),
+        ('client.get_on_switches', snapshot_client.get_on_switches),
+        ('client.get_device_attribute', lambda: device_client.get_device_attribute(alias, 'switch')),
+    ]:
+        for k, v in percentiles_us(call, num_queries).items():
+            results[f'{name}_{k}_us'] = v
+
+
+def bench_commands(client: HubitatCachingClient, num_commands: int, results: dict) -> None:
+    switches = sorted(client.get_switches())
+    commands = [('Switch', switches[i % len(switches)], 'on' if i % 2 else 'off') for i in range(num_commands)]
+    elapsed = time_call(lambda: client.send_commands(commands))
+    results['commands_per_sec'] = num_commands / elapsed
+
+
+def bench_events(hub: HubEmulator, client: HubitatCachingClient, num_events: int, results: dict) -> None:
+    changes = hub.make_random_events(num_events)
+
+    async def run(metric: str, batch_size: int, batch_window: float) -> None:
+        async with EventSocketEmulator(hub) as event_socket:
+            listener = EventSocketListener(client, event_socket.uri, queue_size=num_events, batch_size=batch_size, batch_window=batch_window)
+            task = asyncio.create_task(listener.run())
+            await event_socket.wait_for_clients()
+
+            start = time.perf_counter()
+            await event_socket.send_events(changes)
+            while listener.events_applied + listener.events_dropped < num_events:
+                await asyncio.sleep(0.001)
+            results[metric] = listener.events_applied / (time.perf_counter() - start)
+
+            await listener.stop()
+            await task
+
+    asyncio.run(run('events_per_sec', 1, 0.0))
+    asyncio.run(run('batched_events_per_sec', 100, 0.005))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (value - base) / base
+        worse = -change if name in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append(f'{name}: {base:.6g} -> {value:.6g} ({change:+.0%})')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every hub response')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --json')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional regression')
+    args = parser.parse_args()
+
+    results: dict[str, float] = {}
+    with HubEmulator(num_devices=args.devices, latency=args.latency) as hub:
+        client = bench_load(hub, results)
+        bench_queries(hub, client, args.queries, results)
+        bench_commands(client, args.commands, results)
+        bench_events(hub, client, args.events, results)
+
+    print(f'{args.devices} devices, {args.latency * 1000:g} ms hub latency')
+    for name, value in results.items():
+        print(f'  {name:45} {value:12.1f}' if value >= 100 else f'  {name:45} {value:12.4f}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,3 +4,4 @@ from hubitat_maker_api_client.client import HubitatClient  # noqa
 from hubitat_maker_api_client.device_cache import DeviceCache  # noqa
 from hubitat_maker_api_client.device_cache import InMemoryDeviceCache  # noqa
 from hubitat_maker_api_client.event_socket import HubitatEvent  # noqa
+from hubitat_maker_api_client.federated_client import FederatedHubitatClient  # noqa
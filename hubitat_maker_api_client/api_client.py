@@ -1,10 +1,119 @@
+import codecs
+import json
+import re
+import threading
+import time
+from typing import Any
+from typing import Iterator
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from hubitat_maker_api_client.constants import HSM_STATE_TO_ACTION
+from hubitat_maker_api_client.instrumentation import API_GET_SPAN
+from hubitat_maker_api_client.instrumentation import Instrumentation
+from hubitat_maker_api_client.instrumentation import NOOP_INSTRUMENTATION
+from hubitat_maker_api_client.instrumentation import REQUEST_SECONDS
+from hubitat_maker_api_client.instrumentation import RESPONSE_BYTES
+from hubitat_maker_api_client.instrumentation import endpoint_template
 
 
 CLOUD_API_HOST = 'https://cloud.hubitat.com'
 
+DEFAULT_POOL_CONNECTIONS = 1
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_STREAM_CHUNK_SIZE = 65536
+
+_WHITESPACE = ' \t\n\r'
+_ARRAY_TERMINATORS = _WHITESPACE + ',]'
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+# The rest of a number whose fraction or exponent was cut off, e.g. e- of 1e-3
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]+')
+
+# JSONArrayDecoder states: what it expects next
+_ARRAY_START = 'start'
+_FIRST_ITEM = 'first_item'
+_ITEM = 'item'
+_DELIMITER = 'delimiter'
+_END = 'end'
+
+
+def _is_cut_off(err: json.JSONDecodeError) -> bool:
+    # Whether more data could still make the document valid: the error is at
+    # the end of the buffer, or in a string, escape, literal or number running
+    # up to it
+    tail = err.doc[err.pos:]
+    if not tail or err.msg.startswith('Unterminated string'):
+        return True
+    if err.msg == 'Invalid \\uXXXX escape':
+        return len(tail) < len('\\uXXXX')
+    return bool(_NUMBER_TAIL.fullmatch(tail)) or any(literal.startswith(tail) for literal in _LITERALS)
+
+
+class JSONArrayDecoder:
+    # Incrementally decodes a JSON array fed to it in chunks of bytes,
+    # returning each element once it has fully arrived. Only the unparsed
+    # tail of the document is buffered.
+    #
+    #   decoder = JSONArrayDecoder()
+    #   for chunk in chunks:
+    #       for item in decoder.feed(chunk):
+    #           ...
+    #   decoder.close()
+
+    def __init__(self) -> None:
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._state = _ARRAY_START
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        buf = self._buffer + self._text_decoder.decode(chunk)
+        items = []
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buf):
+                break
+            c = buf[pos]
+            if self._state == _ARRAY_START:
+                if c != '[':
+                    raise json.JSONDecodeError('Expecting a JSON array', buf, pos)
+                self._state = _FIRST_ITEM
+                pos += 1
+            elif c == ']' and self._state in (_FIRST_ITEM, _DELIMITER):
+                self._state = _END
+                pos += 1
+            elif self._state == _DELIMITER:
+                if c != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+                self._state = _ITEM
+                pos += 1
+            elif self._state == _END:
+                raise json.JSONDecodeError('Extra data', buf, pos)
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as err:
+                    if _is_cut_off(err):
+                        break
+                    raise
+                if end == len(buf) or isinstance(item, (int, float)) and buf[end] not in _ARRAY_TERMINATORS:
+                    # A number cut off by the chunk, e.g. 12 of 12.5, parses
+                    # but may continue in the next chunk
+                    break
+                items.append(item)
+                self._state = _DELIMITER
+                pos = end
+        self._buffer = buf[pos:]
+        return items
+
+    def close(self) -> None:
+        if self._state != _END:
+            raise json.JSONDecodeError('Unterminated JSON array', self._buffer, len(self._buffer))
+
 
 class HubitatAPIClient():
     def __init__(
@@ -13,24 +122,134 @@ class HubitatAPIClient():
         access_token: str,
         host: str = CLOUD_API_HOST,
         hub_id: str | None = None,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        pool_block: bool = False,
+        timeout: float | tuple[float, float] | None = DEFAULT_TIMEOUT,
+        max_retries: int = 0,
+        instrumentation: Instrumentation = NOOP_INSTRUMENTATION,
     ) -> None:
         self.host = host
         self.app_id = app_id
         self.access_token = access_token
         self.hub_id = hub_id
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.instrumentation = instrumentation
 
         if host == CLOUD_API_HOST and not hub_id:
             raise ValueError('hub_id required for Cloud API')
 
-    def api_get(self, endpoint: str) -> dict:
-        path = self._path_prefix() + endpoint
-        resp = requests.get(
-            f'{self.host}{path}?access_token={self.access_token}'
+        self._session: requests.Session | None = None
+        self._session_lock = threading.Lock()
+
+    def __enter__(self) -> 'HubitatAPIClient':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _get_session(self) -> requests.Session:
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._make_session()
+                session = self._session
+        return session
+
+    def _make_session(self) -> requests.Session:
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=self.max_retries,
         )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_connection_stats(self) -> dict[str, int]:
+        # Requests that didn't need a new connection reused a kept-alive one
+        num_requests = 0
+        num_connections = 0
+        session = self._session
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                if isinstance(adapter, HTTPAdapter):
+                    for key in list(adapter.poolmanager.pools.keys()):
+                        pool = adapter.poolmanager.pools.get(key)
+                        if pool is not None:
+                            num_requests += pool.num_requests
+                            num_connections += pool.num_connections
+        return {
+            'requests': num_requests,
+            'connections': num_connections,
+            'reused': max(num_requests - num_connections, 0),
+        }
+
+    def api_get(self, endpoint: str, timeout: float | tuple[float, float] | None = None) -> dict:
+        if self.instrumentation.enabled:
+            return self._instrumented_api_get(endpoint, timeout)
+
+        resp = self._request(endpoint, timeout)
         resp.raise_for_status()
 
         return resp.json()
 
+    def _instrumented_api_get(self, endpoint: str, timeout: float | tuple[float, float] | None) -> dict:
+        instrumentation = self.instrumentation
+        labels = {'endpoint': endpoint_template(endpoint)}
+        with instrumentation.span(API_GET_SPAN, labels):
+            start = time.perf_counter()
+            try:
+                resp = self._request(endpoint, timeout)
+            finally:
+                instrumentation.observe(REQUEST_SECONDS, time.perf_counter() - start, labels)
+            instrumentation.increment(RESPONSE_BYTES, len(resp.content), labels)
+            resp.raise_for_status()
+
+            return resp.json()
+
+    def api_get_stream(self, endpoint: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[Any]:
+        # Yields the elements of an endpoint's JSON array as they arrive, so
+        # the whole response is never decoded at once. No span is opened,
+        # since the caller runs between elements.
+        instrumentation = self.instrumentation
+        start = time.perf_counter()
+        num_bytes = 0
+        try:
+            with self._request(endpoint, None, stream=True) as resp:
+                resp.raise_for_status()
+                decoder = JSONArrayDecoder()
+                for chunk in resp.iter_content(chunk_size):
+                    num_bytes += len(chunk)
+                    yield from decoder.feed(chunk)
+                decoder.close()
+        finally:
+            if instrumentation.enabled:
+                labels = {'endpoint': endpoint_template(endpoint)}
+                instrumentation.observe(REQUEST_SECONDS, time.perf_counter() - start, labels)
+                instrumentation.increment(RESPONSE_BYTES, num_bytes, labels)
+
+    def _request(self, endpoint: str, timeout: float | tuple[float, float] | None, stream: bool = False) -> requests.Response:
+        path = self._path_prefix() + endpoint
+        return self._get_session().get(
+            f'{self.host}{path}?access_token={self.access_token}',
+            timeout=timeout if timeout is not None else self.timeout,
+            stream=stream,
+        )
+
     def _path_prefix(self) -> str:
         if self.host == CLOUD_API_HOST:
             return f'/api/{self.hub_id}/apps/{self.app_id}'
@@ -61,6 +280,10 @@ class HubitatAPIClient():
         else:
             return self.api_get('/devices/all')
 
+    def iter_devices(self) -> Iterator[dict]:
+        # /devices/all one device at a time
+        return self.api_get_stream('/devices/all')
+
     def get_device(self, device_id: int) -> dict:
         return self.api_get_device_endpoint(device_id, '')
 
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from typing import Any
+from typing import AsyncIterator
+
+import aiohttp
+
+from hubitat_maker_api_client.api_client import CLOUD_API_HOST
+from hubitat_maker_api_client.api_client import DEFAULT_STREAM_CHUNK_SIZE
+from hubitat_maker_api_client.api_client import JSONArrayDecoder
+from hubitat_maker_api_client.api_client import DEFAULT_POOL_MAXSIZE
+from hubitat_maker_api_client.api_client import DEFAULT_TIMEOUT
+from hubitat_maker_api_client.constants import HSM_STATE_TO_ACTION
+from hubitat_maker_api_client.instrumentation import API_GET_SPAN
+from hubitat_maker_api_client.instrumentation import Instrumentation
+from hubitat_maker_api_client.instrumentation import NOOP_INSTRUMENTATION
+from hubitat_maker_api_client.instrumentation import REQUEST_SECONDS
+from hubitat_maker_api_client.instrumentation import RESPONSE_BYTES
+from hubitat_maker_api_client.instrumentation import endpoint_template
+
+
+DEFAULT_KEEPALIVE_TIMEOUT = 30.0
+
+
+def make_client_timeout(timeout: float | None) -> aiohttp.ClientTimeout:
+    # Like requests' timeout: a limit on connecting and on each read, not on
+    # the whole request, so a long streamed body doesn't time out
+    return aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+
+class AsyncHubitatAPIClient():
+    def __init__(
+        self,
+        app_id: str,
+        access_token: str,
+        host: str = CLOUD_API_HOST,
+        hub_id: str | None = None,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        instrumentation: Instrumentation = NOOP_INSTRUMENTATION,
+    ) -> None:
+        self.host = host
+        self.app_id = app_id
+        self.access_token = access_token
+        self.hub_id = hub_id
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.instrumentation = instrumentation
+
+        if host == CLOUD_API_HOST and not hub_id:
+            raise ValueError('hub_id required for Cloud API')
+
+        self._session: aiohttp.ClientSession | None = None
+        self._session_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> 'AsyncHubitatAPIClient':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        async with self._session_lock:
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        session = self._session
+        if session is None:
+            async with self._session_lock:
+                if self._session is None:
+                    self._session = self._make_session()
+                session = self._session
+        return session
+
+    def _make_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_maxsize,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=make_client_timeout(self.timeout),
+        )
+
+    async def api_get(self, endpoint: str, timeout: float | None = None) -> dict:
+        if self.instrumentation.enabled:
+            return await self._instrumented_api_get(endpoint, timeout)
+
+        path = self._path_prefix() + endpoint
+        session = await self._get_session()
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = make_client_timeout(timeout)
+        async with session.get(f'{self.host}{path}?access_token={self.access_token}', **kwargs) as resp:  # type: ignore
+            resp.raise_for_status()
+
+            return await resp.json(content_type=None)
+
+    async def _instrumented_api_get(self, endpoint: str, timeout: float | None) -> dict:
+        instrumentation = self.instrumentation
+        labels = {'endpoint': endpoint_template(endpoint)}
+        path = self._path_prefix() + endpoint
+        with instrumentation.span(API_GET_SPAN, labels):
+            session = await self._get_session()
+            kwargs = {}
+            if timeout is not None:
+                kwargs['timeout'] = make_client_timeout(timeout)
+            start = time.perf_counter()
+            try:
+                async with session.get(f'{self.host}{path}?access_token={self.access_token}', **kwargs) as resp:  # type: ignore
+                    body = await resp.read()
+            finally:
+                instrumentation.observe(REQUEST_SECONDS, time.perf_counter() - start, labels)
+            instrumentation.increment(RESPONSE_BYTES, len(body), labels)
+            resp.raise_for_status()
+
+            return await resp.json(content_type=None)
+
+    async def api_get_stream(self, endpoint: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> AsyncIterator[Any]:
+        # See HubitatAPIClient.api_get_stream
+        instrumentation = self.instrumentation
+        path = self._path_prefix() + endpoint
+        session = await self._get_session()
+        start = time.perf_counter()
+        num_bytes = 0
+        try:
+            async with session.get(f'{self.host}{path}?access_token={self.access_token}') as resp:
+                resp.raise_for_status()
+                decoder = JSONArrayDecoder()
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    num_bytes += len(chunk)
+                    for item in decoder.feed(chunk):
+                        yield item
+                decoder.close()
+        finally:
+            if instrumentation.enabled:
+                labels = {'endpoint': endpoint_template(endpoint)}
+                instrumentation.observe(REQUEST_SECONDS, time.perf_counter() - start, labels)
+                instrumentation.increment(RESPONSE_BYTES, num_bytes, labels)
+
+    def _path_prefix(self) -> str:
+        if self.host == CLOUD_API_HOST:
+            return f'/api/{self.hub_id}/apps/{self.app_id}'
+        else:
+            return f'/apps/api/{self.app_id}'
+
+    async def api_get_device_endpoint(self, device_id: int, endpoint: str) -> dict:
+        return await self.api_get(f'/devices/{device_id}{endpoint}')
+
+    async def get_modes(self) -> dict:
+        return await self.api_get('/modes')
+
+    async def set_mode(self, mode_id: int) -> None:
+        await self.api_get(f'/modes/{mode_id}')
+
+    async def get_hsm(self) -> dict:
+        return await self.api_get('/hsm')
+
+    async def set_hsm(self, hsm_state: str) -> None:
+        await self.send_hsm_command(HSM_STATE_TO_ACTION[hsm_state])
+
+    async def send_hsm_command(self, command: str) -> None:
+        await self.api_get(f'/hsm/{command}')
+
+    async def get_devices(self, brief: bool = False):
+        if brief:
+            return await self.api_get('/devices')
+        else:
+            return await self.api_get('/devices/all')
+
+    def iter_devices(self) -> AsyncIterator[dict]:
+        return self.api_get_stream('/devices/all')
+
+    async def get_device(self, device_id: int) -> dict:
+        return await self.api_get_device_endpoint(device_id, '')
+
+    async def get_device_events(self, device_id: int) -> dict:
+        return await self.api_get_device_endpoint(device_id, '/events')
+
+    async def get_device_commands(self, device_id: int) -> dict:
+        return await self.api_get_device_endpoint(device_id, '/commands')
+
+    async def get_device_capabilities(self, device_id: int) -> dict:
+        return await self.api_get_device_endpoint(device_id, '/capabilities')
+
+    async def send_device_command(self, device_id: int, command: str, *secondary_values) -> dict:
+        secondary_values_str = ','.join([str(v) for v in secondary_values])
+        if secondary_values_str:
+            return await self.api_get_device_endpoint(device_id, '/' + command + '/' + secondary_values_str)
+        else:
+            return await self.api_get_device_endpoint(device_id, '/' + command)
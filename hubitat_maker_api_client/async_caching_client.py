@@ -0,0 +1,315 @@
+import asyncio
+import threading
+import time
+from itertools import chain
+from typing import Any
+from typing import Callable
+from typing import TYPE_CHECKING
+
+from hubitat_maker_api_client.async_api_client import AsyncHubitatAPIClient
+from hubitat_maker_api_client.async_client import AsyncHubitatClient
+from hubitat_maker_api_client.caching_client import ACCESSOR_ATTR_INDEX
+from hubitat_maker_api_client.caching_client import ATTR_KEY_TO_CAPABILITY
+from hubitat_maker_api_client.caching_client import CachedDevice
+from hubitat_maker_api_client.caching_client import cached_devices_to_cache_mutations
+from hubitat_maker_api_client.caching_client import cached_devices_to_identity_snapshot
+from hubitat_maker_api_client.caching_client import coalesce_hubitat_events
+from hubitat_maker_api_client.caching_client import get_event_capabilities
+from hubitat_maker_api_client.caching_client import hubitat_event_to_cache_mutations
+from hubitat_maker_api_client.caching_client import location_to_cache_mutations
+from hubitat_maker_api_client.caching_client import reconcile_cache_mutations
+from hubitat_maker_api_client.caching_client import reconcile_location_mutations
+from hubitat_maker_api_client.caching_client import to_cached_device
+from hubitat_maker_api_client.capabilities import CapabilityAttrKey
+from hubitat_maker_api_client.capabilities import CapabilityName
+from hubitat_maker_api_client.client import AttrPredicate
+from hubitat_maker_api_client.client import DEFAULT_MAX_COMMAND_CONCURRENCY
+from hubitat_maker_api_client.client import DeviceAlias
+from hubitat_maker_api_client.client import DeviceSnapshot
+from hubitat_maker_api_client.client import RoomName
+from hubitat_maker_api_client.client import intersect_smallest_first
+from hubitat_maker_api_client.client import is_in_range
+from hubitat_maker_api_client.client import to_number
+from hubitat_maker_api_client.device_cache import DeviceCache
+from hubitat_maker_api_client.device_cache import DeviceCacheMutation
+from hubitat_maker_api_client.event_socket import HubitatEvent
+from hubitat_maker_api_client.instrumentation import APPLY_EVENTS_SPAN
+from hubitat_maker_api_client.instrumentation import LOAD_CACHE_SECONDS
+from hubitat_maker_api_client.instrumentation import LOAD_CACHE_SPAN
+from hubitat_maker_api_client.instrumentation import record_events_applied
+
+if TYPE_CHECKING:
+    from hubitat_maker_api_client.telemetry import TelemetryStore
+
+
+class AsyncHubitatCachingClient(AsyncHubitatClient):
+    # Unlike HubitatCachingClient, the cache can't be loaded from __init__, so
+    # callers must await load_cache() (or use create()) before reading.
+    #
+    # A blocking cache, such as RedisDeviceCache, is only called from worker
+    # threads so its network round trips never stall the event loop.
+    # update_from_hubitat_event() and update_from_hubitat_events() are not
+    # coroutines and write to the cache directly; with a blocking cache, call
+    # them through asyncio.to_thread(). As in HubitatCachingClient,
+    # _cache_generation_lock keeps them from interleaving with a rebuild.
+
+    def __init__(
+        self,
+        api_client: AsyncHubitatAPIClient,
+        device_cache: DeviceCache,
+        alias_key: str = 'label',
+        event_key: str = 'device_label',
+        cache_writes_enabled: bool = True,
+        max_command_concurrency: int = DEFAULT_MAX_COMMAND_CONCURRENCY,
+        telemetry_store: 'TelemetryStore | None' = None,
+    ):
+        super(AsyncHubitatCachingClient, self).__init__(api_client, alias_key, max_command_concurrency)
+        self.device_cache = device_cache
+        self.event_key = event_key
+        self.cache_writes_enabled = cache_writes_enabled
+        self.telemetry_store = telemetry_store
+        self._cache_generation_lock = threading.Lock()
+        self._events_during_rebuild: list[HubitatEvent] | None = None
+        self.accessor_attr_index = ACCESSOR_ATTR_INDEX
+        self._device_id_to_capabilities: dict[int, set[CapabilityName]] = {}
+        self._cached_devices: list[CachedDevice] | None = None
+
+    @classmethod
+    async def create(
+        cls,
+        api_client: AsyncHubitatAPIClient,
+        device_cache: DeviceCache,
+        alias_key: str = 'label',
+        event_key: str = 'device_label',
+        cache_writes_enabled: bool = True,
+        max_command_concurrency: int = DEFAULT_MAX_COMMAND_CONCURRENCY,
+        telemetry_store: 'TelemetryStore | None' = None,
+    ) -> 'AsyncHubitatCachingClient':
+        client = cls(api_client, device_cache, alias_key, event_key, cache_writes_enabled, max_command_concurrency, telemetry_store)
+        if client.cache_writes_enabled:
+            await client._call_cache(client.device_cache.clear)
+            await client.load_cache()
+        return client
+
+    async def _call_cache(self, func: Callable, *args: Any) -> Any:
+        if self.device_cache.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def register_accessor_attr(self, capability: CapabilityName, attr_key: CapabilityAttrKey, attr_value: str) -> None:
+        k = (capability, attr_key)
+        values = self.accessor_attr_index.get(k, ())
+        if attr_value not in values:
+            self.accessor_attr_index = {**self.accessor_attr_index, k: values + (attr_value,)}
+
+    async def load_cache(self) -> None:
+        cached_devices = await self._load_cache_into(self.device_cache)
+        self._set_cached_devices(cached_devices, cached_devices_to_identity_snapshot(cached_devices, self.alias_key))
+
+    async def _load_cache_into(self, device_cache: DeviceCache) -> list[CachedDevice]:
+        instrumentation = self.api_client.instrumentation
+        with instrumentation.span(LOAD_CACHE_SPAN):
+            start = time.perf_counter()
+            mode, hsm, cached_devices = await asyncio.gather(
+                self._get_mode_from_api(),
+                self._get_hsm_from_api(),
+                self._fetch_cached_devices(),
+            )
+
+            await self._call_cache(
+                device_cache.apply_mutations,
+                chain(location_to_cache_mutations(mode, hsm), cached_devices_to_cache_mutations(cached_devices)),
+            )
+            instrumentation.observe(LOAD_CACHE_SECONDS, time.perf_counter() - start)
+        return cached_devices
+
+    async def _fetch_cached_devices(self) -> list[CachedDevice]:
+        return [to_cached_device(device, self.alias_key) async for device in self.api_client.iter_devices()]
+
+    async def _refresh_identity_snapshot_from_all_devices(self) -> DeviceSnapshot:
+        snapshot = cached_devices_to_identity_snapshot(await self._fetch_cached_devices(), self.alias_key)
+        self._identity_snapshot = snapshot
+        return snapshot
+
+    def _set_cached_devices(self, cached_devices: list[CachedDevice], identity_snapshot: DeviceSnapshot) -> None:
+        self._cached_devices = cached_devices
+        self._device_id_to_capabilities = identity_snapshot.device_id_to_capabilities
+        self._identity_snapshot = identity_snapshot
+
+    def _event_to_cache_mutations(
+        self,
+        event: HubitatEvent,
+        device_cache: DeviceCache,
+        device_id_to_capabilities: dict[int, set[CapabilityName]],
+    ) -> list[DeviceCacheMutation]:
+        return hubitat_event_to_cache_mutations(
+            get_event_capabilities(device_id_to_capabilities, device_cache, event),
+            event,
+            self.event_key,
+            self.accessor_attr_index,
+        )
+
+    async def rebuild_cache(self) -> None:
+        try:
+            generation = await self._call_cache(self.device_cache.new_generation)
+        except NotImplementedError:
+            await self._call_cache(self.device_cache.clear)
+            await self.load_cache()
+            return
+
+        with self._cache_generation_lock:
+            self._events_during_rebuild = []
+        try:
+            cached_devices = await self._load_cache_into(generation)
+            identity_snapshot = cached_devices_to_identity_snapshot(cached_devices, self.alias_key)
+            await self._call_cache(self._swap_in_generation, generation, cached_devices, identity_snapshot)
+        except BaseException:
+            await self._call_cache(generation.clear)
+            raise
+        finally:
+            with self._cache_generation_lock:
+                self._events_during_rebuild = None
+
+    def _swap_in_generation(self, generation: DeviceCache, cached_devices: list[CachedDevice], identity_snapshot: DeviceSnapshot) -> None:
+        with self._cache_generation_lock:
+            for event in self._events_during_rebuild or []:
+                generation.apply_mutations(self._event_to_cache_mutations(event, generation, identity_snapshot.device_id_to_capabilities))
+            self.device_cache.swap_generation(generation)
+            self._set_cached_devices(cached_devices, identity_snapshot)
+
+    async def reconcile(self) -> None:
+        # Writes only what differs from a fresh /devices/all; see
+        # HubitatCachingClient.reconcile
+        if self._cached_devices is None:
+            await self.rebuild_cache()
+            return
+
+        with self._cache_generation_lock:
+            self._events_during_rebuild = []
+        try:
+            mode, hsm, cached_devices = await asyncio.gather(
+                self._get_mode_from_api(),
+                self._get_hsm_from_api(),
+                self._fetch_cached_devices(),
+            )
+            identity_snapshot = cached_devices_to_identity_snapshot(cached_devices, self.alias_key)
+            await self._call_cache(self._apply_reconcile, mode, hsm, cached_devices, identity_snapshot)
+        finally:
+            with self._cache_generation_lock:
+                self._events_during_rebuild = None
+
+    def _apply_reconcile(self, mode: str | None, hsm: str | None, cached_devices: list[CachedDevice], identity_snapshot: DeviceSnapshot) -> None:
+        assert self._cached_devices is not None
+        with self._cache_generation_lock:
+            mutations = reconcile_location_mutations(self.device_cache, mode, hsm)
+            mutations += reconcile_cache_mutations(self.device_cache, self._cached_devices, cached_devices)
+            for event in self._events_during_rebuild or []:
+                mutations += self._event_to_cache_mutations(event, self.device_cache, identity_snapshot.device_id_to_capabilities)
+            self.device_cache.apply_mutations(mutations)
+            self._set_cached_devices(cached_devices, identity_snapshot)
+
+    async def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
+        return await self._call_cache(self.device_cache.get_devices_by_capability, capability)
+
+    async def get_devices_by_capability_and_room(self, capability: CapabilityName, room: RoomName | None) -> set[DeviceAlias]:
+        return await self._call_cache(self.device_cache.get_devices_by_capability_and_room, capability, room)
+
+    async def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: CapabilityAttrKey, attr_value: str) -> set[DeviceAlias]:
+        return await self._call_cache(self.device_cache.get_devices_by_capability_and_attribute, capability, attr_key, attr_value)
+
+    async def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: CapabilityAttrKey, lo: float | None = None, hi: float | None = None) -> set[DeviceAlias]:
+        return await self._call_cache(self._get_devices_by_attribute_range, capability, attr_key, lo, hi)
+
+    def _get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: CapabilityAttrKey, lo: float | None, hi: float | None) -> set[DeviceAlias]:
+        try:
+            return self.device_cache.get_devices_by_attribute_range(capability, attr_key, lo, hi)
+        except NotImplementedError:
+            return {
+                alias for alias in self.device_cache.get_devices_by_capability(capability)
+                if is_in_range(to_number(self.device_cache.get_last_device_attr_value(capability, alias, attr_key)), lo, hi)
+            }
+
+    async def query(self, capability: CapabilityName, room: RoomName | None = None, attrs: dict[str, AttrPredicate] | None = None) -> set[DeviceAlias]:
+        alias_sets = []
+        if room is not None:
+            alias_sets.append(await self.get_devices_by_capability_and_room(capability, room))
+        for attr_key, predicate in (attrs or {}).items():
+            if isinstance(predicate, tuple):
+                alias_sets.append(await self.get_devices_by_attribute_range(capability, CapabilityAttrKey(attr_key), *predicate))
+            else:
+                alias_sets.append(await self.get_devices_by_capability_and_attribute(capability, CapabilityAttrKey(attr_key), predicate))
+        if not alias_sets:
+            return await self.get_devices_by_capability(capability)
+        return intersect_smallest_first(alias_sets)
+
+    async def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
+        return await self._call_cache(self.device_cache.get_capabilities_for_device_id, device_id)
+
+    # Device accessors
+
+    async def get_mode(self) -> str | None:
+        return await self._call_cache(self.device_cache.get_last_device_attr_value, None, DeviceAlias('Home'), 'mode')
+
+    async def get_hsm(self) -> str | None:
+        return await self._call_cache(self.device_cache.get_last_device_attr_value, None, DeviceAlias('Home'), 'hsmStatus')
+
+    async def get_last_device_value(self, alias: DeviceAlias, attr_key: CapabilityAttrKey, capability: CapabilityName | None = None) -> str | None:
+        if not capability:
+            capability = ATTR_KEY_TO_CAPABILITY.get(attr_key)
+        return await self._call_cache(self.device_cache.get_last_device_attr_value, capability, alias, attr_key)
+
+    async def get_last_device_timestamp(self, alias: DeviceAlias, attr_key: CapabilityAttrKey, attr_value: str, capability: CapabilityName | None = None) -> int | None:
+        if not capability:
+            capability = ATTR_KEY_TO_CAPABILITY.get(attr_key)
+        return await self._call_cache(self.device_cache.get_last_device_attr_timestamp, capability, alias, attr_key, attr_value)
+
+    def update_from_hubitat_event(self, event: HubitatEvent) -> None:
+        if not self.cache_writes_enabled:
+            return
+
+        instrumentation = self.api_client.instrumentation
+        if instrumentation.enabled:
+            with instrumentation.span(APPLY_EVENTS_SPAN, {'events': 1}):
+                start = time.perf_counter()
+                self._apply_hubitat_event(event)
+                record_events_applied(instrumentation, [event], start)
+        else:
+            self._apply_hubitat_event(event)
+
+    def _apply_hubitat_event(self, event: HubitatEvent) -> None:
+        if self.telemetry_store is not None:
+            self.telemetry_store.record_event(getattr(event, self.event_key), event)
+
+        with self._cache_generation_lock:
+            if self._events_during_rebuild is not None:
+                self._events_during_rebuild.append(event)
+            self.device_cache.apply_mutations(
+                self._event_to_cache_mutations(event, self.device_cache, self._device_id_to_capabilities)
+            )
+
+    def update_from_hubitat_events(self, events: list[HubitatEvent]) -> None:
+        if not self.cache_writes_enabled:
+            return
+
+        instrumentation = self.api_client.instrumentation
+        if instrumentation.enabled:
+            with instrumentation.span(APPLY_EVENTS_SPAN, {'events': len(events)}):
+                start = time.perf_counter()
+                self._apply_hubitat_events(events)
+                record_events_applied(instrumentation, events, start)
+        else:
+            self._apply_hubitat_events(events)
+
+    def _apply_hubitat_events(self, events: list[HubitatEvent]) -> None:
+        if self.telemetry_store is not None:
+            for event in events:
+                self.telemetry_store.record_event(getattr(event, self.event_key), event)
+
+        events = coalesce_hubitat_events(events)
+        with self._cache_generation_lock:
+            if self._events_during_rebuild is not None:
+                self._events_during_rebuild.extend(events)
+            mutations: list[DeviceCacheMutation] = []
+            for event in events:
+                mutations += self._event_to_cache_mutations(event, self.device_cache, self._device_id_to_capabilities)
+            self.device_cache.apply_mutations(mutations)
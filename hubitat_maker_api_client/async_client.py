@@ -0,0 +1,440 @@
+import asyncio
+import time
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+
+from hubitat_maker_api_client.async_api_client import AsyncHubitatAPIClient
+from hubitat_maker_api_client.capabilities import CapabilityAttrKey
+from hubitat_maker_api_client.capabilities import CapabilityName
+from hubitat_maker_api_client.capabilities import ContactSensorCapability
+from hubitat_maker_api_client.capabilities import DoorControlCapability
+from hubitat_maker_api_client.capabilities import IlluminanceMeasurementCapability
+from hubitat_maker_api_client.capabilities import LockCapability
+from hubitat_maker_api_client.capabilities import MotionSensorCapability
+from hubitat_maker_api_client.capabilities import PresenceSensorCapability
+from hubitat_maker_api_client.capabilities import SpeechSynthesisCapability
+from hubitat_maker_api_client.capabilities import SwitchCapability
+from hubitat_maker_api_client.capabilities import supported_capabilities
+from hubitat_maker_api_client.client import AttrPredicate
+from hubitat_maker_api_client.client import DEFAULT_ATTRIBUTES_TTL
+from hubitat_maker_api_client.client import DEFAULT_DEVICE_ATTRIBUTES_TTL
+from hubitat_maker_api_client.client import DEFAULT_IDENTITY_TTL
+from hubitat_maker_api_client.client import DEFAULT_MAX_COMMAND_CONCURRENCY
+from hubitat_maker_api_client.client import DEFAULT_RESYNC_INTERVAL
+from hubitat_maker_api_client.client import DeviceAlias
+from hubitat_maker_api_client.client import DeviceCommand
+from hubitat_maker_api_client.client import DeviceCommandResult
+from hubitat_maker_api_client.client import DeviceSnapshot
+from hubitat_maker_api_client.client import RoomName
+from hubitat_maker_api_client.client import attr_matches
+from hubitat_maker_api_client.client import device_attributes_from_device
+from hubitat_maker_api_client.client import get_alias_set
+from hubitat_maker_api_client.client import is_in_range
+from hubitat_maker_api_client.client import resolve_device_command
+from hubitat_maker_api_client.client import resolve_device_id
+from hubitat_maker_api_client.client import to_number
+from hubitat_maker_api_client.event_socket import HubitatEvent
+from hubitat_maker_api_client.instrumentation import record_cache_lookup
+
+
+class AsyncHubitatClient():
+    def __init__(
+        self,
+        api_client: AsyncHubitatAPIClient,
+        alias_key: str = 'label',
+        max_command_concurrency: int = DEFAULT_MAX_COMMAND_CONCURRENCY,
+        identity_ttl: float = DEFAULT_IDENTITY_TTL,
+        attributes_ttl: float = DEFAULT_ATTRIBUTES_TTL,
+        resync_interval: float = DEFAULT_RESYNC_INTERVAL,
+        device_attributes_ttl: float = DEFAULT_DEVICE_ATTRIBUTES_TTL,
+    ):
+        self.api_client = api_client
+        self.alias_key = alias_key
+        self.max_command_concurrency = max_command_concurrency
+        self.identity_ttl = identity_ttl
+        self.attributes_ttl = attributes_ttl
+        self.resync_interval = resync_interval
+        self.device_attributes_ttl = device_attributes_ttl
+        self._device_snapshot: DeviceSnapshot | None = None
+        self._identity_snapshot: DeviceSnapshot | None = None
+        self._device_snapshot_lock = asyncio.Lock()
+        self._brief_devices_have_capabilities: bool | None = None
+        self._events_during_refresh: list[HubitatEvent] | None = None
+        self._events_enabled = False
+        self._resync_needed = False
+        self._ttl_cache: dict[str, tuple[float, Any]] = {}
+        self._ttl_cache_locks: dict[str, asyncio.Lock] = {}
+
+    async def _get_with_ttl(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        # Concurrent callers share a single in-flight fetch per key
+        hit = True
+        cached = self._ttl_cache.get(key)
+        if cached and time.monotonic() - cached[0] < ttl:
+            value = cached[1]
+        else:
+            lock = self._ttl_cache_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                cached = self._ttl_cache.get(key)
+                if cached and time.monotonic() - cached[0] < ttl:
+                    value = cached[1]
+                else:
+                    hit = False
+                    value = await fetch()
+                    self._ttl_cache[key] = (time.monotonic(), value)
+        if self.api_client.instrumentation.enabled:
+            # Keys are <cache>/<id> or just <cache>
+            record_cache_lookup(self.api_client.instrumentation, key.partition('/')[0], hit)
+        return value
+
+    async def _get_device_snapshot(self, max_age: float) -> DeviceSnapshot:
+        # Concurrent callers share a single in-flight /devices/all fetch
+        hit = True
+        snapshot = self._device_snapshot
+        if snapshot is None or snapshot.age() >= max_age:
+            async with self._device_snapshot_lock:
+                snapshot = self._device_snapshot
+                if snapshot is None or snapshot.age() >= max_age:
+                    hit = False
+                    snapshot = await self._refresh_device_snapshot()
+        if self.api_client.instrumentation.enabled:
+            record_cache_lookup(self.api_client.instrumentation, 'device_snapshot', hit)
+        return snapshot
+
+    async def _get_identity_snapshot(self) -> DeviceSnapshot:
+        hit = True
+        snapshot = self._identity_snapshot
+        if snapshot is None or snapshot.age() >= self.identity_ttl:
+            async with self._device_snapshot_lock:
+                snapshot = self._identity_snapshot
+                if snapshot is None or snapshot.age() >= self.identity_ttl:
+                    hit = False
+                    snapshot = await self._refresh_identity_snapshot()
+        if self.api_client.instrumentation.enabled:
+            record_cache_lookup(self.api_client.instrumentation, 'identity_snapshot', hit)
+        return snapshot
+
+    async def refresh_identity_snapshot(self) -> DeviceSnapshot:
+        async with self._device_snapshot_lock:
+            return await self._refresh_identity_snapshot()
+
+    async def _refresh_identity_snapshot(self) -> DeviceSnapshot:
+        # See HubitatClient.refresh_identity_snapshot
+        if self._brief_devices_have_capabilities is not False:
+            devices = await self.api_client.get_devices(brief=True)
+            self._brief_devices_have_capabilities = isinstance(devices, list) and all('capabilities' in device for device in devices)
+            if self._brief_devices_have_capabilities:
+                snapshot = DeviceSnapshot(devices, self.alias_key)
+                self._identity_snapshot = snapshot
+                return snapshot
+        return await self._refresh_identity_snapshot_from_all_devices()
+
+    async def _refresh_identity_snapshot_from_all_devices(self) -> DeviceSnapshot:
+        return await self._refresh_device_snapshot()
+
+    async def refresh_device_snapshot(self) -> DeviceSnapshot:
+        # See HubitatClient.refresh_device_snapshot
+        async with self._device_snapshot_lock:
+            return await self._refresh_device_snapshot()
+
+    async def _refresh_device_snapshot(self) -> DeviceSnapshot:
+        self._events_during_refresh = []
+        try:
+            snapshot = DeviceSnapshot((), self.alias_key)
+            async for device in self.api_client.iter_devices():
+                snapshot.add_device(device)
+        finally:
+            events, self._events_during_refresh = self._events_during_refresh, None
+
+        for event in events or []:
+            snapshot.apply_event(event)
+        self._device_snapshot = snapshot
+        self._identity_snapshot = snapshot
+        self._resync_needed = False
+        return snapshot
+
+    def invalidate_device_snapshot(self) -> None:
+        self._device_snapshot = None
+        self._identity_snapshot = None
+
+    async def _get_capability_to_alias_to_device_ids(self) -> dict[CapabilityName, dict[DeviceAlias, list[int]]]:
+        return (await self._get_identity_snapshot()).capability_to_alias_to_device_ids
+
+    async def _get_capability_to_room_to_aliases(self) -> dict[CapabilityName, dict[RoomName | None, set[DeviceAlias]]]:
+        return (await self._get_identity_snapshot()).capability_to_room_to_aliases
+
+    async def _get_mode_name_to_id(self) -> dict[str, int]:
+        async def fetch():
+            return {
+                mode['name']: mode['id']
+                for mode in await self.api_client.get_modes()
+            }
+        return await self._get_with_ttl('mode_name_to_id', 86400, fetch)
+
+    async def _get_capability_to_alias_to_attributes(self) -> dict[CapabilityName, dict[DeviceAlias, dict[str, Any]]]:
+        if self._events_enabled:
+            return (await self._get_device_snapshot(0 if self._resync_needed else self.resync_interval)).capability_to_alias_to_attributes
+        return await self._get_capability_to_alias_to_attributes_from_api()
+
+    async def _get_capability_to_alias_to_attributes_from_api(self) -> dict[CapabilityName, dict[DeviceAlias, dict[str, Any]]]:
+        return (await self._get_device_snapshot(self.attributes_ttl)).capability_to_alias_to_attributes
+
+    def _get_alias_set(self, alias_list: list[DeviceAlias]) -> set[DeviceAlias]:
+        return get_alias_set(alias_list, self.alias_key)
+
+    # Events
+    def update_from_hubitat_event(self, event: HubitatEvent) -> None:
+        if event.device_id is None:
+            return
+
+        self._events_enabled = True
+        if self._events_during_refresh is not None:
+            self._events_during_refresh.append(event)
+        cached = self._ttl_cache.get(f'device_attributes/{event.device_id}')
+        if cached is not None:
+            cached[1][event.attr_key] = event.attr_value
+        snapshot = self._device_snapshot
+        if snapshot is not None and not snapshot.apply_event(event):
+            self._resync_needed = True
+
+    def update_from_hubitat_events(self, events: list[HubitatEvent]) -> None:
+        for event in events:
+            self.update_from_hubitat_event(event)
+
+    def mark_event_gap(self) -> None:
+        self._resync_needed = True
+
+    async def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
+        alias_to_device_ids = (await self._get_capability_to_alias_to_device_ids()).get(capability, {})
+        aliases = list(alias_to_device_ids.keys())
+        return self._get_alias_set(aliases)
+
+    async def get_devices_by_capability_and_room(self, capability: CapabilityName, room: RoomName | None) -> set[DeviceAlias]:
+        return (await self._get_capability_to_room_to_aliases())[capability][room]
+
+    async def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: CapabilityAttrKey, attr_value: str) -> set[DeviceAlias]:
+        aliases = []
+        for alias, attributes in (await self._get_capability_to_alias_to_attributes())[capability].items():
+            if attributes[attr_key] == attr_value:
+                aliases.append(alias)
+        return self._get_alias_set(aliases)
+
+    async def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: CapabilityAttrKey, lo: float | None = None, hi: float | None = None) -> set[DeviceAlias]:
+        aliases = []
+        for alias, attributes in (await self._get_capability_to_alias_to_attributes())[capability].items():
+            if is_in_range(to_number(attributes.get(attr_key)), lo, hi):
+                aliases.append(alias)
+        return self._get_alias_set(aliases)
+
+    async def query(self, capability: CapabilityName, room: RoomName | None = None, attrs: dict[str, AttrPredicate] | None = None) -> set[DeviceAlias]:
+        alias_to_attributes = (await self._get_capability_to_alias_to_attributes()).get(capability, {})
+        if room is not None:
+            candidates: Any = (await self._get_capability_to_room_to_aliases()).get(capability, {}).get(room, set())
+        else:
+            candidates = alias_to_attributes.keys()
+        return {
+            alias for alias in candidates
+            if all(attr_matches(alias_to_attributes.get(alias, {}).get(k), p) for k, p in (attrs or {}).items())
+        }
+
+    async def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
+        return (await self._get_identity_snapshot()).device_id_to_capabilities.get(int(device_id), set())
+
+    async def get_device_attributes(self, alias: DeviceAlias, capability: CapabilityName | None = None) -> dict[str, Any]:
+        # Reads one device through /devices/{id} instead of /devices/all, with
+        # the alias resolved through the long-lived identity index
+        device_id = resolve_device_id(await self._get_capability_to_alias_to_device_ids(), alias, capability)
+        return await self._get_device_attributes_by_id(device_id)
+
+    async def get_device_attribute(self, alias: DeviceAlias, attr_key: str, capability: CapabilityName | None = None) -> Any:
+        return (await self.get_device_attributes(alias, capability)).get(attr_key)
+
+    async def _get_device_attributes_by_id(self, device_id: int) -> dict[str, Any]:
+        snapshot = self._device_snapshot
+        if self._events_enabled and not self._resync_needed and snapshot is not None and snapshot.age() < self.resync_interval:
+            # Events keep the snapshot current, so there is nothing to fetch
+            attributes = snapshot.device_id_to_attributes.get(device_id)
+            if attributes is not None:
+                return dict(attributes)
+
+        async def fetch() -> dict[str, Any]:
+            return device_attributes_from_device(await self.api_client.get_device(device_id))
+        return dict(await self._get_with_ttl(f'device_attributes/{device_id}', self.device_attributes_ttl, fetch))
+
+    async def _send_device_command_by_capability_and_alias(self, capability: CapabilityName, alias: DeviceAlias, command: str, *secondary_values) -> dict:
+        result = (await self.send_commands([(capability, alias, command, *secondary_values)]))[0]
+        if result.error:
+            raise result.error
+        return result.response  # type: ignore
+
+    async def send_commands(self, commands: list[DeviceCommand], max_concurrency: int | None = None) -> list[DeviceCommandResult]:
+        capability_to_alias_to_device_ids = await self._get_capability_to_alias_to_device_ids()
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_command_concurrency)
+
+        async def send(result: DeviceCommandResult, device_id: int | None) -> DeviceCommandResult:
+            if device_id is not None:
+                async with semaphore:
+                    try:
+                        result.response = await self.api_client.send_device_command(device_id, result.command, *result.secondary_values)
+                    except Exception as e:
+                        result.error = e
+                    # The command may have changed the device, so don't serve
+                    # its cached attributes
+                    self._ttl_cache.pop(f'device_attributes/{device_id}', None)
+            return result
+
+        return await asyncio.gather(*[
+            send(*resolve_device_command(capability_to_alias_to_device_ids, command))
+            for command in commands
+        ])
+
+    # Capabilities
+    async def get_capabilities(self, supported_only: bool = True) -> set[CapabilityName]:
+        all_capabilities = set((await self._get_capability_to_alias_to_device_ids()).keys())
+        if supported_only:
+            return all_capabilities & {c.name for c in supported_capabilities()}
+        else:
+            return all_capabilities
+
+    # Rooms
+    async def get_rooms(self) -> set[RoomName]:
+        return {
+            room
+            for room_to_aliases in (await self._get_capability_to_room_to_aliases()).values()
+            for room in room_to_aliases.keys()
+            if room
+        }
+
+    # Mode
+    async def get_mode(self) -> str | None:
+        return await self._get_mode_from_api()
+
+    async def _get_mode_from_api(self) -> str | None:
+        for mode in await self.api_client.get_modes():
+            if mode['active']:
+                return mode['name']
+        return None
+
+    async def set_mode(self, mode_name: str) -> None:
+        mode_id = (await self._get_mode_name_to_id())[mode_name]
+        await self.api_client.set_mode(mode_id)
+
+    # HSM (Hubitat Security Monitor)
+    async def get_hsm(self) -> str | None:
+        return await self._get_hsm_from_api()
+
+    async def _get_hsm_from_api(self) -> str:
+        return (await self.api_client.get_hsm())['hsm']
+
+    async def set_hsm(self, hsm_state: str) -> None:
+        await self.api_client.set_hsm(hsm_state)
+
+    async def send_hsm_command(self, command: str) -> None:
+        await self.api_client.send_hsm_command(command)
+
+    # Device accessors
+    async def get_contact_sensors(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability(ContactSensorCapability.name)
+
+    async def get_door_controls(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability(DoorControlCapability.name)
+
+    async def get_locks(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability(LockCapability.name)
+
+    async def get_motion_sensors(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability(MotionSensorCapability.name)
+
+    async def get_switches(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability(SwitchCapability.name)
+
+    async def get_users(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability(PresenceSensorCapability.name)
+
+    # Device accessors with attribute filters
+    async def get_open_doors(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability_and_attribute(ContactSensorCapability.name, CapabilityAttrKey('contact'), 'open')
+
+    async def get_unlocked_doors(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability_and_attribute(LockCapability.name, CapabilityAttrKey('lock'), 'unlocked')
+
+    async def get_active_motion(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability_and_attribute(MotionSensorCapability.name, CapabilityAttrKey('motion'), 'active')
+
+    async def get_on_switches(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability_and_attribute(SwitchCapability.name, CapabilityAttrKey('switch'), 'on')
+
+    async def get_present_users(self) -> set[DeviceAlias]:
+        return await self.get_devices_by_capability_and_attribute(PresenceSensorCapability.name, CapabilityAttrKey('presence'), 'present')
+
+    # Device commands
+    async def open_door(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(DoorControlCapability.name, alias, 'open')
+
+    async def close_door(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(DoorControlCapability.name, alias, 'close')
+
+    async def lock_door(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(LockCapability.name, alias, 'lock')
+
+    async def unlock_door(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(LockCapability.name, alias, 'unlock')
+
+    async def turn_on_switch(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SwitchCapability.name, alias, 'on')
+
+    async def turn_off_switch(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SwitchCapability.name, alias, 'off')
+
+    async def turn_on_switches(self, aliases: set[DeviceAlias]) -> list[DeviceCommandResult]:
+        return await self.send_commands([(SwitchCapability.name, alias, 'on') for alias in aliases])
+
+    async def turn_off_switches(self, aliases: set[DeviceAlias]) -> list[DeviceCommandResult]:
+        return await self.send_commands([(SwitchCapability.name, alias, 'off') for alias in aliases])
+
+    async def arrived(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(PresenceSensorCapability.name, alias, 'arrived')
+
+    async def departed(self, alias: DeviceAlias) -> dict:
+        return await self._send_device_command_by_capability_and_alias(PresenceSensorCapability.name, alias, 'departed')
+
+    async def set_lux(self, alias: DeviceAlias, lux: int) -> dict:
+        return await self._send_device_command_by_capability_and_alias(IlluminanceMeasurementCapability.name, alias, 'setLux', lux)
+
+    # Echo speaks
+    async def echo_set_volume_and_speak(self, alias: DeviceAlias, volume: int, message: str) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SpeechSynthesisCapability.name, alias, 'setVolumeAndSpeak', volume, message)
+
+    async def echo_voice_cmd_as_text(self, alias: DeviceAlias, message: str) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SpeechSynthesisCapability.name, alias, 'voiceCmdAsText', message)
+
+    async def echo_parallel_speak(self, alias: DeviceAlias, message: str) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SpeechSynthesisCapability.name, alias, 'parallelSpeak', message)
+
+    async def echo_set_volume_speak_and_restore(self, alias: DeviceAlias, volume: int, message: str, restore_volume: int) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SpeechSynthesisCapability.name, alias, 'setVolumeSpeakAndRestore', volume, message, restore_volume)
+
+    async def echo_play_announcement(self, alias: DeviceAlias, message: str) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SpeechSynthesisCapability.name, alias, 'playAnnouncement', message)
+
+    async def echo_play_announcement_all(self, alias: DeviceAlias, message: str) -> dict:
+        return await self._send_device_command_by_capability_and_alias(SpeechSynthesisCapability.name, alias, 'playAnnouncementAll', message)
+
+    # Intercom
+    async def get_intercom_rooms(self) -> set[RoomName]:
+        return set([
+            k for k in
+            (await self._get_capability_to_room_to_aliases())[SpeechSynthesisCapability.name].keys()
+            if k
+        ])
+
+    async def intercom_speak(self, room: RoomName, message: str, chime_before_message: bool = False) -> None:
+        message = message.replace(',', '...')  # Echo speaks can't handle commas well
+        command = 'playAnnouncement' if chime_before_message else 'parallelSpeak'
+        results = await self.send_commands([
+            (SpeechSynthesisCapability.name, echo, command, message)
+            for echo in await self.get_devices_by_capability_and_room(SpeechSynthesisCapability.name, room)
+        ])
+        for result in results:
+            if result.error:
+                raise result.error
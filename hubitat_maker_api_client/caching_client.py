@@ -1,4 +1,13 @@
+import os
+import threading
+import time
 from datetime import datetime
+from itertools import chain
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import NamedTuple
+from typing import TYPE_CHECKING
 
 from hubitat_maker_api_client.api_client import HubitatAPIClient
 from hubitat_maker_api_client.capabilities import CapabilityAttrKey
@@ -11,11 +20,26 @@ from hubitat_maker_api_client.capabilities import MotionSensorCapability
 from hubitat_maker_api_client.capabilities import PowerMeterCapability
 from hubitat_maker_api_client.capabilities import PresenceSensorCapability
 from hubitat_maker_api_client.capabilities import SwitchCapability
+from hubitat_maker_api_client.client import AttrPredicate
+from hubitat_maker_api_client.client import DEFAULT_MAX_COMMAND_CONCURRENCY
 from hubitat_maker_api_client.client import DeviceAlias
+from hubitat_maker_api_client.client import DeviceSnapshot
 from hubitat_maker_api_client.client import HubitatClient
 from hubitat_maker_api_client.client import RoomName
+from hubitat_maker_api_client.client import UNSUPPORTED_ATTR_KEYS
+from hubitat_maker_api_client.client import intersect_smallest_first
+from hubitat_maker_api_client.client import is_in_range
+from hubitat_maker_api_client.client import to_number
 from hubitat_maker_api_client.device_cache import DeviceCache
+from hubitat_maker_api_client.device_cache import DeviceCacheMutation
 from hubitat_maker_api_client.event_socket import HubitatEvent
+from hubitat_maker_api_client.instrumentation import APPLY_EVENTS_SPAN
+from hubitat_maker_api_client.instrumentation import LOAD_CACHE_SECONDS
+from hubitat_maker_api_client.instrumentation import LOAD_CACHE_SPAN
+from hubitat_maker_api_client.instrumentation import record_events_applied
+
+if TYPE_CHECKING:
+    from hubitat_maker_api_client.telemetry import TelemetryStore
 
 
 ATTR_KEY_TO_CAPABILITY = {
@@ -40,7 +64,22 @@ SUPPORTED_ACCESSOR_ATTRS = [
 ]
 
 
-UNSUPPORTED_ATTR_KEYS = ['dataType', 'values']
+# (capability, attr_key) -> the attr_values whose devices are indexed by
+# get_devices_by_capability_and_attribute, so an event can be dispatched
+# without scanning SUPPORTED_ACCESSOR_ATTRS
+AccessorAttrIndex = dict[tuple[CapabilityName, str], tuple[str, ...]]
+
+
+def make_accessor_attr_index(accessor_attrs: list[tuple[CapabilityName, str, str]]) -> AccessorAttrIndex:
+    index: AccessorAttrIndex = {}
+    for capability, attr_key, attr_value in accessor_attrs:
+        index[(capability, attr_key)] = index.get((capability, attr_key), ()) + (attr_value,)
+    return index
+
+
+ACCESSOR_ATTR_INDEX = make_accessor_attr_index(SUPPORTED_ACCESSOR_ATTRS)
+
+
 ATTR_KEYS_WITH_NUMERIC_VALS = [
     'battery',
     'illuminance',
@@ -50,12 +89,240 @@ ATTR_KEYS_WITH_NUMERIC_VALS = [
     'energy',
     'power',
 ]
+_NUMERIC_ATTR_KEYS = frozenset(ATTR_KEYS_WITH_NUMERIC_VALS)
 
 
 def date_to_timestamp(date_str: str) -> int:
     return int(datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S%z').timestamp())
 
 
+def location_to_cache_mutations(mode: str | None, hsm: str | None) -> list[DeviceCacheMutation]:
+    return [
+        ('set_last_device_attr_value', None, DeviceAlias('Home'), 'mode', mode),
+        ('set_last_device_attr_value', None, DeviceAlias('Home'), 'hsmStatus', hsm),
+    ]
+
+
+class CachedDevice(NamedTuple):
+    # The parts of a /devices/all device the cache is loaded from. A list of
+    # these is all a client keeps of the hub's devices between reconciles.
+    id: int
+    alias: DeviceAlias
+    room: RoomName | None
+    capabilities: tuple[CapabilityName, ...]
+    attributes: tuple[tuple[str, Any], ...]
+    timestamp: int | None
+
+
+def to_cached_device(device: dict, alias_key: str) -> CachedDevice:
+    return CachedDevice(
+        int(device['id']),
+        device[alias_key],
+        device.get('room'),
+        tuple(device['capabilities']),
+        tuple((k, v) for k, v in device.get('attributes', {}).items() if k not in UNSUPPORTED_ATTR_KEYS),
+        date_to_timestamp(device['date']) if device.get('date') else None,
+    )
+
+
+def cached_devices_to_identity_snapshot(cached_devices: Iterable[CachedDevice], alias_key: str) -> DeviceSnapshot:
+    # Commands resolve aliases to device ids, which the cache doesn't index,
+    # so caching clients keep these identity indexes; attribute values are
+    # left out since the cache serves them
+    return DeviceSnapshot(
+        ({'id': d.id, alias_key: d.alias, 'room': d.room, 'capabilities': d.capabilities} for d in cached_devices),
+        alias_key,
+    )
+
+
+def cached_devices_to_cache_mutations(cached_devices: Iterable[CachedDevice]) -> Iterator[DeviceCacheMutation]:
+    # Generated lazily so the mutations for a large hub are never held as
+    # one list
+    for device in cached_devices:
+        alias = device.alias
+        timestamp = device.timestamp
+
+        yield ('set_capabilities_for_device_id', device.id, set(device.capabilities))
+
+        # Numbers are indexed once per device rather than per capability
+        if device.capabilities:
+            for k, v in device.attributes:
+                if k in _NUMERIC_ATTR_KEYS:
+                    yield ('set_device_attr_number', alias, k, to_number(v))
+
+        for capability in device.capabilities:
+            yield ('add_device_for_capability', capability, alias)
+            yield ('add_device_for_capability_and_room', capability, device.room, alias)
+
+            for k, v in device.attributes:
+                yield ('add_device_for_capability_and_attribute', capability, k, v, alias)
+                yield ('set_last_device_attr_value', capability, alias, k, v)
+                if timestamp is not None:
+                    if k in _NUMERIC_ATTR_KEYS:
+                        yield ('set_last_device_attr_timestamp', capability, alias, k, None, timestamp)
+                    else:
+                        yield ('set_last_device_attr_timestamp', capability, alias, k, v, timestamp)
+
+
+def reconcile_location_mutations(device_cache: DeviceCache, mode: str | None, hsm: str | None) -> list[DeviceCacheMutation]:
+    return [
+        (name, capability, alias, attr_key, attr_value)
+        for name, capability, alias, attr_key, attr_value in location_to_cache_mutations(mode, hsm)
+        if not _values_equal(device_cache.get_last_device_attr_value(capability, alias, attr_key), attr_value)
+    ]
+
+
+def _values_equal(cached: Any, value: Any) -> bool:
+    # Some caches, e.g. Redis, give values back as strings
+    return cached == value or (cached is not None and value is not None and str(cached) == str(value))
+
+
+def reconcile_cache_mutations(
+    device_cache: DeviceCache,
+    old_devices: list[CachedDevice],
+    new_devices: list[CachedDevice],
+) -> list[DeviceCacheMutation]:
+    # The mutations that bring a cache loaded from old_devices, and kept up to
+    # date by events since, in line with new_devices. Capabilities and rooms
+    # are only written on load, so they are diffed against old_devices;
+    # attribute values move with events, so they are read back from the cache.
+    mutations: list[DeviceCacheMutation] = []
+
+    old_capabilities = {d.id: set(d.capabilities) for d in old_devices}
+    for device in new_devices:
+        if old_capabilities.pop(device.id, None) != set(device.capabilities):
+            mutations.append(('set_capabilities_for_device_id', device.id, set(device.capabilities)))
+    for device_id in old_capabilities:
+        mutations.append(('set_capabilities_for_device_id', device_id, set()))
+
+    old_members = {(c, d.alias) for d in old_devices for c in d.capabilities}
+    new_members = {(c, d.alias) for d in new_devices for c in d.capabilities}
+    mutations += [('remove_device_for_capability', c, alias) for c, alias in old_members - new_members]
+    mutations += [('add_device_for_capability', c, alias) for c, alias in new_members - old_members]
+
+    old_room_members = {(c, d.room, d.alias) for d in old_devices for c in d.capabilities}
+    new_room_members = {(c, d.room, d.alias) for d in new_devices for c in d.capabilities}
+    mutations += [('remove_device_for_capability_and_room', c, room, alias) for c, room, alias in old_room_members - new_room_members]
+    mutations += [('add_device_for_capability_and_room', c, room, alias) for c, room, alias in new_room_members - old_room_members]
+
+    # (capability, alias, attr_key) -> (new value, device date); None for
+    # attributes of removed devices
+    attr_updates: dict[tuple, tuple[Any, int | None] | None] = {}
+    # (capability, alias, attr_key) -> value indexed when old_devices loaded
+    old_values: dict[tuple, Any] = {}
+    for device in old_devices:
+        for c in device.capabilities:
+            for k, v in device.attributes:
+                attr_updates[(c, device.alias, k)] = None
+                old_values[(c, device.alias, k)] = v
+    for device in new_devices:
+        for c in device.capabilities:
+            for k, v in device.attributes:
+                attr_updates[(c, device.alias, k)] = (v, device.timestamp)
+
+    # (alias, attr_key) -> number to index, or None to drop it
+    number_updates: dict[tuple, float | None] = {}
+    keys = list(attr_updates)
+    for (c, alias, k), cached in zip(keys, device_cache.get_last_device_attr_values(keys)):
+        update = attr_updates[(c, alias, k)]
+        v = None if update is None else update[0]
+        old = old_values.get((c, alias, k))
+        # Events move last values but only re-index accessor attributes, so
+        # the entry written for the old value may outlive the cached value
+        stale = [] if cached is None or _values_equal(cached, v) else [cached]
+        if old is not None and not _values_equal(old, v) and not any(_values_equal(old, x) for x in stale):
+            stale.append(old)
+        for x in stale:
+            mutations.append(('remove_device_for_capability_and_attribute', c, k, x, alias))
+
+        if update is None:
+            if cached is not None:
+                mutations.append(('set_last_device_attr_value', c, alias, k, None))
+                if k in _NUMERIC_ATTR_KEYS:
+                    number_updates.setdefault((alias, k), None)
+            continue
+
+        timestamp = update[1]
+        if _values_equal(cached, v):
+            if old is not None and not _values_equal(old, v):
+                mutations.append(('add_device_for_capability_and_attribute', c, k, v, alias))
+            continue
+        mutations.append(('add_device_for_capability_and_attribute', c, k, v, alias))
+        mutations.append(('set_last_device_attr_value', c, alias, k, v))
+        if k in _NUMERIC_ATTR_KEYS:
+            number_updates[(alias, k)] = to_number(v)
+        if timestamp is not None:
+            mutations.append(('set_last_device_attr_timestamp', c, alias, k, None if k in _NUMERIC_ATTR_KEYS else v, timestamp))
+    mutations += [('set_device_attr_number', alias, k, number) for (alias, k), number in number_updates.items()]
+    return mutations
+
+
+def hubitat_event_to_cache_mutations(
+    capabilities: Iterable[CapabilityName | None],
+    event: HubitatEvent,
+    event_key: str,
+    accessor_attr_index: AccessorAttrIndex = ACCESSOR_ATTR_INDEX,
+) -> list[DeviceCacheMutation]:
+    mutations: list[DeviceCacheMutation] = []
+    alias = getattr(event, event_key)
+    attr_key = event.attr_key
+    attr_value = event.attr_value
+    is_numeric = attr_key in _NUMERIC_ATTR_KEYS
+    timestamp_value = None if is_numeric else attr_value
+    known_device = False
+
+    for capability in capabilities:
+        for v in accessor_attr_index.get((capability, attr_key), ()):  # type: ignore
+            if v == attr_value:
+                mutations.append(('add_device_for_capability_and_attribute', capability, attr_key, v, alias))
+            else:
+                mutations.append(('remove_device_for_capability_and_attribute', capability, attr_key, v, alias))
+
+        mutations.append(('set_last_device_attr_value', capability, alias, attr_key, attr_value))
+        mutations.append(('set_last_device_attr_timestamp', capability, alias, attr_key, timestamp_value, event.timestamp))
+        known_device = known_device or capability is not None
+    if is_numeric and known_device:
+        mutations.append(('set_device_attr_number', alias, attr_key, to_number(attr_value)))
+    return mutations
+
+
+def get_event_capabilities(
+    device_id_to_capabilities: dict[int, set[CapabilityName]],
+    device_cache: DeviceCache,
+    event: HubitatEvent,
+) -> set[CapabilityName] | set[None]:
+    if event.device_id is None:
+        return {None}
+
+    capabilities = device_id_to_capabilities.get(event.device_id)
+    if capabilities is None:
+        # Devices the client hasn't loaded itself, e.g. after a warm start,
+        # are looked up in the cache once
+        capabilities = device_cache.get_capabilities_for_device_id(event.device_id)
+        if capabilities:
+            device_id_to_capabilities[event.device_id] = capabilities
+    return capabilities or {None}
+
+
+def coalesce_hubitat_events(events: list[HubitatEvent]) -> list[HubitatEvent]:
+    # Drops every event that a later event in the batch fully overwrites, so
+    # applying the result leaves the cache exactly as applying all of them
+    # would. Numeric attributes keep one timestamp per attribute and collapse
+    # to their latest event; other attributes keep a timestamp per value, so
+    # the latest event for each value survives and every state transition of
+    # e.g. switch or motion is still recorded.
+    latest: dict[tuple, HubitatEvent] = {}
+    for event in events:
+        if event.attr_key in _NUMERIC_ATTR_KEYS:
+            k: tuple = (event.device_id, event.device_label, event.attr_key)
+        else:
+            k = (event.device_id, event.device_label, event.attr_key, event.attr_value)
+        # Re-insert so the dict stays ordered by each event's last occurrence
+        latest.pop(k, None)
+        latest[k] = event
+    return list(latest.values())
+
+
 class HubitatCachingClient(HubitatClient):
     def __init__(
         self,
@@ -64,40 +331,177 @@ class HubitatCachingClient(HubitatClient):
         alias_key: str = 'label',
         event_key: str = 'device_label',
         cache_writes_enabled: bool = True,
+        max_command_concurrency: int = DEFAULT_MAX_COMMAND_CONCURRENCY,
+        snapshot_path: str | None = None,
+        telemetry_store: 'TelemetryStore | None' = None,
     ):
-        super(HubitatCachingClient, self).__init__(api_client, alias_key)
+        super(HubitatCachingClient, self).__init__(api_client, alias_key, max_command_concurrency)
         self.device_cache = device_cache
         self.event_key = event_key
         self.cache_writes_enabled = cache_writes_enabled
+        self.snapshot_path = snapshot_path
+        self.telemetry_store = telemetry_store
+        self.warm_start_thread: threading.Thread | None = None
+        self._cache_generation_lock = threading.Lock()
+        self._events_during_rebuild: list[HubitatEvent] | None = None
+        self.accessor_attr_index = ACCESSOR_ATTR_INDEX
+        self._device_id_to_capabilities: dict[int, set[CapabilityName]] = {}
+        # The devices the cache's capabilities, rooms and attribute indexes
+        # were written from; unknown after a warm start until the rebuild is
+        # done
+        self._cached_devices: list[CachedDevice] | None = None
 
         if self.cache_writes_enabled:
+            if self._load_cache_snapshot():
+                # Serve the persisted state right away and reconcile it with
+                # the hub in the background
+                self.warm_start_thread = self.rebuild_cache(background=True)
+            else:
+                self.device_cache.clear()
+                self.load_cache()
+
+    def _load_cache_snapshot(self) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            self.device_cache.load_snapshot(self.snapshot_path)
+        except (NotImplementedError, OSError, ValueError, KeyError, TypeError):
+            # Unreadable or corrupt, so load from the hub as if it were missing
+            return False
+        return True
+
+    def save_cache_snapshot(self) -> None:
+        # The cache copies its state under its own lock, so events keep being
+        # applied while the snapshot is written to disk
+        if self.snapshot_path:
+            try:
+                self.device_cache.save_snapshot(self.snapshot_path)
+            except NotImplementedError:
+                pass
+
+    def register_accessor_attr(self, capability: CapabilityName, attr_key: CapabilityAttrKey, attr_value: str) -> None:
+        # Keeps get_devices_by_capability_and_attribute(capability, attr_key,
+        # attr_value) up to date from events, like the SUPPORTED_ACCESSOR_ATTRS
+        k = (capability, attr_key)
+        values = self.accessor_attr_index.get(k, ())
+        if attr_value not in values:
+            # Copy so events being applied concurrently see either index
+            self.accessor_attr_index = {**self.accessor_attr_index, k: values + (attr_value,)}
+
+    def load_cache(self) -> None:
+        cached_devices = self._load_cache_into(self.device_cache)
+        self._set_cached_devices(cached_devices, cached_devices_to_identity_snapshot(cached_devices, self.alias_key))
+        self.save_cache_snapshot()
+
+    def _load_cache_into(self, device_cache: DeviceCache) -> list[CachedDevice]:
+        instrumentation = self.api_client.instrumentation
+        with instrumentation.span(LOAD_CACHE_SPAN):
+            start = time.perf_counter()
+            mode = self._get_mode_from_api()
+            hsm = self._get_hsm_from_api()
+            cached_devices = self._fetch_cached_devices()
+
+            device_cache.apply_mutations(
+                chain(location_to_cache_mutations(mode, hsm), cached_devices_to_cache_mutations(cached_devices))
+            )
+            instrumentation.observe(LOAD_CACHE_SECONDS, time.perf_counter() - start)
+        return cached_devices
+
+    def _fetch_cached_devices(self) -> list[CachedDevice]:
+        # Streamed, so only the CachedDevice of each device is ever held
+        return [to_cached_device(device, self.alias_key) for device in self.api_client.iter_devices()]
+
+    def _refresh_identity_snapshot_from_all_devices(self) -> DeviceSnapshot:
+        # The cache serves attribute values, so only keep identity indexes
+        snapshot = cached_devices_to_identity_snapshot(self._fetch_cached_devices(), self.alias_key)
+        self._identity_snapshot = snapshot
+        return snapshot
+
+    def _set_cached_devices(self, cached_devices: list[CachedDevice], identity_snapshot: DeviceSnapshot) -> None:
+        self._cached_devices = cached_devices
+        self._device_id_to_capabilities = identity_snapshot.device_id_to_capabilities
+        self._identity_snapshot = identity_snapshot
+
+    def _event_to_cache_mutations(
+        self,
+        event: HubitatEvent,
+        device_cache: DeviceCache,
+        device_id_to_capabilities: dict[int, set[CapabilityName]],
+    ) -> list[DeviceCacheMutation]:
+        return hubitat_event_to_cache_mutations(
+            get_event_capabilities(device_id_to_capabilities, device_cache, event),
+            event,
+            self.event_key,
+            self.accessor_attr_index,
+        )
+
+    def rebuild_cache(self, background: bool = False) -> threading.Thread | None:
+        # Loads a fresh generation of the cache while readers keep using the
+        # current one, then swaps it in. Events that arrive meanwhile are
+        # applied to the current generation and replayed onto the new one.
+        if background:
+            thread = threading.Thread(target=self.rebuild_cache, name='hubitat-cache-rebuild', daemon=True)
+            thread.start()
+            return thread
+
+        try:
+            generation = self.device_cache.new_generation()
+        except NotImplementedError:
             self.device_cache.clear()
             self.load_cache()
+            return None
 
-    def load_cache(self) -> None:
-        self.device_cache.set_last_device_attr_value(None, DeviceAlias('Home'), 'mode', self._get_mode_from_api())
-        self.device_cache.set_last_device_attr_value(None, DeviceAlias('Home'), 'hsmStatus', self._get_hsm_from_api())
-
-        devices = self.api_client.get_devices()
-        for device in devices:
-            alias = device[self.alias_key]
-
-            self.device_cache.set_capabilities_for_device_id(device['id'], set(device['capabilities']))
-
-            for capability in device['capabilities']:
-                self.device_cache.add_device_for_capability(capability, alias)
-                self.device_cache.add_device_for_capability_and_room(capability, device['room'], alias)
-
-                for k, v in device['attributes'].items():
-                    if k not in UNSUPPORTED_ATTR_KEYS:
-                        self.device_cache.add_device_for_capability_and_attribute(capability, k, v, alias)
-                        self.device_cache.set_last_device_attr_value(capability, alias, k, v)
-                        if device['date']:
-                            timestamp = date_to_timestamp(device['date'])
-                            if k in ATTR_KEYS_WITH_NUMERIC_VALS:
-                                self.device_cache.set_last_device_attr_timestamp(capability, alias, k, None, timestamp)
-                            else:
-                                self.device_cache.set_last_device_attr_timestamp(capability, alias, k, v, timestamp)
+        with self._cache_generation_lock:
+            self._events_during_rebuild = []
+        try:
+            cached_devices = self._load_cache_into(generation)
+            identity_snapshot = cached_devices_to_identity_snapshot(cached_devices, self.alias_key)
+            with self._cache_generation_lock:
+                for event in self._events_during_rebuild or []:
+                    generation.apply_mutations(self._event_to_cache_mutations(event, generation, identity_snapshot.device_id_to_capabilities))
+                self.device_cache.swap_generation(generation)
+                self._set_cached_devices(cached_devices, identity_snapshot)
+        except BaseException:
+            # A shared backend like Redis would otherwise keep the half-loaded
+            # generation's keys forever
+            generation.clear()
+            raise
+        finally:
+            # Otherwise a failed replay or swap would leave every later event
+            # buffered until the next rebuild
+            with self._cache_generation_lock:
+                self._events_during_rebuild = None
+        self.save_cache_snapshot()
+        return None
+
+    def reconcile(self) -> None:
+        # Repairs drift between the cache and the hub by writing only what
+        # differs from a fresh /devices/all, including room moves and removed
+        # devices, rather than every key like rebuild_cache(). Events that
+        # arrive during the fetch are replayed on top, as in rebuild_cache().
+        if self._cached_devices is None:
+            self.rebuild_cache()
+            return
+
+        with self._cache_generation_lock:
+            self._events_during_rebuild = []
+        try:
+            mode = self._get_mode_from_api()
+            hsm = self._get_hsm_from_api()
+            cached_devices = self._fetch_cached_devices()
+            identity_snapshot = cached_devices_to_identity_snapshot(cached_devices, self.alias_key)
+            with self._cache_generation_lock:
+                mutations = reconcile_location_mutations(self.device_cache, mode, hsm)
+                mutations += reconcile_cache_mutations(self.device_cache, self._cached_devices, cached_devices)
+                for event in self._events_during_rebuild or []:
+                    mutations += self._event_to_cache_mutations(event, self.device_cache, identity_snapshot.device_id_to_capabilities)
+                self.device_cache.apply_mutations(mutations)
+                self._set_cached_devices(cached_devices, identity_snapshot)
+        finally:
+            with self._cache_generation_lock:
+                self._events_during_rebuild = None
+        if mutations:
+            self.save_cache_snapshot()
 
     def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
         return self.device_cache.get_devices_by_capability(capability)
@@ -108,6 +512,30 @@ class HubitatCachingClient(HubitatClient):
     def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: CapabilityAttrKey, attr_value: str) -> set[DeviceAlias]:
         return self.device_cache.get_devices_by_capability_and_attribute(capability, attr_key, attr_value)
 
+    def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: CapabilityAttrKey, lo: float | None = None, hi: float | None = None) -> set[DeviceAlias]:
+        try:
+            return self.device_cache.get_devices_by_attribute_range(capability, attr_key, lo, hi)
+        except NotImplementedError:
+            return {
+                alias for alias in self.device_cache.get_devices_by_capability(capability)
+                if is_in_range(to_number(self.device_cache.get_last_device_attr_value(capability, alias, attr_key)), lo, hi)
+            }
+
+    def query(self, capability: CapabilityName, room: RoomName | None = None, attrs: dict[str, AttrPredicate] | None = None) -> set[DeviceAlias]:
+        # Each predicate is answered by a cache index; the result is built by
+        # probing the smallest of those sets against the rest
+        alias_sets = []
+        if room is not None:
+            alias_sets.append(self.get_devices_by_capability_and_room(capability, room))
+        for attr_key, predicate in (attrs or {}).items():
+            if isinstance(predicate, tuple):
+                alias_sets.append(self.get_devices_by_attribute_range(capability, CapabilityAttrKey(attr_key), *predicate))
+            else:
+                alias_sets.append(self.get_devices_by_capability_and_attribute(capability, CapabilityAttrKey(attr_key), predicate))
+        if not alias_sets:
+            return self.get_devices_by_capability(capability)
+        return intersect_smallest_first(alias_sets)
+
     def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
         return self.device_cache.get_capabilities_for_device_id(device_id)
 
@@ -133,20 +561,51 @@ class HubitatCachingClient(HubitatClient):
         if not self.cache_writes_enabled:
             return
 
-        alias = getattr(event, self.event_key)
+        instrumentation = self.api_client.instrumentation
+        if instrumentation.enabled:
+            with instrumentation.span(APPLY_EVENTS_SPAN, {'events': 1}):
+                start = time.perf_counter()
+                self._apply_hubitat_event(event)
+                record_events_applied(instrumentation, [event], start)
+        else:
+            self._apply_hubitat_event(event)
 
-        capabilities = self.get_capabilities_for_device_id(event.device_id) or {None}  # type: ignore
+    def _apply_hubitat_event(self, event: HubitatEvent) -> None:
+        if self.telemetry_store is not None:
+            self.telemetry_store.record_event(getattr(event, self.event_key), event)
 
-        for capability in capabilities:
-            for cap, k, v in SUPPORTED_ACCESSOR_ATTRS:
-                if cap == capability and k == event.attr_key:
-                    if v == event.attr_value:
-                        self.device_cache.add_device_for_capability_and_attribute(capability, k, v, alias)
-                    else:
-                        self.device_cache.remove_device_for_capability_and_attribute(capability, k, v, alias)
+        with self._cache_generation_lock:
+            if self._events_during_rebuild is not None:
+                self._events_during_rebuild.append(event)
+            self.device_cache.apply_mutations(
+                self._event_to_cache_mutations(event, self.device_cache, self._device_id_to_capabilities)
+            )
 
-            self.device_cache.set_last_device_attr_value(capability, alias, event.attr_key, event.attr_value)
-            if event.attr_key in ATTR_KEYS_WITH_NUMERIC_VALS:
-                self.device_cache.set_last_device_attr_timestamp(capability, alias, event.attr_key, None, event.timestamp)
-            else:
-                self.device_cache.set_last_device_attr_timestamp(capability, alias, event.attr_key, event.attr_value, event.timestamp)
+    def update_from_hubitat_events(self, events: list[HubitatEvent]) -> None:
+        # Applies a burst of events with one cache write
+        if not self.cache_writes_enabled:
+            return
+
+        instrumentation = self.api_client.instrumentation
+        if instrumentation.enabled:
+            with instrumentation.span(APPLY_EVENTS_SPAN, {'events': len(events)}):
+                start = time.perf_counter()
+                self._apply_hubitat_events(events)
+                record_events_applied(instrumentation, events, start)
+        else:
+            self._apply_hubitat_events(events)
+
+    def _apply_hubitat_events(self, events: list[HubitatEvent]) -> None:
+        # History wants every sample, so record before coalescing
+        if self.telemetry_store is not None:
+            for event in events:
+                self.telemetry_store.record_event(getattr(event, self.event_key), event)
+
+        events = coalesce_hubitat_events(events)
+        with self._cache_generation_lock:
+            if self._events_during_rebuild is not None:
+                self._events_during_rebuild.extend(events)
+            mutations: list[DeviceCacheMutation] = []
+            for event in events:
+                mutations += self._event_to_cache_mutations(event, self.device_cache, self._device_id_to_capabilities)
+            self.device_cache.apply_mutations(mutations)
@@ -1,6 +1,10 @@
 from cachetools.func import ttl_cache
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 from typing import Any
+from typing import Iterable
 from typing import NewType
 
 from hubitat_maker_api_client.api_client import HubitatAPIClient
@@ -17,41 +21,330 @@ from hubitat_maker_api_client.capabilities import SwitchCapability
 from hubitat_maker_api_client.capabilities import supported_capabilities
 from hubitat_maker_api_client.errors import DeviceNotFoundError
 from hubitat_maker_api_client.errors import MultipleDevicesFoundError
+from hubitat_maker_api_client.event_socket import HubitatEvent
+from hubitat_maker_api_client.instrumentation import record_cache_lookup
 
 
 DeviceAlias = NewType('DeviceAlias', str)
 RoomName = NewType('RoomName', str)
 
+# (capability, alias, command, *secondary_values)
+DeviceCommand = tuple
+
+# An attribute value to match exactly, or a (lo, hi) numeric range as taken by
+# get_devices_by_attribute_range
+AttrPredicate = str | tuple[float | None, float | None]
+
+DEFAULT_MAX_COMMAND_CONCURRENCY = 8
+
+# How stale the shared device snapshot may be for identity lookups (ids,
+# rooms, capabilities) and for attribute values respectively.
+DEFAULT_IDENTITY_TTL = 86400
+DEFAULT_ATTRIBUTES_TTL = 2
+
+# How stale a single device's attributes fetched from /devices/{id} may be
+DEFAULT_DEVICE_ATTRIBUTES_TTL = 2
+
+# The /devices/all fields the clients read; everything else, e.g. each
+# device's commands, is dropped as devices are decoded
+DEVICE_FIELDS = ('id', 'name', 'label', 'room', 'capabilities', 'attributes', 'date')
+
+# Attribute metadata listed among a device's attribute values
+UNSUPPORTED_ATTR_KEYS = ['dataType', 'values']
+
+# Once the client is fed eventsocket events, attribute reads are served from
+# the event-maintained snapshot and only fully refetched this often.
+DEFAULT_RESYNC_INTERVAL = 3600
+
+
+class DeviceCommandResult:
+    def __init__(
+        self,
+        capability: CapabilityName,
+        alias: DeviceAlias,
+        command: str,
+        secondary_values: tuple,
+        response: dict | None = None,
+        error: Exception | None = None,
+    ):
+        self.capability = capability
+        self.alias = alias
+        self.command = command
+        self.secondary_values = secondary_values
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        outcome = f'error={self.error!r}' if self.error else f'response={self.response!r}'
+        return f'DeviceCommandResult({self.capability} {self.alias} {self.command}, {outcome})'
+
+
+def resolve_device_command(
+    capability_to_alias_to_device_ids: dict[CapabilityName, dict[DeviceAlias, list[int]]],
+    command: DeviceCommand,
+) -> tuple[DeviceCommandResult, int | None]:
+    capability, alias, command_name, *secondary_values = command
+    result = DeviceCommandResult(capability, alias, command_name, tuple(secondary_values))
+    matched_device_ids = capability_to_alias_to_device_ids.get(capability, {}).get(alias, [])
+    if not matched_device_ids:
+        result.error = DeviceNotFoundError('Unable to find {} {}'.format(capability, alias))
+        return result, None
+    elif len(matched_device_ids) > 1:
+        result.error = MultipleDevicesFoundError('Multiple devices found for {} {}'.format(capability, alias))
+        return result, None
+    else:
+        return result, matched_device_ids[0]
+
+
+def resolve_device_id(
+    capability_to_alias_to_device_ids: dict[CapabilityName, dict[DeviceAlias, list[int]]],
+    alias: DeviceAlias,
+    capability: CapabilityName | None = None,
+) -> int:
+    if capability is not None:
+        device_ids = set(capability_to_alias_to_device_ids.get(capability, {}).get(alias, []))
+    else:
+        device_ids = {
+            device_id
+            for alias_to_device_ids in capability_to_alias_to_device_ids.values()
+            for device_id in alias_to_device_ids.get(alias, [])
+        }
+    if not device_ids:
+        raise DeviceNotFoundError('Unable to find {} {}'.format(capability or 'device', alias))
+    elif len(device_ids) > 1:
+        raise MultipleDevicesFoundError('Multiple devices found for {} {}'.format(capability or 'device', alias))
+    return device_ids.pop()
+
+
+def trim_device(device: dict, alias_key: str) -> dict:
+    trimmed = {k: device[k] for k in DEVICE_FIELDS if k in device}
+    trimmed[alias_key] = device[alias_key]
+    if isinstance(trimmed.get('attributes'), dict):
+        trimmed['attributes'] = {k: v for k, v in trimmed['attributes'].items() if k not in UNSUPPORTED_ATTR_KEYS}
+    return trimmed
+
+
+def device_attributes_from_device(device: dict) -> dict[str, Any]:
+    # /devices/{id} lists attributes as [{'name': ..., 'currentValue': ...}]
+    # rather than the {name: value} dict of /devices/all
+    attributes = device.get('attributes', {})
+    if isinstance(attributes, dict):
+        return dict(attributes)
+    return {attribute['name']: attribute.get('currentValue') for attribute in attributes}
+
+
+class DeviceSnapshot:
+    # All indexes derived from one /devices/all payload, built in a single
+    # pass as devices stream in; the devices themselves aren't kept. Devices
+    # without attributes, e.g. from the brief /devices listing, only get the
+    # identity indexes.
+    def __init__(self, devices: Iterable[dict], alias_key: str):
+        self.alias_key = alias_key
+        self.fetched_at = time.monotonic()
+        self.capability_to_alias_to_device_ids: dict[CapabilityName, dict[DeviceAlias, list[int]]] = defaultdict(lambda: defaultdict(list))
+        self.capability_to_room_to_aliases: dict[CapabilityName, dict[RoomName | None, set[DeviceAlias]]] = defaultdict(lambda: defaultdict(set))
+        self.capability_to_alias_to_attributes: dict[CapabilityName, dict[DeviceAlias, dict[str, Any]]] = defaultdict(lambda: defaultdict(dict))
+        self.device_id_to_capabilities: dict[int, set[CapabilityName]] = {}
+        self.device_id_to_attributes: dict[int, dict[str, Any]] = {}
+
+        for device in devices:
+            self.add_device(device)
+
+    def add_device(self, device: dict) -> None:
+        device = trim_device(device, self.alias_key)
+        alias = device[self.alias_key]
+        device_id = int(device['id'])
+        room = device.get('room')
+        attributes = device.get('attributes')
+        self.device_id_to_capabilities[device_id] = set(device['capabilities'])
+        if attributes is not None:
+            self.device_id_to_attributes[device_id] = attributes
+        for capability in device['capabilities']:
+            self.capability_to_alias_to_device_ids[capability][alias].append(device_id)
+            self.capability_to_room_to_aliases[capability][room].add(alias)
+            if attributes is not None:
+                self.capability_to_alias_to_attributes[capability][alias] = attributes
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def apply_event(self, event: HubitatEvent) -> bool:
+        # The attributes dict is shared by every capability of the device, so
+        # one write updates all of its capability_to_alias_to_attributes entries
+        attributes = self.device_id_to_attributes.get(event.device_id)  # type: ignore
+        if attributes is None:
+            return False
+        attributes[event.attr_key] = event.attr_value
+        return True
+
+
+def to_number(value: Any) -> float | None:
+    # Attribute values arrive as strings; anything that isn't a finite-ish
+    # number (None, '', 'n/a', NaN) is left out of numeric indexes
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number == number else None
+
+
+def is_in_range(number: float | None, lo: float | None, hi: float | None) -> bool:
+    # lo is inclusive and hi exclusive; None leaves that side unbounded
+    return number is not None and (lo is None or number >= lo) and (hi is None or number < hi)
+
+
+def attr_matches(value: Any, predicate: AttrPredicate) -> bool:
+    if isinstance(predicate, tuple):
+        return is_in_range(to_number(value), *predicate)
+    return value == predicate
+
+
+def intersect_smallest_first(alias_sets: list[set[DeviceAlias]]) -> set[DeviceAlias]:
+    # Probes each member of the smallest set against the others, so the work
+    # is bounded by the most selective predicate and no input set is copied
+    if not alias_sets:
+        return set()
+    alias_sets = sorted(alias_sets, key=len)
+    smallest, others = alias_sets[0], alias_sets[1:]
+    return {alias for alias in smallest if all(alias in s for s in others)}
+
+
+def get_alias_set(alias_list: list[DeviceAlias], alias_key: str) -> set[DeviceAlias]:
+    aliases = set()
+    duplicate_aliases = set()
+    for alias in alias_list:
+        if alias in aliases:
+            duplicate_aliases.add(alias)
+        aliases.add(alias)
+    if duplicate_aliases:
+        raise MultipleDevicesFoundError(
+            'Multiple devices found for ' + alias_key + ' ' + ','.join(map(str, duplicate_aliases))
+        )
+    return aliases
+
 
 class HubitatClient():
     def __init__(
         self,
         api_client: HubitatAPIClient,
-        alias_key: str = 'label'
+        alias_key: str = 'label',
+        max_command_concurrency: int = DEFAULT_MAX_COMMAND_CONCURRENCY,
+        identity_ttl: float = DEFAULT_IDENTITY_TTL,
+        attributes_ttl: float = DEFAULT_ATTRIBUTES_TTL,
+        resync_interval: float = DEFAULT_RESYNC_INTERVAL,
+        device_attributes_ttl: float = DEFAULT_DEVICE_ATTRIBUTES_TTL,
     ):
         self.api_client = api_client
         self.alias_key = alias_key
+        self.max_command_concurrency = max_command_concurrency
+        self.identity_ttl = identity_ttl
+        self.attributes_ttl = attributes_ttl
+        self.resync_interval = resync_interval
+        self.device_attributes_ttl = device_attributes_ttl
+        self._device_snapshot: DeviceSnapshot | None = None
+        # Serves ids, rooms and capabilities; either a full snapshot or one
+        # built from the brief /devices listing
+        self._identity_snapshot: DeviceSnapshot | None = None
+        self._device_snapshot_lock = threading.Lock()
+        # Whether the hub's brief /devices listing includes capabilities;
+        # None until the first identity refresh finds out
+        self._brief_devices_have_capabilities: bool | None = None
+        # device id -> (fetched at, attributes) from /devices/{id}
+        self._device_id_to_attributes: dict[int, tuple[float, dict[str, Any]]] = {}
+        self._device_attributes_lock = threading.Lock()
+        self._event_lock = threading.Lock()
+        self._events_during_refresh: list[HubitatEvent] | None = None
+        self._events_enabled = False
+        self._resync_needed = False
+
+    def _get_device_snapshot(self, max_age: float) -> DeviceSnapshot:
+        hit = True
+        snapshot = self._device_snapshot
+        if snapshot is None or snapshot.age() >= max_age:
+            with self._device_snapshot_lock:
+                snapshot = self._device_snapshot
+                if snapshot is None or snapshot.age() >= max_age:
+                    hit = False
+                    snapshot = self._refresh_device_snapshot()
+        if self.api_client.instrumentation.enabled:
+            record_cache_lookup(self.api_client.instrumentation, 'device_snapshot', hit)
+        return snapshot
+
+    def _get_identity_snapshot(self) -> DeviceSnapshot:
+        hit = True
+        snapshot = self._identity_snapshot
+        if snapshot is None or snapshot.age() >= self.identity_ttl:
+            with self._device_snapshot_lock:
+                snapshot = self._identity_snapshot
+                if snapshot is None or snapshot.age() >= self.identity_ttl:
+                    hit = False
+                    snapshot = self._refresh_identity_snapshot()
+        if self.api_client.instrumentation.enabled:
+            record_cache_lookup(self.api_client.instrumentation, 'identity_snapshot', hit)
+        return snapshot
+
+    def refresh_identity_snapshot(self) -> DeviceSnapshot:
+        with self._device_snapshot_lock:
+            return self._refresh_identity_snapshot()
+
+    def _refresh_identity_snapshot(self) -> DeviceSnapshot:
+        # Identity indexes only need ids, aliases, rooms and capabilities, so
+        # build them from the brief /devices listing when the hub includes
+        # capabilities in it. Otherwise fall back to /devices/all, which also
+        # leaves attribute values ready for the first attribute query.
+        if self._brief_devices_have_capabilities is not False:
+            devices = self.api_client.get_devices(brief=True)
+            self._brief_devices_have_capabilities = isinstance(devices, list) and all('capabilities' in device for device in devices)
+            if self._brief_devices_have_capabilities:
+                snapshot = DeviceSnapshot(devices, self.alias_key)
+                self._identity_snapshot = snapshot
+                return snapshot
+        return self._refresh_identity_snapshot_from_all_devices()
+
+    def _refresh_identity_snapshot_from_all_devices(self) -> DeviceSnapshot:
+        return self._refresh_device_snapshot()
+
+    def refresh_device_snapshot(self) -> DeviceSnapshot:
+        # Holds the snapshot lock so concurrent refreshes don't share the
+        # buffer of events received during the fetch
+        with self._device_snapshot_lock:
+            return self._refresh_device_snapshot()
+
+    def _refresh_device_snapshot(self) -> DeviceSnapshot:
+        with self._event_lock:
+            self._events_during_refresh = []
+        try:
+            snapshot = DeviceSnapshot(self.api_client.iter_devices(), self.alias_key)
+        except BaseException:
+            with self._event_lock:
+                self._events_during_refresh = None
+            raise
+
+        with self._event_lock:
+            # Events may have raced the fetch, so replay them onto the new
+            # snapshot rather than lose them. Installing it under the same
+            # lock means no event can fall between the replay and the swap.
+            for event in self._events_during_refresh or []:
+                snapshot.apply_event(event)
+            self._events_during_refresh = None
+            self._device_snapshot = snapshot
+            self._identity_snapshot = snapshot
+            self._resync_needed = False
+        return snapshot
+
+    def invalidate_device_snapshot(self) -> None:
+        self._device_snapshot = None
+        self._identity_snapshot = None
 
-    @ttl_cache(ttl=86400)
     def _get_capability_to_alias_to_device_ids(self) -> dict[CapabilityName, dict[DeviceAlias, list[int]]]:
-        devices = self.api_client.get_devices()
-        capability_to_alias_to_device_ids: dict[CapabilityName, dict[DeviceAlias, list[int]]] = defaultdict(lambda: defaultdict(list))
-        for device in devices:
-            for capability in device['capabilities']:
-                alias = device[self.alias_key]
-                device_id = int(device['id'])
-                capability_to_alias_to_device_ids[capability][alias].append(device_id)
-        return capability_to_alias_to_device_ids
+        return self._get_identity_snapshot().capability_to_alias_to_device_ids
 
-    @ttl_cache(ttl=86400)
     def _get_capability_to_room_to_aliases(self) -> dict[CapabilityName, dict[RoomName | None, set[DeviceAlias]]]:
-        capability_to_room_to_aliases: dict[CapabilityName, dict[RoomName | None, set[DeviceAlias]]] = defaultdict(lambda: defaultdict(set))
-        for device in self.api_client.get_devices():
-            for capability in device['capabilities']:
-                alias = device[self.alias_key]
-                room = device['room']
-                capability_to_room_to_aliases[capability][room].add(alias)
-        return capability_to_room_to_aliases
+        return self._get_identity_snapshot().capability_to_room_to_aliases
 
     @ttl_cache(ttl=86400)
     def _get_mode_name_to_id(self) -> dict[str, int]:
@@ -61,30 +354,43 @@ class HubitatClient():
         }
 
     def _get_capability_to_alias_to_attributes(self) -> dict[CapabilityName, dict[DeviceAlias, dict[str, Any]]]:
+        if self._events_enabled:
+            return self._get_device_snapshot(0 if self._resync_needed else self.resync_interval).capability_to_alias_to_attributes
         return self._get_capability_to_alias_to_attributes_from_api()
 
-    @ttl_cache(ttl=2)
     def _get_capability_to_alias_to_attributes_from_api(self) -> dict[CapabilityName, dict[DeviceAlias, dict[str, Any]]]:
-        devices = self.api_client.get_devices()
-        capability_to_alias_to_attributes: dict[CapabilityName, dict[DeviceAlias, dict]] = defaultdict(lambda: defaultdict(dict))
-        for device in devices:
-            for capability in device['capabilities']:
-                alias = device[self.alias_key]
-                capability_to_alias_to_attributes[capability][alias] = device['attributes']
-        return capability_to_alias_to_attributes
+        return self._get_device_snapshot(self.attributes_ttl).capability_to_alias_to_attributes
 
     def _get_alias_set(self, alias_list: list[DeviceAlias]) -> set[DeviceAlias]:
-        aliases = set()
-        duplicate_aliases = set()
-        for alias in alias_list:
-            if alias in aliases:
-                duplicate_aliases.add(alias)
-            aliases.add(alias)
-        if duplicate_aliases:
-            raise MultipleDevicesFoundError(
-                'Multiple devices found for ' + self.alias_key + ' ' + ','.join(map(str, duplicate_aliases))
-            )
-        return aliases
+        return get_alias_set(alias_list, self.alias_key)
+
+    # Events
+    def update_from_hubitat_event(self, event: HubitatEvent) -> None:
+        if event.device_id is None:
+            return
+
+        with self._event_lock:
+            self._events_enabled = True
+            if self._events_during_refresh is not None:
+                self._events_during_refresh.append(event)
+            with self._device_attributes_lock:
+                cached = self._device_id_to_attributes.get(event.device_id)
+                if cached is not None:
+                    cached[1][event.attr_key] = event.attr_value
+            snapshot = self._device_snapshot
+            if snapshot is not None and not snapshot.apply_event(event):
+                # A device we have never seen means the snapshot is missing
+                # something, so don't trust it any longer
+                self._resync_needed = True
+
+    def update_from_hubitat_events(self, events: list[HubitatEvent]) -> None:
+        for event in events:
+            self.update_from_hubitat_event(event)
+
+    def mark_event_gap(self) -> None:
+        # Call when events may have been missed, e.g. after an eventsocket
+        # reconnect; the next attribute read refetches /devices/all
+        self._resync_needed = True
 
     def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
         alias_to_device_ids = self._get_capability_to_alias_to_device_ids().get(capability, {})
@@ -101,20 +407,90 @@ class HubitatClient():
                 aliases.append(alias)
         return self._get_alias_set(aliases)
 
-    def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
+    def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: CapabilityAttrKey, lo: float | None = None, hi: float | None = None) -> set[DeviceAlias]:
+        aliases = []
+        for alias, attributes in self._get_capability_to_alias_to_attributes()[capability].items():
+            if is_in_range(to_number(attributes.get(attr_key)), lo, hi):
+                aliases.append(alias)
+        return self._get_alias_set(aliases)
+
+    def query(self, capability: CapabilityName, room: RoomName | None = None, attrs: dict[str, AttrPredicate] | None = None) -> set[DeviceAlias]:
+        # Devices of a capability, optionally in a room, whose attributes match
+        # every predicate in attrs. Here that is one pass over the snapshot;
+        # HubitatCachingClient intersects its cache indexes instead.
+        alias_to_attributes = self._get_capability_to_alias_to_attributes().get(capability, {})
+        if room is not None:
+            candidates: Any = self._get_capability_to_room_to_aliases().get(capability, {}).get(room, set())
+        else:
+            candidates = alias_to_attributes.keys()
         return {
-            capability for capability in self.api_client.get_device(device_id)['capabilities']
-            if type(capability) == CapabilityName
+            alias for alias in candidates
+            if all(attr_matches(alias_to_attributes.get(alias, {}).get(k), p) for k, p in (attrs or {}).items())
         }
 
+    def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
+        return self._get_identity_snapshot().device_id_to_capabilities.get(int(device_id), set())
+
+    def get_device_attributes(self, alias: DeviceAlias, capability: CapabilityName | None = None) -> dict[str, Any]:
+        # Reads one device through /devices/{id} instead of /devices/all, with
+        # the alias resolved through the long-lived identity index
+        device_id = resolve_device_id(self._get_capability_to_alias_to_device_ids(), alias, capability)
+        return self._get_device_attributes_by_id(device_id)
+
+    def get_device_attribute(self, alias: DeviceAlias, attr_key: str, capability: CapabilityName | None = None) -> Any:
+        return self.get_device_attributes(alias, capability).get(attr_key)
+
+    def _get_device_attributes_by_id(self, device_id: int) -> dict[str, Any]:
+        snapshot = self._device_snapshot
+        if self._events_enabled and not self._resync_needed and snapshot is not None and snapshot.age() < self.resync_interval:
+            # Events keep the snapshot current, so there is nothing to fetch
+            attributes = snapshot.device_id_to_attributes.get(device_id)
+            if attributes is not None:
+                return dict(attributes)
+
+        with self._device_attributes_lock:
+            cached = self._device_id_to_attributes.get(device_id)
+            cached_attributes = dict(cached[1]) if cached is not None and time.monotonic() - cached[0] < self.device_attributes_ttl else None
+        if self.api_client.instrumentation.enabled:
+            record_cache_lookup(self.api_client.instrumentation, 'device_attributes', cached_attributes is not None)
+        if cached_attributes is not None:
+            return cached_attributes
+
+        attributes = device_attributes_from_device(self.api_client.get_device(device_id))
+        with self._device_attributes_lock:
+            self._device_id_to_attributes[device_id] = (time.monotonic(), attributes)
+        return dict(attributes)
+
+    def _invalidate_device_attributes(self, device_id: int) -> None:
+        with self._device_attributes_lock:
+            self._device_id_to_attributes.pop(device_id, None)
+
     def _send_device_command_by_capability_and_alias(self, capability: CapabilityName, alias: DeviceAlias, command: str, *secondary_values) -> dict:
-        matched_device_ids = self._get_capability_to_alias_to_device_ids().get(capability, {}).get(alias, [])
-        if not matched_device_ids:
-            raise DeviceNotFoundError('Unable to find {} {}'.format(capability, alias))
-        elif len(matched_device_ids) > 1:
-            raise MultipleDevicesFoundError('Multiple devices found for {} {}'.format(capability, alias))
-        else:
-            return self.api_client.send_device_command(matched_device_ids[0], command, *secondary_values)
+        result = self.send_commands([(capability, alias, command, *secondary_values)])[0]
+        if result.error:
+            raise result.error
+        return result.response  # type: ignore
+
+    def send_commands(self, commands: list[DeviceCommand], max_concurrency: int | None = None) -> list[DeviceCommandResult]:
+        capability_to_alias_to_device_ids = self._get_capability_to_alias_to_device_ids()
+        resolved = [resolve_device_command(capability_to_alias_to_device_ids, command) for command in commands]
+
+        def send(result: DeviceCommandResult, device_id: int | None) -> DeviceCommandResult:
+            if device_id is not None:
+                try:
+                    result.response = self.api_client.send_device_command(device_id, result.command, *result.secondary_values)
+                except Exception as e:
+                    result.error = e
+                # The command may have changed the device, so don't serve its
+                # cached attributes
+                self._invalidate_device_attributes(device_id)
+            return result
+
+        max_workers = min(max_concurrency or self.max_command_concurrency, len(resolved))
+        if max_workers <= 1:
+            return [send(result, device_id) for result, device_id in resolved]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda r: send(*r), resolved))
 
     # Capabilities
     def get_capabilities(self, supported_only: bool = True) -> set[CapabilityName]:
@@ -214,6 +590,12 @@ class HubitatClient():
     def turn_off_switch(self, alias: DeviceAlias) -> dict:
         return self._send_device_command_by_capability_and_alias(SwitchCapability.name, alias, 'off')
 
+    def turn_on_switches(self, aliases: set[DeviceAlias]) -> list[DeviceCommandResult]:
+        return self.send_commands([(SwitchCapability.name, alias, 'on') for alias in aliases])
+
+    def turn_off_switches(self, aliases: set[DeviceAlias]) -> list[DeviceCommandResult]:
+        return self.send_commands([(SwitchCapability.name, alias, 'off') for alias in aliases])
+
     def arrived(self, alias: DeviceAlias) -> dict:
         return self._send_device_command_by_capability_and_alias(PresenceSensorCapability.name, alias, 'arrived')
 
@@ -252,8 +634,11 @@ class HubitatClient():
 
     def intercom_speak(self, room: RoomName, message: str, chime_before_message: bool = False) -> None:
         message = message.replace(',', '...')  # Echo speaks can't handle commas well
-        for echo in self.get_devices_by_capability_and_room(SpeechSynthesisCapability.name, room):
-            if chime_before_message:
-                self.echo_play_announcement(echo, message)
-            else:
-                self.echo_parallel_speak(echo, message)
+        command = 'playAnnouncement' if chime_before_message else 'parallelSpeak'
+        results = self.send_commands([
+            (SpeechSynthesisCapability.name, echo, command, message)
+            for echo in self.get_devices_by_capability_and_room(SpeechSynthesisCapability.name, room)
+        ])
+        for result in results:
+            if result.error:
+                raise result.error
@@ -1,15 +1,75 @@
+import json
+import os
+import sys
+import threading
 from abc import ABC
 from abc import abstractmethod
-from collections import defaultdict
+from bisect import bisect_left
+from bisect import insort
+from contextlib import AbstractContextManager
+from contextlib import contextmanager
+from contextlib import nullcontext
+from typing import Any
+from typing import Iterable
+from typing import Iterator
 
 from hubitat_maker_api_client.capabilities import CapabilityName
 from hubitat_maker_api_client.client import DeviceAlias
 from hubitat_maker_api_client.client import RoomName
 
 
+SNAPSHOT_FORMAT = 'hubitat-device-cache'
+SNAPSHOT_VERSION = 2
+
+# (mutator method name, *args), e.g. ('add_device_for_capability', 'Switch', 'Lamp')
+DeviceCacheMutation = tuple
+
+
 class DeviceCache(ABC):
+    # True for backends whose calls wait on the network, e.g. Redis, so async
+    # clients run them in a worker thread instead of on the event loop
+    blocking = False
+
     # Cache mutators
 
+    def batch(self) -> AbstractContextManager:
+        # Mutations made inside the returned context may be buffered and
+        # written together when it exits. Backends with a per-call round trip
+        # should override this.
+        return nullcontext()
+
+    def new_generation(self) -> 'DeviceCache':
+        # Returns an empty cache of the same backend that readers of this one
+        # can't see until it is passed to swap_generation()
+        raise NotImplementedError
+
+    def swap_generation(self, generation: 'DeviceCache') -> None:
+        # Atomically replaces the contents of this cache with those of a
+        # generation returned by new_generation()
+        raise NotImplementedError
+
+    def save_snapshot(self, path: str) -> None:
+        # Persists the whole cache to path so a restarted process can serve
+        # reads before reloading from the hub
+        raise NotImplementedError
+
+    def load_snapshot(self, path: str) -> None:
+        raise NotImplementedError
+
+    def apply_mutations(self, mutations: Iterable[DeviceCacheMutation]) -> None:
+        # Backends that can write many mutations in one operation should
+        # override this; by default each one is applied with its single call.
+        with self.batch():
+            for method_name, *args in mutations:
+                getattr(self, method_name)(*args)
+
+    def set_device_attr_number(self, alias: DeviceAlias, attr_key: str, value: float | None) -> None:
+        # Maintains the numeric index behind get_devices_by_attribute_range;
+        # None removes the device from it. It is keyed by attribute alone, and
+        # range queries keep the devices with the capability asked for.
+        # Backends without range queries can leave this as a no-op.
+        pass
+
     @abstractmethod
     def clear(self) -> None:
         pass
@@ -64,6 +124,10 @@ class DeviceCache(ABC):
     def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str) -> set[DeviceAlias]:
         pass
 
+    def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: str, lo: float | None, hi: float | None) -> set[DeviceAlias]:
+        # Devices whose attr_key is in [lo, hi); None leaves a side unbounded
+        raise NotImplementedError
+
     @abstractmethod
     def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
         pass
@@ -76,66 +140,388 @@ class DeviceCache(ABC):
     def get_last_device_attr_timestamp(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str, attr_value: str | None) -> int | None:
         pass
 
+    def get_last_device_attr_values(self, keys: list[tuple[CapabilityName | None, DeviceAlias, str]]) -> list[str | None]:
+        # get_last_device_attr_value for each (capability, alias, attr_key);
+        # caches with per-call round trips should read them all at once
+        return [self.get_last_device_attr_value(*k) for k in keys]
+
+
+def _intern(value: Any) -> Any:
+    # Capabilities, aliases, rooms and attribute keys repeat across thousands
+    # of index keys; interning stores each once and speeds up key comparison
+    return sys.intern(value) if type(value) is str else value
+
+
+class ReadOnlySet(set):
+    # The sets InMemoryDeviceCache hands out are shared by every reader of an
+    # entry, so they refuse mutation. Writers change the cache's own sets and
+    # the next read gets a new ReadOnlySet. Use copy() or set() for a mutable
+    # copy.
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Sets returned by InMemoryDeviceCache are read-only; copy() them to modify')
+
+    add = discard = remove = pop = clear = _read_only  # type: ignore
+    update = difference_update = intersection_update = symmetric_difference_update = _read_only  # type: ignore
+    __ior__ = __iand__ = __isub__ = __ixor__ = _read_only  # type: ignore
+
+    def copy(self) -> set:
+        return set(self)
+
+
+EMPTY_SET = ReadOnlySet()
+
+
+class AliasIndex(dict):
+    # key -> the set of aliases for it, which writers change in place. views
+    # holds the ReadOnlySet handed to readers of each key; a write drops the
+    # key's view and the next read copies the set into a new one, so writes
+    # to a hot key like ('Switch', 'switch', 'on') cost one copy per read
+    # rather than one per write.
+    __slots__ = ('views',)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.views: dict = {}
+
+
+class SortedNumbers:
+    # (number, alias) pairs in order, split into chunks of up to
+    # 2 * CHUNK_SIZE so adding or removing one only shifts entries within its
+    # chunk, not across every device with the attribute. maxes holds each
+    # chunk's last entry for finding the chunk.
+    CHUNK_SIZE = 512
+    __slots__ = ('chunks', 'maxes')
+
+    def __init__(self, entries: Iterable[tuple[float, DeviceAlias]] = ()) -> None:
+        ordered = sorted(entries)
+        n = self.CHUNK_SIZE
+        self.chunks = [ordered[i:i + n] for i in range(0, len(ordered), n)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def add(self, entry: tuple[float, DeviceAlias]) -> None:
+        if not self.chunks:
+            self.chunks.append([entry])
+            self.maxes.append(entry)
+            return
+
+        i = bisect_left(self.maxes, entry)
+        if i == len(self.maxes):
+            i -= 1
+            self.chunks[i].append(entry)
+            self.maxes[i] = entry
+        else:
+            insort(self.chunks[i], entry)
+        chunk = self.chunks[i]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            n = self.CHUNK_SIZE
+            self.chunks[i:i + 1] = [chunk[:n], chunk[n:]]
+            self.maxes[i:i + 1] = [chunk[n - 1], chunk[-1]]
+
+    def remove(self, entry: tuple[float, DeviceAlias]) -> None:
+        i = bisect_left(self.maxes, entry)
+        if i == len(self.maxes):
+            return
+        chunk = self.chunks[i]
+        j = bisect_left(chunk, entry)
+        if chunk[j] != entry:
+            return
+        del chunk[j]
+        if not chunk:
+            del self.chunks[i]
+            del self.maxes[i]
+        elif j == len(chunk):
+            self.maxes[i] = chunk[-1]
+
+    def aliases_in_range(self, lo: float | None, hi: float | None) -> Iterator[DeviceAlias]:
+        # (n,) sorts before every (n, alias), so bisecting for it finds the
+        # first entry >= n
+        i = 0 if lo is None else bisect_left(self.maxes, (lo,))
+        for chunk in self.chunks[i:]:
+            start = 0 if lo is None else bisect_left(chunk, (lo,))
+            end = len(chunk) if hi is None else bisect_left(chunk, (hi,))
+            for number, alias in chunk[start:end]:
+                yield alias
+            if end < len(chunk):
+                return
+
+
+class InMemoryDeviceCacheState:
+    def __init__(self) -> None:
+        # A missing key is an empty set
+        self.cached_cap_to_aliases = AliasIndex()
+        self.cached_cap_and_room_to_aliases = AliasIndex()
+        self.cached_cap_to_attr_to_aliases = AliasIndex()
+        self.cached_cap_to_alias_to_attr_to_timestamp: dict = dict()
+        self.cached_cap_to_alias_to_attr: dict = dict()
+        self.cached_device_id_to_capabilities: dict = dict()
+        # attr_key -> SortedNumbers, for range queries
+        self.cached_attr_to_sorted_numbers: dict = dict()
+        self.cached_alias_to_attr_number: dict = dict()
+
 
 class InMemoryDeviceCache(DeviceCache):
+    # All data lives in one state object so a whole generation can be swapped
+    # in with a single assignment. Writers change alias sets in place and
+    # drop the entry's view (see AliasIndex), so a write costs the same
+    # however many devices share the entry. Reads of an unchanged entry
+    # return its stored view, or EMPTY_SET on a miss, and never allocate.
+    #
+    # Writers, and readers that have to make a view, are serialized by
+    # _write_lock, which a batch holds until it exits; readers that find a
+    # view or miss take no lock. A reader therefore sees each entry either
+    # before or after a write or batch. The SortedNumbers behind range
+    # queries are also changed in place, so range queries read them under
+    # the lock.
+    def __init__(self) -> None:
+        self._write_lock = threading.RLock()
+        # Alias entries emptied inside a batch, dropped when it exits so a
+        # reader that skips the lock on a miss never sees one half way
+        self._emptied: list | None = None
+        self.clear()
+
     def clear(self):
-        self.cached_cap_to_aliases = defaultdict(set)
-        self.cached_cap_to_room_to_aliases = defaultdict(lambda: defaultdict(set))
-        self.cached_cap_to_attr_to_aliases = defaultdict(set)
-        self.cached_cap_to_alias_to_attr_to_timestamp = dict()
-        self.cached_cap_to_alias_to_attr = dict()
-        self.cached_device_id_to_capabilities = dict()
+        with self._write_lock:
+            self._state = InMemoryDeviceCacheState()
+
+    def new_generation(self) -> 'InMemoryDeviceCache':
+        return InMemoryDeviceCache()
+
+    def swap_generation(self, generation: DeviceCache) -> None:
+        assert isinstance(generation, InMemoryDeviceCache)
+        with self._write_lock:
+            self._state = generation._state
+
+    def batch(self) -> AbstractContextManager:
+        return self._batch()
+
+    @contextmanager
+    def _batch(self) -> Iterator[None]:
+        with self._write_lock:
+            if self._emptied is not None:
+                yield
+                return
+
+            self._emptied = []
+            try:
+                yield
+            finally:
+                emptied, self._emptied = self._emptied, None
+                for alias_index, k in emptied:
+                    if k in alias_index and not alias_index[k]:
+                        del alias_index[k]
+
+    def _update_aliases(self, index_name: str, k: Any, alias: DeviceAlias, add: bool) -> None:
+        alias = _intern(alias)
+        with self._write_lock:
+            # Resolved under the lock, or a concurrent swap_generation(),
+            # clear() or load_snapshot() could leave the write on a discarded
+            # state
+            index = getattr(self._state, index_name)
+            aliases = index.get(k)
+            if add:
+                if aliases is None:
+                    aliases = index[k] = set()
+                elif alias in aliases:
+                    return
+                aliases.add(alias)
+            else:
+                if aliases is None or alias not in aliases:
+                    return
+                aliases.discard(alias)
+                if not aliases:
+                    if self._emptied is None:
+                        del index[k]
+                    else:
+                        self._emptied.append((index, k))
+            index.views.pop(k, None)
+
+    def _get_aliases(self, index: AliasIndex, k: Any) -> set[DeviceAlias]:
+        aliases = index.views.get(k)
+        if aliases is None:
+            # A key that isn't there was empty before any batch in progress
+            if k not in index:
+                return EMPTY_SET
+            with self._write_lock:
+                aliases = index.views.get(k)
+                if aliases is None:
+                    members = index.get(k)
+                    if not members:
+                        return EMPTY_SET
+                    aliases = index.views[k] = ReadOnlySet(members)
+        return aliases
+
+    def save_snapshot(self, path: str) -> None:
+        with self._write_lock:
+            snapshot = self._to_snapshot()
+
+        # Write then rename so a crash never leaves a truncated snapshot
+        # behind, to a file of this thread's own so concurrent saves don't
+        # interleave
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def _to_snapshot(self) -> dict:
+        state = self._state
+        return {
+            'format': SNAPSHOT_FORMAT,
+            'version': SNAPSHOT_VERSION,
+            'cap_to_aliases': [
+                [cap, sorted(aliases)]
+                for cap, aliases in state.cached_cap_to_aliases.items()
+            ],
+            'cap_to_room_to_aliases': [
+                [cap, room, sorted(aliases)]
+                for (cap, room), aliases in state.cached_cap_and_room_to_aliases.items()
+            ],
+            'cap_to_attr_to_aliases': [
+                [*k, sorted(aliases)]
+                for k, aliases in state.cached_cap_to_attr_to_aliases.items()
+            ],
+            'cap_to_alias_to_attr': [
+                [*k, v]
+                for k, v in state.cached_cap_to_alias_to_attr.items()
+            ],
+            'cap_to_alias_to_attr_to_timestamp': [
+                [*k, v]
+                for k, v in state.cached_cap_to_alias_to_attr_to_timestamp.items()
+            ],
+            'device_id_to_capabilities': [
+                [device_id, sorted(capabilities)]
+                for device_id, capabilities in state.cached_device_id_to_capabilities.items()
+            ],
+            'alias_to_attr_number': [
+                [*k, v]
+                for k, v in state.cached_alias_to_attr_number.items()
+            ],
+        }
+
+    def load_snapshot(self, path: str) -> None:
+        with open(path) as f:
+            snapshot = json.load(f)
+        if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported device cache snapshot in {path}')
+
+        def intern_all(values: list) -> tuple:
+            return tuple(_intern(v) for v in values)
+
+        def alias_set(aliases: list) -> set:
+            return set(intern_all(aliases))
+
+        state = InMemoryDeviceCacheState()
+        for cap, aliases in snapshot['cap_to_aliases']:
+            state.cached_cap_to_aliases[_intern(cap)] = alias_set(aliases)
+        for cap, room, aliases in snapshot['cap_to_room_to_aliases']:
+            state.cached_cap_and_room_to_aliases[intern_all([cap, room])] = alias_set(aliases)
+        for cap, attr_key, attr_value, aliases in snapshot['cap_to_attr_to_aliases']:
+            state.cached_cap_to_attr_to_aliases[intern_all([cap, attr_key, attr_value])] = alias_set(aliases)
+        for cap, alias, attr_key, attr_value in snapshot['cap_to_alias_to_attr']:
+            state.cached_cap_to_alias_to_attr[intern_all([cap, alias, attr_key])] = attr_value
+        for cap, alias, attr_key, attr_value, timestamp in snapshot['cap_to_alias_to_attr_to_timestamp']:
+            state.cached_cap_to_alias_to_attr_to_timestamp[intern_all([cap, alias, attr_key, attr_value])] = timestamp
+        for device_id, capabilities in snapshot['device_id_to_capabilities']:
+            state.cached_device_id_to_capabilities[device_id] = ReadOnlySet(intern_all(capabilities))
+        numbers: dict = {}
+        for alias, attr_key, number in snapshot['alias_to_attr_number']:
+            alias, attr_key = intern_all([alias, attr_key])
+            state.cached_alias_to_attr_number[(alias, attr_key)] = number
+            numbers.setdefault(attr_key, []).append((number, alias))
+        for attr_key, entries in numbers.items():
+            state.cached_attr_to_sorted_numbers[attr_key] = SortedNumbers(entries)
+        with self._write_lock:
+            self._state = state
 
     def add_device_for_capability(self, capability: CapabilityName, alias: DeviceAlias) -> None:
-        self.cached_cap_to_aliases[capability].add(alias)
+        self._update_aliases('cached_cap_to_aliases', _intern(capability), alias, add=True)
 
     def remove_device_for_capability(self, capability: CapabilityName, alias: DeviceAlias) -> None:
-        self.cached_cap_to_aliases[capability].remove(alias)
+        self._update_aliases('cached_cap_to_aliases', _intern(capability), alias, add=False)
 
     def add_device_for_capability_and_room(self, capability: CapabilityName, room: RoomName | None, alias: DeviceAlias) -> None:
-        self.cached_cap_to_room_to_aliases[capability][room].add(alias)
+        k = (_intern(capability), _intern(room))
+        self._update_aliases('cached_cap_and_room_to_aliases', k, alias, add=True)
 
     def remove_device_for_capability_and_room(self, capability: CapabilityName, room: RoomName | None, alias: DeviceAlias) -> None:
-        self.cached_cap_to_room_to_aliases[capability][room].remove(alias)
+        k = (_intern(capability), _intern(room))
+        self._update_aliases('cached_cap_and_room_to_aliases', k, alias, add=False)
 
     def add_device_for_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str, alias: DeviceAlias) -> None:
-        k = (capability, attr_key, attr_value)
-        self.cached_cap_to_attr_to_aliases[k].add(alias)
+        k = (_intern(capability), _intern(attr_key), _intern(attr_value))
+        self._update_aliases('cached_cap_to_attr_to_aliases', k, alias, add=True)
 
     def remove_device_for_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str, alias: DeviceAlias) -> None:
-        k = (capability, attr_key, attr_value)
-        self.cached_cap_to_attr_to_aliases[k].remove(alias)
+        k = (_intern(capability), _intern(attr_key), _intern(attr_value))
+        self._update_aliases('cached_cap_to_attr_to_aliases', k, alias, add=False)
 
     def set_capabilities_for_device_id(self, device_id: int, capabilities: set[CapabilityName]) -> None:
-        self.cached_device_id_to_capabilities[device_id] = capabilities
+        capabilities = ReadOnlySet(_intern(c) for c in capabilities)
+        with self._write_lock:
+            self._state.cached_device_id_to_capabilities[device_id] = capabilities
 
     def set_last_device_attr_value(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str, attr_value: str | None) -> None:
-        k = (capability, alias, attr_key)
-        self.cached_cap_to_alias_to_attr[k] = attr_value
+        k = (_intern(capability), _intern(alias), _intern(attr_key))
+        with self._write_lock:
+            self._state.cached_cap_to_alias_to_attr[k] = attr_value
 
     def set_last_device_attr_timestamp(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str, attr_value: str | None, timestamp: int) -> None:
-        k = (capability, alias, attr_key, attr_value)
-        self.cached_cap_to_alias_to_attr_to_timestamp[k] = timestamp
+        k = (_intern(capability), _intern(alias), _intern(attr_key), attr_value)
+        with self._write_lock:
+            self._state.cached_cap_to_alias_to_attr_to_timestamp[k] = timestamp
+
+    def set_device_attr_number(self, alias: DeviceAlias, attr_key: str, value: float | None) -> None:
+        alias, attr_key = _intern(alias), _intern(attr_key)
+        with self._write_lock:
+            state = self._state
+            old_value = state.cached_alias_to_attr_number.get((alias, attr_key))
+            if old_value == value:
+                return
+
+            index = state.cached_attr_to_sorted_numbers
+            numbers = index.get(attr_key)
+            if numbers is None:
+                numbers = index[attr_key] = SortedNumbers()
+            if old_value is not None:
+                numbers.remove((old_value, alias))
+            if value is not None:
+                numbers.add((value, alias))
+                state.cached_alias_to_attr_number[(alias, attr_key)] = value
+            else:
+                state.cached_alias_to_attr_number.pop((alias, attr_key), None)
+            if not numbers:
+                del index[attr_key]
 
     # Cache accessors
 
     def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
-        return self.cached_cap_to_aliases[capability]
+        return self._get_aliases(self._state.cached_cap_to_aliases, capability)
 
     def get_devices_by_capability_and_room(self, capability: CapabilityName, room: RoomName | None) -> set[DeviceAlias]:
-        return self.cached_cap_to_room_to_aliases[capability]
+        return self._get_aliases(self._state.cached_cap_and_room_to_aliases, (capability, room))
 
     def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str) -> set[DeviceAlias]:
         k = (capability, attr_key, attr_value)
-        return self.cached_cap_to_attr_to_aliases.get(k)
+        return self._get_aliases(self._state.cached_cap_to_attr_to_aliases, k)
+
+    def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: str, lo: float | None, hi: float | None) -> set[DeviceAlias]:
+        aliases = self.get_devices_by_capability(capability)
+        with self._write_lock:
+            numbers = self._state.cached_attr_to_sorted_numbers.get(attr_key)
+            if not numbers or not aliases:
+                return EMPTY_SET
+            return ReadOnlySet(alias for alias in numbers.aliases_in_range(lo, hi) if alias in aliases)
 
     def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
-        return self.cached_device_id_to_capabilities.get(device_id, set())
+        return self._state.cached_device_id_to_capabilities.get(device_id, EMPTY_SET)
 
     def get_last_device_attr_value(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str) -> str | None:
         k = (capability, alias, attr_key)
-        return self.cached_cap_to_alias_to_attr.get(k)
+        return self._state.cached_cap_to_alias_to_attr.get(k)
 
     def get_last_device_attr_timestamp(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str | None, attr_value: str | None) -> int | None:
         k = (capability, alias, attr_key, attr_value)
-        return self.cached_cap_to_alias_to_attr_to_timestamp.get(k)
+        return self._state.cached_cap_to_alias_to_attr_to_timestamp.get(k)
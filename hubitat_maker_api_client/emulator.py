@@ -0,0 +1,364 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Callable
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.constants import HSM_ACTION_ARM_AWAY
+from hubitat_maker_api_client.constants import HSM_ACTION_ARM_HOME
+from hubitat_maker_api_client.constants import HSM_ACTION_ARM_NIGHT
+from hubitat_maker_api_client.constants import HSM_ACTION_DISARM
+from hubitat_maker_api_client.constants import HSM_ACTION_DISARM_ALL
+from hubitat_maker_api_client.constants import HSM_STATE_ALL_DISARMED
+from hubitat_maker_api_client.constants import HSM_STATE_ARMED_AWAY
+from hubitat_maker_api_client.constants import HSM_STATE_ARMED_HOME
+from hubitat_maker_api_client.constants import HSM_STATE_ARMED_NIGHT
+from hubitat_maker_api_client.constants import HSM_STATE_DISARMED
+
+
+DEFAULT_APP_ID = '1'
+DEFAULT_ACCESS_TOKEN = 'emulator-token'
+DEFAULT_NUM_DEVICES = 500
+DEFAULT_MODES = ['Day', 'Evening', 'Night', 'Away']
+
+HSM_ACTION_TO_STATE = {
+    HSM_ACTION_ARM_AWAY: HSM_STATE_ARMED_AWAY,
+    HSM_ACTION_ARM_HOME: HSM_STATE_ARMED_HOME,
+    HSM_ACTION_ARM_NIGHT: HSM_STATE_ARMED_NIGHT,
+    HSM_ACTION_DISARM: HSM_STATE_DISARMED,
+    HSM_ACTION_DISARM_ALL: HSM_STATE_ALL_DISARMED,
+}
+
+# (type, capabilities, attributes) of the devices a generated hub is made of
+DEVICE_TEMPLATES = [
+    ('Generic Zigbee Outlet', ['Switch', 'PowerMeter', 'EnergyMeter', 'Refresh', 'Actuator', 'Sensor'], {'switch': 'off', 'power': '0', 'energy': '0'}),
+    ('Generic Z-Wave Dimmer', ['Switch', 'SwitchLevel', 'Refresh', 'Actuator'], {'switch': 'off', 'level': '0'}),
+    ('Generic Zigbee Contact Sensor', ['ContactSensor', 'Battery', 'TemperatureMeasurement', 'Sensor'], {'contact': 'closed', 'battery': '100', 'temperature': '70'}),
+    ('Generic Zigbee Motion Sensor', ['MotionSensor', 'Battery', 'IlluminanceMeasurement', 'Sensor'], {'motion': 'inactive', 'battery': '100', 'illuminance': '30'}),
+    ('Generic Z-Wave Lock', ['Lock', 'Battery', 'Actuator'], {'lock': 'locked', 'battery': '100'}),
+    ('Virtual Presence', ['PresenceSensor', 'Sensor'], {'presence': 'present'}),
+]
+
+# command -> (attribute, value) it sets; None takes the value from the command
+COMMAND_EFFECTS: dict[str, tuple[str, str | None]] = {
+    'on': ('switch', 'on'),
+    'off': ('switch', 'off'),
+    'setLevel': ('level', None),
+    'lock': ('lock', 'locked'),
+    'unlock': ('lock', 'unlocked'),
+    'open': ('door', 'open'),
+    'close': ('door', 'closed'),
+    'arrived': ('presence', 'present'),
+    'departed': ('presence', 'not present'),
+    'setLux': ('illuminance', None),
+}
+
+
+def make_emulated_devices(num_devices: int = DEFAULT_NUM_DEVICES, num_rooms: int = 25, seed: int = 0) -> list[dict]:
+    # Devices in the /devices/all format, cycling through DEVICE_TEMPLATES
+    rng = random.Random(seed)
+    devices = []
+    for i in range(num_devices):
+        device_type, capabilities, attributes = DEVICE_TEMPLATES[i % len(DEVICE_TEMPLATES)]
+        devices.append({
+            'id': str(i + 1),
+            'name': device_type,
+            'label': f'{device_type.split()[-1]} {i + 1}',
+            'type': device_type,
+            'room': f'Room {rng.randrange(num_rooms)}',
+            'capabilities': list(capabilities),
+            'attributes': dict(attributes),
+            'date': format_hub_date(time.time()),
+        })
+    return devices
+
+
+def format_hub_date(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S%z')
+
+
+class HubEmulator:
+    # A local stand-in for a hub's Maker API app, serving /devices/all,
+    # /devices, /devices/{id}, device commands, /modes and /hsm over HTTP from
+    # a background thread. Commands change device state the way the hub would
+    # and are reported to event listeners, e.g. EventSocketEmulator. Every
+    # response is delayed by latency seconds to mimic a real hub. With
+    # chunk_delay, bodies are sent chunked, chunk_size bytes at a time with a
+    # pause before each chunk, like a slow hub streaming a large /devices/all.
+    #
+    #   with HubEmulator(num_devices=500, latency=0.005) as hub:
+    #       client = HubitatCachingClient(hub.make_api_client(), InMemoryDeviceCache())
+
+    def __init__(
+        self,
+        devices: list[dict] | None = None,
+        num_devices: int = DEFAULT_NUM_DEVICES,
+        latency: float = 0.0,
+        chunk_delay: float = 0.0,
+        chunk_size: int = 16 * 1024,
+        app_id: str = DEFAULT_APP_ID,
+        access_token: str = DEFAULT_ACCESS_TOKEN,
+        modes: list[str] = DEFAULT_MODES,
+        hsm: str = HSM_STATE_DISARMED,
+        location_name: str = 'Home',
+        host: str = '127.0.0.1',
+        port: int = 0,
+    ):
+        self.devices = devices if devices is not None else make_emulated_devices(num_devices)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.app_id = app_id
+        self.access_token = access_token
+        self.modes = [{'id': i + 1, 'name': name, 'active': i == 0} for i, name in enumerate(modes)]
+        self.hsm = hsm
+        self.location_name = location_name
+        self.request_counts: Counter = Counter()
+
+        self._device_id_to_device = {int(device['id']): device for device in self.devices}
+        self._event_listeners: list[Callable[[dict], None]] = []
+        self._lock = threading.Lock()
+        self._bind_host = host
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def host(self) -> str:
+        return f'http://{self._bind_host}:{self._server.server_port}'
+
+    def make_api_client(self, **kwargs) -> HubitatAPIClient:
+        return HubitatAPIClient(app_id=self.app_id, access_token=self.access_token, host=self.host, **kwargs)
+
+    def start(self) -> 'HubEmulator':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name='hubitat-emulator', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> 'HubEmulator':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    # Device state and events
+
+    def add_event_listener(self, listener: Callable[[dict], None]) -> None:
+        # listener is called with each event, in the eventsocket JSON format,
+        # on whichever thread changed the device
+        self._event_listeners.append(listener)
+
+    def set_device_attribute(self, device_id: int, attr_key: str, attr_value: Any, source: str = 'DEVICE') -> dict:
+        # Changes a device as if it had reported a new value, and emits the event
+        now = time.time()
+        with self._lock:
+            device = self._device_id_to_device[int(device_id)]
+            device['attributes'][attr_key] = str(attr_value)
+            device['date'] = format_hub_date(now)
+        event = {
+            'source': source,
+            'name': attr_key,
+            'displayName': device['label'],
+            'value': str(attr_value),
+            'type': 'physical',
+            'unit': None,
+            'deviceId': int(device_id),
+            'hubId': 0,
+            'installedAppId': 0,
+            'descriptionText': f'{device["label"]} {attr_key} is {attr_value}',
+            'date': device['date'],
+        }
+        self._emit(event)
+        return event
+
+    def _emit_location_event(self, attr_key: str, attr_value: str) -> None:
+        # Mode and HSM changes arrive on the eventsocket without a device
+        self._emit({
+            'source': 'LOCATION',
+            'name': attr_key,
+            'displayName': self.location_name,
+            'value': attr_value,
+            'type': None,
+            'unit': None,
+            'deviceId': None,
+            'hubId': 0,
+            'installedAppId': 0,
+            'descriptionText': f'{self.location_name} {attr_key} is {attr_value}',
+            'date': format_hub_date(time.time()),
+        })
+
+    def _emit(self, event: dict) -> None:
+        for listener in self._event_listeners:
+            listener(event)
+
+    def make_random_events(self, num_events: int, seed: int = 0) -> list[tuple[int, str, str]]:
+        # (device_id, attr_key, attr_value) changes drawn from the devices'
+        # own attributes, for set_device_attribute
+        rng = random.Random(seed)
+        changes = []
+        for _ in range(num_events):
+            device = rng.choice(self.devices)
+            attr_key = rng.choice(list(device['attributes']))
+            changes.append((int(device['id']), attr_key, random_attr_value(rng, attr_key)))
+        return changes
+
+    # Maker API
+
+    def _make_handler(self) -> type:
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, small
+            # responses on a kept-alive connection wait on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                status, payload = emulator._handle_get(self.path)
+                if emulator.latency:
+                    time.sleep(emulator.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if not emulator.chunk_delay:
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i in range(0, len(payload), emulator.chunk_size):
+                    time.sleep(emulator.chunk_delay)
+                    chunk = payload[i:i + emulator.chunk_size]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    self.wfile.flush()
+                self.wfile.write(b'0\r\n\r\n')
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def _handle_get(self, raw_path: str) -> tuple[int, bytes]:
+        url = urlsplit(raw_path)
+        if parse_qs(url.query).get('access_token') != [self.access_token]:
+            return 401, b'{"error":"Invalid access token"}'
+
+        prefix = f'/apps/api/{self.app_id}/'
+        parts = [unquote(part) for part in url.path[len(prefix):].split('/') if part]
+        with self._lock:
+            route = self._route(parts) if url.path.startswith(prefix) else None
+            if route is None:
+                return 404, b'{"error":"Not found"}'
+            name, response, events = route
+            self.request_counts[name] += 1
+            # Serialize while holding the lock so commands can't change a
+            # device halfway through
+            payload = json.dumps(response).encode()
+
+        for device_id, attr_key, attr_value in events:
+            if device_id is None:
+                self._emit_location_event(attr_key, attr_value)
+            else:
+                self.set_device_attribute(device_id, attr_key, attr_value)
+        return 200, payload
+
+    def _route(self, parts: list[str]) -> tuple[str, Any, list] | None:
+        # Returns (endpoint name, response, (device_id, attr_key, attr_value)
+        # changes to emit), or None for an unknown endpoint. A device_id of
+        # None is a location event. Requires _lock.
+        if parts == ['devices', 'all']:
+            return 'devices/all', self.devices, []
+        if parts == ['devices']:
+            return 'devices', [
+                {'id': d['id'], 'name': d['name'], 'label': d['label'], 'type': d['type'], 'room': d['room']}
+                for d in self.devices
+            ], []
+        if len(parts) >= 2 and parts[0] == 'devices' and parts[1].isdigit():
+            device = self._device_id_to_device.get(int(parts[1]))
+            if device is None:
+                return None
+            if len(parts) == 2:
+                return 'devices/{id}', device_detail(device), []
+            if len(parts) == 3 and parts[2] in ('events', 'commands', 'capabilities'):
+                return f'devices/{{id}}/{parts[2]}', [], []
+            effect = COMMAND_EFFECTS.get(parts[2])
+            events: list[tuple[int | None, str, Any]] = []
+            if effect is not None:
+                attr_key, attr_value = effect
+                if attr_value is None:
+                    attr_value = parts[3] if len(parts) > 3 else None
+                if attr_value is not None:
+                    events.append((int(device['id']), attr_key, attr_value))
+            return 'devices/{id}/{command}', device_detail(device), events
+        if parts == ['modes']:
+            return 'modes', self.modes, []
+        if len(parts) == 2 and parts[0] == 'modes' and parts[1].isdigit():
+            events = []
+            for mode in self.modes:
+                mode['active'] = mode['id'] == int(parts[1])
+                if mode['active']:
+                    events.append((None, 'mode', mode['name']))
+            return 'modes/{id}', self.modes, events
+        if parts == ['hsm']:
+            return 'hsm', {'hsm': self.hsm}, []
+        if len(parts) == 2 and parts[0] == 'hsm' and parts[1] in HSM_ACTION_TO_STATE:
+            self.hsm = HSM_ACTION_TO_STATE[parts[1]]
+            return 'hsm/{command}', {'hsm': self.hsm}, [(None, 'hsmStatus', self.hsm)]
+        return None
+
+
+def device_detail(device: dict) -> dict:
+    # The /devices/{id} format, which lists attributes as records
+    return {
+        'id': device['id'],
+        'name': device['name'],
+        'label': device['label'],
+        'type': device['type'],
+        'room': device['room'],
+        'attributes': [
+            {'name': k, 'currentValue': v, 'dataType': 'STRING'}
+            for k, v in device['attributes'].items()
+        ],
+        'capabilities': device['capabilities'],
+        'commands': [],
+    }
+
+
+def random_attr_value(rng: random.Random, attr_key: str) -> str:
+    if attr_key == 'switch':
+        return rng.choice(['on', 'off'])
+    elif attr_key == 'contact':
+        return rng.choice(['open', 'closed'])
+    elif attr_key == 'motion':
+        return rng.choice(['active', 'inactive'])
+    elif attr_key == 'lock':
+        return rng.choice(['locked', 'unlocked'])
+    elif attr_key == 'presence':
+        return rng.choice(['present', 'not present'])
+    elif attr_key in ('battery', 'level'):
+        return str(rng.randrange(101))
+    elif attr_key == 'temperature':
+        return str(rng.randrange(50, 90))
+    elif attr_key == 'power':
+        return str(round(rng.uniform(0, 2000), 1))
+    else:
+        return str(rng.randrange(1000))
@@ -1,12 +1,53 @@
+import json
 import time
+from datetime import datetime
+from typing import Any
+
+try:
+    import orjson
+    _json_loads: Any = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def _parse_hub_date(date: Any) -> int | None:
+    if not date:
+        return None
+    try:
+        return int(datetime.strptime(date, '%Y-%m-%dT%H:%M:%S%z').timestamp())
+    except (TypeError, ValueError):
+        return None
 
 
 class HubitatEvent:
-    def __init__(self, json_dict: dict):
-        self.device_id: int = json_dict['deviceId']
+    # Slotted, since the eventsocket can deliver thousands of these a second
+    # and they are buffered during cache rebuilds. The decoded payload is only
+    # kept in raw_event when asked for.
+    __slots__ = (
+        'device_id',
+        'device_label',
+        'attr_key',
+        'attr_value',
+        'source',
+        'timestamp',
+        'hub_timestamp',
+        'raw_event',
+    )
+
+    def __init__(self, json_dict: dict, keep_raw_event: bool = False):
+        device_id = json_dict['deviceId']
+        self.device_id: int | None = int(device_id) if device_id is not None else None
         self.device_label: str = json_dict['displayName']
         self.attr_key: str = json_dict['name']
         self.attr_value: str = json_dict['value']
         self.source: str = json_dict['source']
-        self.timestamp: int = int(time.time())
-        self.raw_event: dict = json_dict
+
+        # Prefer the time the hub says the event happened, if it sent one
+        self.hub_timestamp: int | None = _parse_hub_date(json_dict.get('date'))
+        self.timestamp: int = self.hub_timestamp if self.hub_timestamp is not None else int(time.time())
+        self.raw_event: dict | None = json_dict if keep_raw_event else None
+
+    @classmethod
+    def from_bytes(cls, message: bytes | str, keep_raw_event: bool = False) -> 'HubitatEvent':
+        # Decodes an eventsocket message, with orjson when it is installed
+        return cls(_json_loads(message), keep_raw_event)
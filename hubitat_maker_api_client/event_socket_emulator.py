@@ -0,0 +1,98 @@
+import asyncio
+import json
+from typing import Any
+
+from websockets.asyncio.server import ServerConnection
+from websockets.asyncio.server import broadcast
+from websockets.asyncio.server import serve
+
+from hubitat_maker_api_client.emulator import HubEmulator
+
+
+class EventSocketEmulator:
+    # Serves a HubEmulator's /eventsocket: every change to one of its devices,
+    # whether from a command or from send_events(), is broadcast to connected
+    # clients in the hub's JSON format.
+    #
+    #   async with EventSocketEmulator(hub) as event_socket:
+    #       listener = EventSocketListener(client, event_socket.uri)
+    #       await event_socket.send_events(hub.make_random_events(10000), rate=1000)
+
+    def __init__(self, hub: HubEmulator, host: str = '127.0.0.1', port: int = 0):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.events_sent = 0
+        self._server: Any = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._connected = asyncio.Condition()
+
+    @property
+    def uri(self) -> str:
+        return f'ws://{self.host}:{self.port}/eventsocket'
+
+    @property
+    def num_clients(self) -> int:
+        return len(self._server.connections) if self._server is not None else 0
+
+    async def start(self) -> 'EventSocketEmulator':
+        self._loop = asyncio.get_running_loop()
+        self._server = await serve(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.hub.add_event_listener(self._on_hub_event)
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> 'EventSocketEmulator':
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def wait_for_clients(self, num_clients: int = 1, timeout: float = 5.0) -> None:
+        async with self._connected:
+            await asyncio.wait_for(self._connected.wait_for(lambda: self.num_clients >= num_clients), timeout)
+
+    async def send_events(self, changes: list[tuple[int, str, str]], rate: float | None = None) -> None:
+        # Applies (device_id, attr_key, attr_value) changes to the hub, which
+        # broadcasts them; rate caps them at that many per second
+        interval = 1 / rate if rate else 0.0
+        start = self._loop.time() if self._loop is not None else 0.0
+        for i, (device_id, attr_key, attr_value) in enumerate(changes):
+            self.hub.set_device_attribute(device_id, attr_key, attr_value)
+            if interval:
+                delay = start + (i + 1) * interval - asyncio.get_running_loop().time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 100 == 99:
+                # Let the socket writers drain
+                await asyncio.sleep(0)
+
+    async def _handle_connection(self, websocket: ServerConnection) -> None:
+        async with self._connected:
+            self._connected.notify_all()
+        await websocket.wait_closed()
+
+    def _on_hub_event(self, event: dict) -> None:
+        # Called on whichever thread changed the device
+        if self._loop is None or self._loop.is_closed():
+            return
+        message = json.dumps(event)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._broadcast(message)
+        else:
+            self._loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _broadcast(self, message: str) -> None:
+        if self._server is not None:
+            broadcast(self._server.connections, message)
+            self.events_sent += 1
@@ -0,0 +1,245 @@
+import asyncio
+from typing import Any
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+from websockets.exceptions import InvalidHandshake
+
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_RESYNC = 'resync'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_RESYNC)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MIN_RECONNECT_DELAY = 1.0
+DEFAULT_MAX_RECONNECT_DELAY = 60.0
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_BATCH_WINDOW = 0.0
+
+# Queued in place of an event to make the writer resync the client with the hub
+_RESYNC = object()
+
+
+class EventSocketListener:
+    # Reads the hub's /eventsocket on the event loop and applies events to the
+    # client from a separate writer task, so a slow cache write never stalls
+    # the socket. The two are decoupled by a bounded queue whose overflow
+    # behaviour is set by overflow_policy:
+    #   block: stop reading the socket until the writer catches up
+    #   drop_oldest / drop_newest: discard an event to make room
+    #   resync: discard everything queued and reload the client from the hub
+    # After a reconnect the client is always resynced, since events sent while
+    # the socket was down are lost. A resync that fails, e.g. because the hub
+    # is unreachable, is retried with the same backoff as reconnects.
+    #
+    # With batch_size > 1 the writer waits up to batch_window seconds for more
+    # events and hands the whole batch to update_from_hubitat_events(), which
+    # coalesces bursts (e.g. power meter updates) into a single cache write.
+
+    def __init__(
+        self,
+        client: HubitatClient,
+        uri: str,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        min_reconnect_delay: float = DEFAULT_MIN_RECONNECT_DELAY,
+        max_reconnect_delay: float = DEFAULT_MAX_RECONNECT_DELAY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow_policy}')
+
+        self.client = client
+        self.uri = uri
+        self.overflow_policy = overflow_policy
+        self.min_reconnect_delay = min_reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+
+        self.events_received = 0
+        self.events_applied = 0
+        self.events_dropped = 0
+        self.reconnects = 0
+        self.resyncs = 0
+        self.last_error: Exception | None = None
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._stopped = asyncio.Event()
+        self._websocket: Any = None
+        self._resync_delay = min_reconnect_delay
+        self._resync_retry: asyncio.TimerHandle | None = None
+
+    async def run(self) -> None:
+        writer = asyncio.create_task(self._write_events())
+        try:
+            await self._read_events()
+            await self._queue.join()
+        finally:
+            if self._resync_retry is not None:
+                self._resync_retry.cancel()
+            writer.cancel()
+            try:
+                await writer
+            except asyncio.CancelledError:
+                pass
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._websocket is not None:
+            await self._websocket.close()
+
+    # Socket reader
+
+    async def _read_events(self) -> None:
+        delay = self.min_reconnect_delay
+        connected_before = False
+        while not self._stopped.is_set():
+            try:
+                async with websockets.connect(self.uri) as websocket:
+                    self._websocket = websocket
+                    if connected_before:
+                        self.reconnects += 1
+                        await self._enqueue_resync()
+                    connected_before = True
+                    delay = self.min_reconnect_delay
+
+                    async for message in websocket:
+                        try:
+                            event = HubitatEvent.from_bytes(message)
+                        except (ValueError, KeyError, TypeError):
+                            continue
+                        self.events_received += 1
+                        await self._enqueue(event)
+            except (OSError, ConnectionClosed, InvalidHandshake, asyncio.TimeoutError) as e:
+                self.last_error = e
+            finally:
+                self._websocket = None
+
+            try:
+                await asyncio.wait_for(self._stopped.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _enqueue(self, event: HubitatEvent) -> None:
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            await self._queue.put(event)
+            return
+
+        try:
+            self._queue.put_nowait(event)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+            self.events_dropped += 1
+        elif self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            self.events_dropped += 1
+            if self._take_nowait() is _RESYNC:
+                # The pending resync already covers everything behind it
+                self._replace_queue_with_resync()
+            else:
+                self._queue.put_nowait(event)
+        else:
+            self._replace_queue_with_resync()
+            self.events_dropped += 1
+
+    async def _enqueue_resync(self) -> None:
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            await self._queue.put(_RESYNC)
+        else:
+            self._replace_queue_with_resync()
+
+    def _take_nowait(self) -> Any:
+        item = self._queue.get_nowait()
+        self._queue.task_done()
+        return item
+
+    def _replace_queue_with_resync(self) -> None:
+        while not self._queue.empty():
+            if self._take_nowait() is not _RESYNC:
+                self.events_dropped += 1
+        self._queue.put_nowait(_RESYNC)
+
+    # Cache writer
+
+    async def _write_events(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            events = [item for item in batch if item is not _RESYNC]
+            try:
+                if events:
+                    await asyncio.to_thread(self._apply_events, events)
+                    self.events_applied += len(events)
+                if batch[-1] is _RESYNC:
+                    await self._resync()
+            except Exception as e:
+                # The client may have missed these events, so reload it from
+                # the hub rather than keep applying events on top of it
+                self.last_error = e
+                if batch[-1] is _RESYNC:
+                    self._schedule_resync_retry()
+                else:
+                    self._replace_queue_with_resync()
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _next_batch(self) -> list:
+        # A resync always ends a batch, so events queued behind it are applied
+        # on top of the reloaded state
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        while batch[-1] is not _RESYNC and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _apply_events(self, events: list[HubitatEvent]) -> None:
+        if len(events) == 1:
+            self.client.update_from_hubitat_event(events[0])
+        else:
+            self.client.update_from_hubitat_events(events)
+
+    async def _resync(self) -> None:
+        self.resyncs += 1
+        if isinstance(self.client, HubitatCachingClient):
+            await asyncio.to_thread(self.client.reconcile)
+        else:
+            self.client.mark_event_gap()
+        self._resync_delay = self.min_reconnect_delay
+
+    def _schedule_resync_retry(self) -> None:
+        # Events keep being applied meanwhile; the retry discards whatever is
+        # queued by then, since the reload covers it
+        if self._stopped.is_set() or self._resync_retry is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._resync_retry = loop.call_later(self._resync_delay, self._retry_resync)
+        self._resync_delay = min(self._resync_delay * 2, self.max_reconnect_delay)
+
+    def _retry_resync(self) -> None:
+        self._resync_retry = None
+        if not self._stopped.is_set():
+            self._replace_queue_with_resync()
@@ -0,0 +1,282 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Callable
+
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.capabilities import CapabilityAttrKey
+from hubitat_maker_api_client.capabilities import CapabilityName
+from hubitat_maker_api_client.client import AttrPredicate
+from hubitat_maker_api_client.client import DeviceAlias
+from hubitat_maker_api_client.client import DeviceCommand
+from hubitat_maker_api_client.client import DeviceCommandResult
+from hubitat_maker_api_client.client import DeviceSnapshot
+from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.client import RoomName
+from hubitat_maker_api_client.errors import DeviceNotFoundError
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+DEFAULT_HUB_SEPARATOR = '/'
+# Fan-outs that can run at once, e.g. from several threads, before they queue
+# for the shared pool
+DEFAULT_MAX_CONCURRENT_CALLS = 8
+
+HubName = str
+
+
+def _per_hub_only(name: str) -> Callable[..., Any]:
+    def method(self: 'FederatedHubitatClient', *args: Any, **kwargs: Any) -> Any:
+        raise NotImplementedError(f'FederatedHubitatClient has no {name} of its own; call it on one of hub_clients')
+    return method
+
+
+class FederatedHubitatClient(HubitatClient):
+    # Presents several hubs as one. Devices are addressed by hub-qualified
+    # aliases, '<hub><separator><alias>', so the same label on two hubs stays
+    # distinct; rooms are not qualified, so a room name covers that room on
+    # every hub. Reads fan out to all hubs in parallel and commands go to the
+    # hub that owns the device, so latency follows the slowest hub rather than
+    # the sum of them.
+    #
+    # Each hub is an ordinary HubitatClient or HubitatCachingClient. The
+    # accessors and commands inherited from HubitatClient are all built on the
+    # methods overridden here, so there is no api_client of its own and
+    # HubitatClient.__init__ is not called. The private HubitatClient helpers
+    # that would reach a hub's API or snapshots are blocked below.
+
+    _get_device_snapshot = _per_hub_only('_get_device_snapshot')
+    _refresh_device_snapshot = _per_hub_only('_refresh_device_snapshot')
+    _get_identity_snapshot = _per_hub_only('_get_identity_snapshot')
+    _refresh_identity_snapshot = _per_hub_only('_refresh_identity_snapshot')
+    _refresh_identity_snapshot_from_all_devices = _per_hub_only('_refresh_identity_snapshot_from_all_devices')
+    _get_capability_to_alias_to_device_ids = _per_hub_only('_get_capability_to_alias_to_device_ids')
+    _get_capability_to_room_to_aliases = _per_hub_only('_get_capability_to_room_to_aliases')
+    _get_capability_to_alias_to_attributes = _per_hub_only('_get_capability_to_alias_to_attributes')
+    _get_capability_to_alias_to_attributes_from_api = _per_hub_only('_get_capability_to_alias_to_attributes_from_api')
+    _get_device_attributes_by_id = _per_hub_only('_get_device_attributes_by_id')
+    _invalidate_device_attributes = _per_hub_only('_invalidate_device_attributes')
+    _get_mode_from_api = _per_hub_only('_get_mode_from_api')
+    _get_mode_name_to_id = _per_hub_only('_get_mode_name_to_id')  # type: ignore[assignment]
+    _get_hsm_from_api = _per_hub_only('_get_hsm_from_api')
+
+    def __init__(
+        self,
+        hub_clients: dict[HubName, HubitatClient],
+        separator: str = DEFAULT_HUB_SEPARATOR,
+        max_concurrent_calls: int = DEFAULT_MAX_CONCURRENT_CALLS,
+    ):
+        for hub in hub_clients:
+            if separator in hub:
+                raise ValueError(f'Hub name {hub!r} may not contain {separator!r}')
+
+        self.hub_clients = dict(hub_clients)
+        self.separator = separator
+        self.alias_key = 'label'
+        self.max_command_concurrency = max(len(hub_clients), 1)
+        # Each fan-out takes a worker per hub; the pool starts threads only as
+        # they are needed
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_command_concurrency * max_concurrent_calls,
+            thread_name_prefix='hubitat-federation',
+        )
+
+    @classmethod
+    def create(
+        cls,
+        hub_client_factories: dict[HubName, Callable[[], HubitatClient]],
+        separator: str = DEFAULT_HUB_SEPARATOR,
+        max_concurrent_calls: int = DEFAULT_MAX_CONCURRENT_CALLS,
+    ) -> 'FederatedHubitatClient':
+        # Builds the hub clients in parallel, so hubs whose constructor loads
+        # a cache (HubitatCachingClient) start up concurrently
+        with ThreadPoolExecutor(max_workers=max(len(hub_client_factories), 1)) as executor:
+            futures = {hub: executor.submit(factory) for hub, factory in hub_client_factories.items()}
+            return cls({hub: future.result() for hub, future in futures.items()}, separator, max_concurrent_calls)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self) -> 'FederatedHubitatClient':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def qualify_alias(self, hub: HubName, alias: DeviceAlias) -> DeviceAlias:
+        return DeviceAlias(f'{hub}{self.separator}{alias}')
+
+    def split_alias(self, qualified_alias: DeviceAlias) -> tuple[HubName, DeviceAlias]:
+        hub, separator, alias = qualified_alias.partition(self.separator)
+        if not separator or hub not in self.hub_clients:
+            raise DeviceNotFoundError(f'Unable to find hub for {qualified_alias}')
+        return hub, DeviceAlias(alias)
+
+    def _fan_out(self, call: Callable[[HubitatClient], Any]) -> dict[HubName, Any]:
+        # Calls every hub client at once and waits for all of them, so a call
+        # like set_mode has reached every hub before the first hub error, in
+        # hub order, is raised
+        futures = {hub: self._executor.submit(call, client) for hub, client in self.hub_clients.items()}
+        wait(futures.values())
+        return {hub: future.result() for hub, future in futures.items()}
+
+    def _fan_out_aliases(self, call: Callable[[HubitatClient], set[DeviceAlias]]) -> set[DeviceAlias]:
+        return {
+            self.qualify_alias(hub, alias)
+            for hub, aliases in self._fan_out(call).items()
+            for alias in aliases
+        }
+
+    # Cache loading
+
+    def load_cache(self) -> None:
+        # Reloads every hub in parallel: caching clients rebuild their cache,
+        # plain clients refetch their device snapshot
+        def load(client: HubitatClient) -> None:
+            if isinstance(client, HubitatCachingClient):
+                client.rebuild_cache()
+            else:
+                client.refresh_device_snapshot()
+        self._fan_out(load)
+
+    def reconcile(self) -> None:
+        # Like load_cache, but caching clients only write what changed
+        def reconcile(client: HubitatClient) -> None:
+            if isinstance(client, HubitatCachingClient):
+                client.reconcile()
+            else:
+                client.refresh_device_snapshot()
+        self._fan_out(reconcile)
+
+    # The hubs' snapshots can't be merged into one, since device ids are only
+    # unique within a hub
+    def refresh_device_snapshot(self) -> DeviceSnapshot:
+        raise NotImplementedError('FederatedHubitatClient has no device snapshot of its own; use load_cache() or reconcile() to refresh every hub')
+
+    def refresh_identity_snapshot(self) -> DeviceSnapshot:
+        raise NotImplementedError('FederatedHubitatClient has no device snapshot of its own; use load_cache() or reconcile() to refresh every hub')
+
+    def invalidate_device_snapshot(self) -> None:
+        for client in self.hub_clients.values():
+            client.invalidate_device_snapshot()
+
+    # Events
+
+    def update_from_hubitat_event(self, event: HubitatEvent, hub: HubName | None = None) -> None:
+        # Events carry no hub, so the caller must say which hub's eventsocket
+        # delivered it
+        if hub not in self.hub_clients:
+            raise ValueError(f'Unknown hub for event: {hub!r}')
+        self.hub_clients[hub].update_from_hubitat_event(event)
+
+    def update_from_hubitat_events(self, events: list[HubitatEvent], hub: HubName | None = None) -> None:
+        if hub not in self.hub_clients:
+            raise ValueError(f'Unknown hub for events: {hub!r}')
+        self.hub_clients[hub].update_from_hubitat_events(events)
+
+    def mark_event_gap(self) -> None:
+        for client in self.hub_clients.values():
+            client.mark_event_gap()
+
+    # Devices
+
+    def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
+        return self._fan_out_aliases(lambda client: client.get_devices_by_capability(capability))
+
+    def get_devices_by_capability_and_room(self, capability: CapabilityName, room: RoomName | None) -> set[DeviceAlias]:
+        return self._fan_out_aliases(lambda client: client.get_devices_by_capability_and_room(capability, room))
+
+    def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: CapabilityAttrKey, attr_value: str) -> set[DeviceAlias]:
+        return self._fan_out_aliases(lambda client: client.get_devices_by_capability_and_attribute(capability, attr_key, attr_value))
+
+    def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: CapabilityAttrKey, lo: float | None = None, hi: float | None = None) -> set[DeviceAlias]:
+        return self._fan_out_aliases(lambda client: client.get_devices_by_attribute_range(capability, attr_key, lo, hi))
+
+    def query(self, capability: CapabilityName, room: RoomName | None = None, attrs: dict[str, AttrPredicate] | None = None) -> set[DeviceAlias]:
+        return self._fan_out_aliases(lambda client: client.query(capability, room, attrs))
+
+    def get_capabilities_for_device_id(self, device_id: int, hub: HubName | None = None) -> set[CapabilityName]:
+        # Device ids are only unique within a hub
+        if hub not in self.hub_clients:
+            raise ValueError(f'Unknown hub for device id {device_id}: {hub!r}')
+        return self.hub_clients[hub].get_capabilities_for_device_id(device_id)
+
+    def get_device_attributes(self, alias: DeviceAlias, capability: CapabilityName | None = None) -> dict[str, Any]:
+        hub, hub_alias = self.split_alias(alias)
+        return self.hub_clients[hub].get_device_attributes(hub_alias, capability)
+
+    def send_commands(self, commands: list[DeviceCommand], max_concurrency: int | None = None) -> list[DeviceCommandResult]:
+        # Splits the commands by owning hub and sends each hub its share in
+        # parallel; results keep the order and qualified aliases of commands
+        results: list[DeviceCommandResult | None] = [None] * len(commands)
+        hub_to_indexed_commands: dict[HubName, list[tuple[int, DeviceCommand]]] = {}
+        for i, (capability, qualified_alias, command_name, *secondary_values) in enumerate(commands):
+            try:
+                hub, alias = self.split_alias(qualified_alias)
+            except DeviceNotFoundError as e:
+                results[i] = DeviceCommandResult(capability, qualified_alias, command_name, tuple(secondary_values), error=e)
+                continue
+            hub_to_indexed_commands.setdefault(hub, []).append((i, (capability, alias, command_name, *secondary_values)))
+
+        futures = {
+            hub: self._executor.submit(
+                self.hub_clients[hub].send_commands,
+                [command for _, command in indexed_commands],
+                max_concurrency,
+            )
+            for hub, indexed_commands in hub_to_indexed_commands.items()
+        }
+        for hub, future in futures.items():
+            for (i, _), result in zip(hub_to_indexed_commands[hub], future.result()):
+                result.alias = self.qualify_alias(hub, result.alias)
+                results[i] = result
+        return results  # type: ignore
+
+    # Last values seen by a hub's HubitatCachingClient
+    def get_last_device_value(self, alias: DeviceAlias, attr_key: CapabilityAttrKey, capability: CapabilityName | None = None) -> str | None:
+        client, hub_alias = self._caching_client_for_alias(alias)
+        return client.get_last_device_value(hub_alias, attr_key, capability)
+
+    def get_last_device_timestamp(self, alias: DeviceAlias, attr_key: CapabilityAttrKey, attr_value: str, capability: CapabilityName | None = None) -> int | None:
+        client, hub_alias = self._caching_client_for_alias(alias)
+        return client.get_last_device_timestamp(hub_alias, attr_key, attr_value, capability)
+
+    def _caching_client_for_alias(self, qualified_alias: DeviceAlias) -> tuple[HubitatCachingClient, DeviceAlias]:
+        hub, alias = self.split_alias(qualified_alias)
+        client = self.hub_clients[hub]
+        if not isinstance(client, HubitatCachingClient):
+            raise TypeError(f'Hub {hub} is not served by a HubitatCachingClient')
+        return client, alias
+
+    # Capabilities
+    def get_capabilities(self, supported_only: bool = True) -> set[CapabilityName]:
+        return set().union(*self._fan_out(lambda client: client.get_capabilities(supported_only)).values())
+
+    # Rooms
+    def get_rooms(self) -> set[RoomName]:
+        return set().union(*self._fan_out(lambda client: client.get_rooms()).values())
+
+    # Mode and HSM apply to the whole site: setting them sets every hub, and
+    # reading them returns the value the hubs agree on, or None if they don't
+    def get_mode(self) -> str | None:
+        return self._agreed_value(self._fan_out(lambda client: client.get_mode()))
+
+    def set_mode(self, mode_name: str) -> None:
+        self._fan_out(lambda client: client.set_mode(mode_name))
+
+    def get_hsm(self) -> str | None:
+        return self._agreed_value(self._fan_out(lambda client: client.get_hsm()))
+
+    def set_hsm(self, hsm_state: str) -> None:
+        self._fan_out(lambda client: client.set_hsm(hsm_state))
+
+    def send_hsm_command(self, command: str) -> None:
+        self._fan_out(lambda client: client.send_hsm_command(command))
+
+    def _agreed_value(self, hub_to_value: dict[HubName, Any]) -> Any:
+        values = set(hub_to_value.values())
+        return values.pop() if len(values) == 1 else None
+
+    # Intercom
+    def get_intercom_rooms(self) -> set[RoomName]:
+        return set().union(*self._fan_out(lambda client: client.get_intercom_rooms()).values())
@@ -0,0 +1,224 @@
+from contextlib import ExitStack
+from contextlib import nullcontext
+import math
+import threading
+import time
+from typing import Any
+from typing import ContextManager
+
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+# Metrics emitted by the clients. Labels: endpoint for requests, cache for
+# cache lookups.
+REQUEST_SECONDS = 'hubitat_request_seconds'
+RESPONSE_BYTES = 'hubitat_response_bytes_total'
+CACHE_HITS = 'hubitat_cache_hits_total'
+CACHE_MISSES = 'hubitat_cache_misses_total'
+LOAD_CACHE_SECONDS = 'hubitat_load_cache_seconds'
+EVENTS_APPLIED = 'hubitat_events_applied_total'
+EVENT_APPLY_SECONDS = 'hubitat_event_apply_seconds'
+# Time from the hub stamping an event to the client applying it. Hub dates
+# have one second resolution, so this is only accurate to about a second.
+EVENT_LAG_SECONDS = 'hubitat_event_lag_seconds'
+
+# Spans
+API_GET_SPAN = 'hubitat.api_get'
+LOAD_CACHE_SPAN = 'hubitat.load_cache'
+APPLY_EVENTS_SPAN = 'hubitat.apply_events'
+
+# Device endpoints that are not commands
+DEVICE_SUBRESOURCES = ('events', 'commands', 'capabilities')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_BUCKETS = {
+    LOAD_CACHE_SECONDS: (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+    EVENT_APPLY_SECONDS: (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.1),
+    EVENT_LAG_SECONDS: (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+}
+
+
+def endpoint_template(endpoint: str) -> str:
+    # Collapses ids and commands so the endpoint label has a bounded number
+    # of values, e.g. /devices/12/setLevel/50 -> /devices/{id}/{command}
+    parts = endpoint.strip('/').split('/')
+    if parts[0] == 'devices' and len(parts) > 1 and parts[1] != 'all':
+        template = ['devices', '{id}']
+        if len(parts) > 2:
+            template.append(parts[2] if parts[2] in DEVICE_SUBRESOURCES else '{command}')
+        parts = template
+    elif parts[0] == 'modes' and len(parts) > 1:
+        parts = ['modes', '{id}']
+    elif parts[0] == 'hsm' and len(parts) > 1:
+        parts = ['hsm', '{command}']
+    return '/' + '/'.join(parts)
+
+
+class Instrumentation:
+    # Hooks the clients call at each instrumented point; this base class
+    # drops everything. Callers check enabled before timing anything, so an
+    # uninstrumented client only pays for that attribute lookup.
+    enabled = False
+
+    def observe(self, name: str, value: float, labels: dict[str, str] | None = None) -> None:
+        pass
+
+    def increment(self, name: str, value: float = 1, labels: dict[str, str] | None = None) -> None:
+        pass
+
+    def span(self, name: str, attributes: dict[str, Any] | None = None) -> ContextManager:
+        return nullcontext()
+
+
+NOOP_INSTRUMENTATION = Instrumentation()
+
+
+def record_cache_lookup(instrumentation: Instrumentation, cache: str, hit: bool) -> None:
+    instrumentation.increment(CACHE_HITS if hit else CACHE_MISSES, labels={'cache': cache})
+
+
+def record_events_applied(instrumentation: Instrumentation, events: list[HubitatEvent], start: float) -> None:
+    # start is the time.perf_counter() reading from before applying events
+    instrumentation.observe(EVENT_APPLY_SECONDS, time.perf_counter() - start)
+    instrumentation.increment(EVENTS_APPLIED, len(events))
+    now = time.time()
+    for event in events:
+        if event.hub_timestamp is not None:
+            instrumentation.observe(EVENT_LAG_SECONDS, now - event.hub_timestamp)
+
+
+class CompositeInstrumentation(Instrumentation):
+    # Fans every call out, e.g. to a PrometheusInstrumentation for metrics
+    # and an OpenTelemetrySpanAdapter for traces
+    def __init__(self, *instrumentations: Instrumentation):
+        self.instrumentations = [i for i in instrumentations if i.enabled]
+        self.enabled = bool(self.instrumentations)
+
+    def observe(self, name: str, value: float, labels: dict[str, str] | None = None) -> None:
+        for instrumentation in self.instrumentations:
+            instrumentation.observe(name, value, labels)
+
+    def increment(self, name: str, value: float = 1, labels: dict[str, str] | None = None) -> None:
+        for instrumentation in self.instrumentations:
+            instrumentation.increment(name, value, labels)
+
+    def span(self, name: str, attributes: dict[str, Any] | None = None) -> ContextManager:
+        stack = ExitStack()
+        for instrumentation in self.instrumentations:
+            stack.enter_context(instrumentation.span(name, attributes))
+        return stack
+
+
+LabelsKey = tuple[tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.bucket_counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class PrometheusInstrumentation(Instrumentation):
+    # Aggregates observations into histograms and increments into counters,
+    # and renders them in the Prometheus text exposition format for a
+    # /metrics handler:
+    #
+    #   metrics = PrometheusInstrumentation()
+    #   api_client = HubitatAPIClient(..., instrumentation=metrics)
+    #   body = metrics.render()
+    enabled = True
+
+    def __init__(self, buckets: dict[str, tuple[float, ...]] | None = None):
+        self.buckets = {**METRIC_BUCKETS, **(buckets or {})}
+        self._counters: dict[str, dict[LabelsKey, float]] = {}
+        self._histograms: dict[str, dict[LabelsKey, _Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: dict[str, str] | None = None) -> None:
+        k = tuple(sorted(labels.items())) if labels else ()
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(k)
+            if histogram is None:
+                histogram = histograms[k] = _Histogram(self.buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, labels: dict[str, str] | None = None) -> None:
+        k = tuple(sorted(labels.items())) if labels else ()
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[k] = counters.get(k, 0) + value
+
+    def get_counter(self, name: str, labels: dict[str, str] | None = None) -> float:
+        k = tuple(sorted(labels.items())) if labels else ()
+        with self._lock:
+            return self._counters.get(name, {}).get(k, 0)
+
+    def get_histogram_count(self, name: str, labels: dict[str, str] | None = None) -> int:
+        k = tuple(sorted(labels.items())) if labels else ()
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(k)
+            return histogram.count if histogram is not None else 0
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for k, value in sorted(counters.items()):
+                    lines.append(f'{name}{_format_labels(k)} {_format_value(value)}')
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for k, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for le, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{_format_labels(k + (("le", _format_value(le)),))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(k + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(k)} {_format_value(histogram.sum)}')
+                    lines.append(f'{name}_count{_format_labels(k)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(k: LabelsKey) -> str:
+    if not k:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape_label_value(value)}"' for label, value in k) + '}'
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class OpenTelemetrySpanAdapter(Instrumentation):
+    # Wraps client operations in spans from an OpenTelemetry-style tracer,
+    # i.e. anything with start_as_current_span(name, attributes=...):
+    #
+    #   from opentelemetry import trace
+    #   spans = OpenTelemetrySpanAdapter(trace.get_tracer('hubitat'))
+    #
+    # Metrics are dropped; combine with PrometheusInstrumentation through
+    # CompositeInstrumentation to collect both.
+    enabled = True
+
+    def __init__(self, tracer: Any):
+        self.tracer = tracer
+
+    def span(self, name: str, attributes: dict[str, Any] | None = None) -> ContextManager:
+        return self.tracer.start_as_current_span(name, attributes=attributes)
@@ -0,0 +1,261 @@
+import json
+import threading
+import uuid
+from contextlib import AbstractContextManager
+from contextlib import contextmanager
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+
+import redis
+
+from hubitat_maker_api_client.capabilities import CapabilityName
+from hubitat_maker_api_client.client import DeviceAlias
+from hubitat_maker_api_client.client import RoomName
+from hubitat_maker_api_client.device_cache import DeviceCache
+from hubitat_maker_api_client.device_cache import DeviceCacheMutation
+
+
+# Redis has no null, so None rooms, capabilities and values are stored as this
+NONE_SENTINEL = '\x00'
+
+
+def _encode(value: Any) -> str:
+    return NONE_SENTINEL if value is None else str(value)
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, bytes):
+        value = value.decode()
+    return None if value == NONE_SENTINEL else value
+
+
+class RedisDeviceCache(DeviceCache):
+    # Capability, room and attribute memberships are Redis sets; last values
+    # and timestamps are fields of two hashes; numeric attributes are also
+    # scored in a sorted set per attribute for range queries. Every set key
+    # written is recorded in a registry set so clear() doesn't need to SCAN.
+    blocking = True
+
+    def __init__(self, redis_client: redis.Redis, namespace: str = 'hubitat'):
+        self.redis = redis_client
+        self.namespace = namespace
+        # Each thread batches into its own pipeline, so a load in a worker
+        # thread and events applied elsewhere never share one
+        self._local = threading.local()
+
+    @property
+    def _pipeline(self) -> Any:
+        return getattr(self._local, 'pipeline', None)
+
+    @_pipeline.setter
+    def _pipeline(self, pipeline: Any) -> None:
+        self._local.pipeline = pipeline
+
+    # Keys
+
+    def _key(self, *parts: Any) -> str:
+        return ':'.join([self.namespace] + [_encode(p) for p in parts])
+
+    def _registry_key(self) -> str:
+        return self._key('keys')
+
+    def _values_key(self) -> str:
+        return self._key('values')
+
+    def _timestamps_key(self) -> str:
+        return self._key('timestamps')
+
+    def _capability_key(self, capability: CapabilityName) -> str:
+        return self._key('cap', capability)
+
+    def _room_key(self, capability: CapabilityName, room: RoomName | None) -> str:
+        return self._key('room', capability, room)
+
+    def _attribute_key(self, capability: CapabilityName, attr_key: str, attr_value: str) -> str:
+        return self._key('attr', capability, attr_key, attr_value)
+
+    def _device_capabilities_key(self, device_id: int) -> str:
+        return self._key('device_caps', device_id)
+
+    def _number_key(self, attr_key: str) -> str:
+        return self._key('num', attr_key)
+
+    def _field(self, *parts: Any) -> str:
+        return json.dumps(parts)
+
+    # Batching
+
+    def batch(self) -> AbstractContextManager:
+        return self._batch(transaction=False)
+
+    def apply_mutations(self, mutations: Iterable[DeviceCacheMutation]) -> None:
+        # MULTI/EXEC, so other processes never read a half-applied load or event
+        with self._batch(transaction=True):
+            for method_name, *args in mutations:
+                getattr(self, method_name)(*args)
+
+    @contextmanager
+    def _batch(self, transaction: bool) -> Iterator[None]:
+        if self._pipeline is not None:
+            yield
+            return
+
+        self._pipeline = self.redis.pipeline(transaction=transaction)
+        try:
+            yield
+            self._pipeline.execute()
+        finally:
+            self._pipeline.reset()
+            self._pipeline = None
+
+    @contextmanager
+    def _writer(self) -> Iterator[Any]:
+        if self._pipeline is not None:
+            yield self._pipeline
+        else:
+            pipeline = self.redis.pipeline(transaction=False)
+            yield pipeline
+            pipeline.execute()
+
+    # Generations
+
+    def new_generation(self) -> 'RedisDeviceCache':
+        # A namespace of its own, so rebuilds running at once in this or
+        # another process never load into each other's keys
+        generation = RedisDeviceCache(self.redis, namespace=f'{self.namespace}:gen:{uuid.uuid4().hex}')
+        generation.clear()
+        return generation
+
+    def swap_generation(self, generation: DeviceCache) -> None:
+        # Renames every key of the generation over this namespace inside one
+        # MULTI/EXEC, so other processes see either the old or the new data
+        assert isinstance(generation, RedisDeviceCache) and generation.redis is self.redis
+        old_keys = [_decode(k) for k in self.redis.smembers(self._registry_key())]
+        candidate_keys = [_decode(k) for k in self.redis.smembers(generation._registry_key())]
+        candidate_keys += [generation._values_key(), generation._timestamps_key()]
+        # Redis drops a set once its last member is removed, e.g. by an event
+        # replayed onto the generation, and RENAME of a missing key would fail
+        # midway through the transaction
+        with self.redis.pipeline(transaction=False) as pipeline:
+            for k in candidate_keys:
+                pipeline.exists(k)
+            exists = pipeline.execute()
+        generation_keys = [k for k, e in zip(candidate_keys, exists) if e]
+        prefix = generation.namespace + ':'
+        renamed_keys = {k: self.namespace + ':' + k[len(prefix):] for k in generation_keys}
+
+        # RENAME overwrites its destination, so only live keys without a
+        # replacement are deleted up front
+        stale_keys = {self._registry_key(), self._values_key(), self._timestamps_key(), *old_keys} - set(renamed_keys.values())
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.delete(*stale_keys)
+        for generation_key, key in renamed_keys.items():
+            pipeline.rename(generation_key, key)
+        set_keys = [
+            key for key in renamed_keys.values()
+            if key not in (self._values_key(), self._timestamps_key())
+        ]
+        if set_keys:
+            pipeline.sadd(self._registry_key(), *set_keys)
+        pipeline.delete(generation._registry_key())
+        pipeline.execute()
+
+    # Cache mutators
+
+    def clear(self) -> None:
+        keys = [_decode(k) for k in self.redis.smembers(self._registry_key())]
+        with self._writer() as w:
+            w.delete(self._registry_key(), self._values_key(), self._timestamps_key(), *keys)
+
+    def _add_to_set(self, key: str, alias: DeviceAlias) -> None:
+        with self._writer() as w:
+            w.sadd(key, alias)
+            w.sadd(self._registry_key(), key)
+
+    def _remove_from_set(self, key: str, alias: DeviceAlias) -> None:
+        with self._writer() as w:
+            w.srem(key, alias)
+
+    def add_device_for_capability(self, capability: CapabilityName, alias: DeviceAlias) -> None:
+        self._add_to_set(self._capability_key(capability), alias)
+
+    def remove_device_for_capability(self, capability: CapabilityName, alias: DeviceAlias) -> None:
+        self._remove_from_set(self._capability_key(capability), alias)
+
+    def add_device_for_capability_and_room(self, capability: CapabilityName, room: RoomName | None, alias: DeviceAlias) -> None:
+        self._add_to_set(self._room_key(capability, room), alias)
+
+    def remove_device_for_capability_and_room(self, capability: CapabilityName, room: RoomName | None, alias: DeviceAlias) -> None:
+        self._remove_from_set(self._room_key(capability, room), alias)
+
+    def add_device_for_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str, alias: DeviceAlias) -> None:
+        self._add_to_set(self._attribute_key(capability, attr_key, attr_value), alias)
+
+    def remove_device_for_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str, alias: DeviceAlias) -> None:
+        self._remove_from_set(self._attribute_key(capability, attr_key, attr_value), alias)
+
+    def set_capabilities_for_device_id(self, device_id: int, capabilities: set[CapabilityName]) -> None:
+        key = self._device_capabilities_key(device_id)
+        with self._writer() as w:
+            w.delete(key)
+            if capabilities:
+                w.sadd(key, *capabilities)
+                w.sadd(self._registry_key(), key)
+
+    def set_last_device_attr_value(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str, attr_value: str | None) -> None:
+        with self._writer() as w:
+            w.hset(self._values_key(), self._field(capability, alias, attr_key), _encode(attr_value))
+
+    def set_last_device_attr_timestamp(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str, attr_value: str | None, timestamp: int) -> None:
+        with self._writer() as w:
+            w.hset(self._timestamps_key(), self._field(capability, alias, attr_key, attr_value), timestamp)
+
+    def set_device_attr_number(self, alias: DeviceAlias, attr_key: str, value: float | None) -> None:
+        key = self._number_key(attr_key)
+        with self._writer() as w:
+            if value is None:
+                w.zrem(key, alias)
+            else:
+                w.zadd(key, {alias: value})
+                w.sadd(self._registry_key(), key)
+
+    # Cache accessors
+
+    def _get_set(self, key: str) -> set[Any]:
+        return {_decode(m) for m in self.redis.smembers(key)}
+
+    def get_devices_by_capability(self, capability: CapabilityName) -> set[DeviceAlias]:
+        return self._get_set(self._capability_key(capability))
+
+    def get_devices_by_capability_and_room(self, capability: CapabilityName, room: RoomName | None) -> set[DeviceAlias]:
+        return self._get_set(self._room_key(capability, room))
+
+    def get_devices_by_capability_and_attribute(self, capability: CapabilityName, attr_key: str, attr_value: str) -> set[DeviceAlias]:
+        return self._get_set(self._attribute_key(capability, attr_key, attr_value))
+
+    def get_devices_by_attribute_range(self, capability: CapabilityName, attr_key: str, lo: float | None, hi: float | None) -> set[DeviceAlias]:
+        with self.redis.pipeline(transaction=False) as pipeline:
+            pipeline.zrangebyscore(
+                self._number_key(attr_key),
+                '-inf' if lo is None else lo,
+                '+inf' if hi is None else f'({hi}',
+            )
+            pipeline.smembers(self._capability_key(capability))
+            aliases, capability_aliases = pipeline.execute()
+        return {_decode(a) for a in aliases if a in capability_aliases}
+
+    def get_capabilities_for_device_id(self, device_id: int) -> set[CapabilityName]:
+        return self._get_set(self._device_capabilities_key(device_id))
+
+    def get_last_device_attr_value(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str) -> str | None:
+        return _decode(self.redis.hget(self._values_key(), self._field(capability, alias, attr_key)))
+
+    def get_last_device_attr_values(self, keys: list[tuple[CapabilityName | None, DeviceAlias, str]]) -> list[str | None]:
+        if not keys:
+            return []
+        return [_decode(v) for v in self.redis.hmget(self._values_key(), [self._field(*k) for k in keys])]
+
+    def get_last_device_attr_timestamp(self, capability: CapabilityName | None, alias: DeviceAlias, attr_key: str, attr_value: str | None) -> int | None:
+        timestamp = self.redis.hget(self._timestamps_key(), self._field(capability, alias, attr_key, attr_value))
+        return int(timestamp) if timestamp is not None else None
@@ -0,0 +1,152 @@
+import threading
+
+import numpy as np
+
+from hubitat_maker_api_client.caching_client import ATTR_KEYS_WITH_NUMERIC_VALS
+from hubitat_maker_api_client.client import DeviceAlias
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+DEFAULT_CAPACITY = 4096
+
+AGG_MEAN = 'mean'
+AGG_MIN = 'min'
+AGG_MAX = 'max'
+AGG_COUNT = 'count'
+AGGREGATES = (AGG_MEAN, AGG_MIN, AGG_MAX, AGG_COUNT)
+
+
+class TelemetrySeries:
+    # Ring buffer of the last `capacity` (timestamp, value) samples of one
+    # attribute, stored as two preallocated arrays. Samples must arrive in
+    # time order; older ones are dropped so the arrays stay sorted.
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self._next = 0
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+
+    def last_timestamp(self) -> int | None:
+        if not self.size:
+            return None
+        return int(self._timestamps[self._next - 1])
+
+    def append(self, timestamp: int, value: float) -> bool:
+        last_timestamp = self.last_timestamp()
+        if last_timestamp is not None and timestamp < last_timestamp:
+            return False
+
+        self._timestamps[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return True
+
+    def samples(self, start: int | None = None, end: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # Copies of the samples with start <= timestamp < end, oldest first
+        if self.size < self.capacity:
+            timestamps = self._timestamps[:self.size]
+            values = self._values[:self.size]
+        else:
+            timestamps = np.concatenate((self._timestamps[self._next:], self._timestamps[:self._next]))
+            values = np.concatenate((self._values[self._next:], self._values[:self._next]))
+
+        lo = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+        hi = len(timestamps) if end is None else np.searchsorted(timestamps, end, side='left')
+        return timestamps[lo:hi].copy(), values[lo:hi].copy()
+
+
+class TelemetryStore:
+    # In-process history of numeric attributes (battery, power, energy, ...)
+    # per device, fed by HubitatCachingClient.update_from_hubitat_event when
+    # passed as its telemetry_store. Memory is bounded by `capacity` samples
+    # per device and attribute.
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, attr_keys: list[str] = ATTR_KEYS_WITH_NUMERIC_VALS):
+        self.capacity = capacity
+        self.attr_keys = frozenset(attr_keys)
+        self._series: dict[tuple[DeviceAlias, str], TelemetrySeries] = {}
+        self._lock = threading.Lock()
+
+    def record_event(self, alias: DeviceAlias, event: HubitatEvent) -> bool:
+        if event.attr_key not in self.attr_keys:
+            return False
+        return self.record(alias, event.attr_key, event.timestamp, event.attr_value)
+
+    def record(self, alias: DeviceAlias, attr_key: str, timestamp: int, value: str | float) -> bool:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+
+        with self._lock:
+            series = self._series.get((alias, attr_key))
+            if series is None:
+                series = self._series[(alias, attr_key)] = TelemetrySeries(self.capacity)
+            return series.append(timestamp, value)
+
+    def get_samples(self, alias: DeviceAlias, attr_key: str, start: int | None = None, end: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            series = self._series.get((alias, attr_key))
+            if series is None:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+            return series.samples(start, end)
+
+    def get_stats(self, alias: DeviceAlias, attr_key: str, start: int | None = None, end: int | None = None) -> dict | None:
+        _, values = self.get_samples(alias, attr_key, start, end)
+        if not len(values):
+            return None
+        return {
+            'count': len(values),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'mean': float(values.mean()),
+        }
+
+    def get_windowed(
+        self,
+        alias: DeviceAlias,
+        attr_key: str,
+        window: int,
+        agg: str = AGG_MEAN,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Aggregates samples into buckets of `window` seconds aligned to the
+        # epoch; returns the start of each non-empty bucket and its aggregate
+        if agg not in AGGREGATES:
+            raise ValueError(f'Unknown aggregate: {agg}')
+
+        timestamps, values = self.get_samples(alias, attr_key, start, end)
+        if not len(timestamps):
+            return timestamps, values
+
+        buckets = timestamps // window
+        bucket_starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        counts = np.diff(np.append(bucket_starts, len(values)))
+        if agg == AGG_MEAN:
+            result = np.add.reduceat(values, bucket_starts) / counts
+        elif agg == AGG_MIN:
+            result = np.minimum.reduceat(values, bucket_starts)
+        elif agg == AGG_MAX:
+            result = np.maximum.reduceat(values, bucket_starts)
+        else:
+            result = counts.astype(np.float64)
+        return buckets[bucket_starts] * window, result
+
+    def get_rate(self, alias: DeviceAlias, attr_key: str, start: int | None = None, end: int | None = None) -> float | None:
+        # Average change per second, e.g. kWh/s for an energy meter
+        timestamps, values = self.get_samples(alias, attr_key, start, end)
+        if len(timestamps) < 2 or timestamps[-1] == timestamps[0]:
+            return None
+        return float((values[-1] - values[0]) / (timestamps[-1] - timestamps[0]))
+
+    def get_rates(self, alias: DeviceAlias, attr_key: str, start: int | None = None, end: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # Change per second between consecutive samples, timestamped with the
+        # later sample; samples sharing a timestamp are skipped
+        timestamps, values = self.get_samples(alias, attr_key, start, end)
+        dt = np.diff(timestamps)
+        moved = dt > 0
+        return timestamps[1:][moved], np.diff(values)[moved] / dt[moved]
@@ -1,8 +1,13 @@
 import json
 import requests_mock
 import pytest
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 
+from hubitat_maker_api_client.api_client import DEFAULT_TIMEOUT
 from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.api_client import JSONArrayDecoder
 
 
 FAKE_APP_ID = 'fake_app_id'
@@ -61,3 +66,128 @@ def test_local_api_get(mock_local_client):
         resp = mock_local_client.api_get('/some_endpoint')
 
         assert resp == fake_payload
+
+
+def test_api_get_reuses_session(mock_local_client):
+    with requests_mock.mock() as req_mock:
+        req_mock.get(requests_mock.ANY, text='{}')
+
+        mock_local_client.api_get('/some_endpoint')
+        session = mock_local_client._session
+        mock_local_client.api_get('/some_endpoint')
+
+        assert session is not None
+        assert mock_local_client._session is session
+
+
+def test_api_get_timeout(mock_local_client):
+    with requests_mock.mock() as req_mock:
+        req_mock.get(requests_mock.ANY, text='{}')
+
+        mock_local_client.api_get('/some_endpoint')
+        mock_local_client.api_get('/some_endpoint', timeout=1.5)
+
+        assert req_mock.request_history[0].timeout == DEFAULT_TIMEOUT
+        assert req_mock.request_history[1].timeout == 1.5
+
+
+def test_close():
+    with requests_mock.mock() as req_mock:
+        req_mock.get(requests_mock.ANY, text='{}')
+
+        with HubitatAPIClient(host=FAKE_LOCAL_HOST, app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN) as client:
+            client.api_get('/some_endpoint')
+            assert client._session is not None
+
+        assert client._session is None
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_get_connection_stats():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with HubitatAPIClient(
+            host='http://127.0.0.1:{}'.format(server.server_port),
+            app_id=FAKE_APP_ID,
+            access_token=FAKE_ACCESS_TOKEN,
+        ) as client:
+            assert client.get_connection_stats() == {'requests': 0, 'connections': 0, 'reused': 0}
+
+            for _ in range(3):
+                client.api_get('/some_endpoint')
+
+            assert client.get_connection_stats() == {'requests': 3, 'connections': 1, 'reused': 2}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+FAKE_DEVICES = [
+    {'id': '1', 'label': 'Caf\u00e9 Lamp \U0001f4a1', 'attributes': {'switch': 'on', 'level': 50}, 'commands': ['on', 'off']},
+    {'id': '3', 'label': 'Lock', 'attributes': {'lock': None, 'tamper': True, 'jammed': False, 'battery': -7.5e-1}},
+    {'id': '2', 'label': 'Porch [Front]', 'attributes': {'note': 'a, b ] c'}},
+    12.5,
+    [],
+]
+
+
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_json_array_decoder_handles_any_chunking(ensure_ascii):
+    body = json.dumps(FAKE_DEVICES, ensure_ascii=ensure_ascii).encode()
+    for chunk_size in [1, 2, 3, 7, len(body)]:
+        decoder = JSONArrayDecoder()
+        items = []
+        for i in range(0, len(body), chunk_size):
+            items += decoder.feed(body[i:i + chunk_size])
+        decoder.close()
+        assert items == FAKE_DEVICES
+
+
+@pytest.mark.parametrize('body', [b'{}', b'[1, 2', b'[1 2]', b'[1, 2] 3'])
+def test_json_array_decoder_rejects_bad_documents(body):
+    decoder = JSONArrayDecoder()
+    with pytest.raises(json.JSONDecodeError):
+        decoder.feed(body)
+        decoder.close()
+
+
+@pytest.mark.parametrize('body', [
+    b'[{"id": "1"},]',
+    b'[{"id": "1",}, {"id": "2"}]',
+    b'[{"id" "1"}, {"id": "2"}]',
+    b'[{"id": tru}, {"id": "2"}]',
+    b'[{"id": "\\x"}, {"id": "2"}]',
+    b'[{"id": "1"}, ]',
+])
+def test_json_array_decoder_raises_on_malformed_element(body):
+    # Without waiting for more data that can't fix it
+    decoder = JSONArrayDecoder()
+    with pytest.raises(json.JSONDecodeError):
+        decoder.feed(body)
+
+
+def test_iter_devices(mock_local_client):
+    with requests_mock.mock() as req_mock:
+        req_mock.get(
+            '{}/apps/api/{}/devices/all?access_token={}'.format(FAKE_LOCAL_HOST, FAKE_APP_ID, FAKE_ACCESS_TOKEN),
+            text=json.dumps(FAKE_DEVICES[:2]),
+        )
+
+        devices = mock_local_client.iter_devices()
+        assert next(devices) == FAKE_DEVICES[0]
+        assert list(devices) == [FAKE_DEVICES[1]]
@@ -0,0 +1,311 @@
+import asyncio
+import mock
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hubitat_maker_api_client.async_api_client import AsyncHubitatAPIClient
+from hubitat_maker_api_client.async_caching_client import AsyncHubitatCachingClient
+from hubitat_maker_api_client.async_client import AsyncHubitatClient
+from hubitat_maker_api_client.constants import HSM_STATE_DISARMED
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.errors import DeviceNotFoundError
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+FAKE_APP_ID = 'fake_app_id'
+FAKE_ACCESS_TOKEN = 'fake_access_token'
+FAKE_HUB_ID = 'fake_hub_id'
+
+FAKE_DEVICE_DATE = '2019-12-07T03:57:07+0000'
+
+FAKE_SWITCH_ON = {
+    'id': '1',
+    'label': 'Kitchen Ceiling',
+    'capabilities': ['Switch'],
+    'attributes': {
+        'switch': 'on',
+    },
+    'date': FAKE_DEVICE_DATE,
+    'room': 'Kitchen',
+}
+
+FAKE_SWITCH_OFF = {
+    'id': '2',
+    'label': 'Porch Light',
+    'capabilities': ['Switch'],
+    'attributes': {
+        'switch': 'off',
+    },
+    'date': FAKE_DEVICE_DATE,
+    'room': 'Porch',
+}
+
+FAKE_DEVICES_ALL = [
+    FAKE_SWITCH_ON,
+    FAKE_SWITCH_OFF,
+]
+
+# As returned by /devices/{id}
+FAKE_SWITCH_ON_DETAIL = {
+    'id': FAKE_SWITCH_ON['id'],
+    'label': FAKE_SWITCH_ON['label'],
+    'attributes': [{'name': 'switch', 'currentValue': 'on', 'dataType': 'ENUM', 'values': ['on', 'off']}],
+    'capabilities': ['Switch'],
+}
+
+FAKE_ACTIVE_MODE = 'Day'
+FAKE_MODES = [
+    {'active': True, 'id': 1, 'name': FAKE_ACTIVE_MODE},
+    {'active': False, 'id': 2, 'name': 'Night'},
+]
+
+FAKE_HSM = {
+    'hsm': HSM_STATE_DISARMED,
+}
+
+
+def make_app(requests_seen: list[str]) -> web.Application:
+    prefix = f'/apps/api/{FAKE_APP_ID}'
+
+    async def handler(request: web.Request) -> web.Response:
+        assert request.query['access_token'] == FAKE_ACCESS_TOKEN
+        endpoint = request.path[len(prefix):]
+        requests_seen.append(endpoint)
+        if endpoint == '/devices/all':
+            return web.json_response(FAKE_DEVICES_ALL)
+        elif endpoint == '/devices':
+            # Like a real hub, the brief listing has no capabilities
+            return web.json_response([{'id': d['id'], 'label': d['label'], 'room': d['room']} for d in FAKE_DEVICES_ALL])
+        elif endpoint == '/modes':
+            return web.json_response(FAKE_MODES)
+        elif endpoint == '/hsm':
+            return web.json_response(FAKE_HSM)
+        elif endpoint == '/devices/{}'.format(FAKE_SWITCH_ON['id']):
+            return web.json_response(FAKE_SWITCH_ON_DETAIL)
+        else:
+            await asyncio.sleep(0.05)
+            return web.json_response({'fake': 'json'})
+
+    app = web.Application()
+    app.router.add_get(prefix + '/{tail:.*}', handler)
+    return app
+
+
+def run_with_client(client_factory, test_coro):
+    async def run():
+        requests_seen: list[str] = []
+        async with TestServer(make_app(requests_seen)) as server:
+            async with AsyncHubitatAPIClient(
+                host=str(server.make_url('')).rstrip('/'),
+                app_id=FAKE_APP_ID,
+                access_token=FAKE_ACCESS_TOKEN,
+            ) as api_client:
+                client = await client_factory(api_client)
+                await test_coro(client, requests_seen)
+    asyncio.run(run())
+
+
+async def make_client(api_client):
+    return AsyncHubitatClient(api_client)
+
+
+async def make_caching_client(api_client):
+    return await AsyncHubitatCachingClient.create(api_client, InMemoryDeviceCache())
+
+
+class BlockingDeviceCache(InMemoryDeviceCache):
+    # Stands in for a network cache like RedisDeviceCache and records every
+    # call made on the event loop
+    blocking = True
+
+    def __init__(self):
+        self.calls_on_loop = []
+        super().__init__()
+        self.calls_on_loop.clear()
+
+    def __getattribute__(self, name):
+        attr = super().__getattribute__(name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        calls_on_loop = super().__getattribute__('calls_on_loop')
+
+        def checked(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                calls_on_loop.append(name)
+            except RuntimeError:
+                pass
+            return attr(*args, **kwargs)
+        return checked
+
+
+async def make_blocking_caching_client(api_client):
+    return await AsyncHubitatCachingClient.create(api_client, BlockingDeviceCache())
+
+
+@pytest.fixture(params=[make_client, make_caching_client, make_blocking_caching_client])
+def client_factory(request):
+    return request.param
+
+
+def test_cloud_client_requires_hub_id():
+    with pytest.raises(ValueError):
+        AsyncHubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN)
+
+
+def test_api_get():
+    async def test(client, requests_seen):
+        assert await client.api_client.get_hsm() == FAKE_HSM
+
+    run_with_client(make_client, test)
+
+
+def test_get_switches(client_factory):
+    async def test(client, requests_seen):
+        assert await client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+    run_with_client(client_factory, test)
+
+
+def test_get_on_switches(client_factory):
+    async def test(client, requests_seen):
+        assert await client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+    run_with_client(client_factory, test)
+
+
+def test_get_rooms(client_factory):
+    async def test(client, requests_seen):
+        assert await client.get_rooms() == {d['room'] for d in FAKE_DEVICES_ALL}
+
+    run_with_client(client_factory, test)
+
+
+def test_query(client_factory):
+    async def test(client, requests_seen):
+        assert await client.query('Switch', room='Kitchen', attrs={'switch': 'on'}) == {FAKE_SWITCH_ON['label']}
+        assert await client.query('Switch', room='Porch', attrs={'switch': 'on'}) == set()
+
+    run_with_client(client_factory, test)
+
+
+def test_get_mode_and_hsm(client_factory):
+    async def test(client, requests_seen):
+        assert await client.get_mode() == FAKE_ACTIVE_MODE
+        assert await client.get_hsm() == HSM_STATE_DISARMED
+
+    run_with_client(client_factory, test)
+
+
+def test_concurrent_device_commands():
+    async def test(client, requests_seen):
+        await asyncio.gather(
+            client.turn_off_switch(FAKE_SWITCH_ON['label']),
+            client.turn_on_switch(FAKE_SWITCH_OFF['label']),
+        )
+
+        assert requests_seen.count('/devices/all') == 1
+        assert sorted(r for r in requests_seen if r not in ('/devices', '/devices/all')) == [
+            '/devices/{}/off'.format(FAKE_SWITCH_ON['id']),
+            '/devices/{}/on'.format(FAKE_SWITCH_OFF['id']),
+        ]
+
+    run_with_client(make_client, test)
+
+
+def test_send_commands():
+    async def test(client, requests_seen):
+        results = await client.send_commands([
+            ('Switch', FAKE_SWITCH_ON['label'], 'off'),
+            ('Switch', 'No Such Switch', 'off'),
+            ('Switch', FAKE_SWITCH_OFF['label'], 'on'),
+        ], max_concurrency=1)
+
+        assert [r.ok for r in results] == [True, False, True]
+        assert isinstance(results[1].error, DeviceNotFoundError)
+
+    run_with_client(make_client, test)
+
+
+def test_rebuild_cache():
+    async def test(client, requests_seen):
+        device_cache = client.device_cache
+        client.device_cache.add_device_for_capability('Switch', 'Removed Switch')
+
+        await client.rebuild_cache()
+
+        assert client.device_cache is device_cache
+        assert await client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+    run_with_client(make_caching_client, test)
+
+
+def test_failed_rebuild_clears_generation():
+    async def test(client, requests_seen):
+        generation = InMemoryDeviceCache()
+        with mock.patch.object(client.device_cache, 'new_generation', return_value=generation), \
+                mock.patch.object(client.device_cache, 'swap_generation', side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                await client.rebuild_cache()
+
+        assert generation.get_devices_by_capability('Switch') == set()
+        assert await client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+    run_with_client(make_caching_client, test)
+
+
+def test_reconcile():
+    async def test(client, requests_seen):
+        client.update_from_hubitat_event(HubitatEvent({
+            'deviceId': FAKE_SWITCH_OFF['id'],
+            'displayName': FAKE_SWITCH_OFF['label'],
+            'name': 'switch',
+            'value': 'on',
+            'source': 'DEVICE',
+        }))
+
+        await client.reconcile()
+
+        assert await client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+    run_with_client(make_caching_client, test)
+
+
+def test_get_device_attributes(client_factory):
+    async def test(client, requests_seen):
+        assert await client.get_device_attributes(FAKE_SWITCH_ON['label']) == {'switch': 'on'}
+        assert await client.get_device_attribute(FAKE_SWITCH_ON['label'], 'switch') == 'on'
+        assert requests_seen.count('/devices/{}'.format(FAKE_SWITCH_ON['id'])) == 1
+
+        await client.turn_off_switch(FAKE_SWITCH_ON['label'])
+        await client.get_device_attributes(FAKE_SWITCH_ON['label'])
+
+        assert requests_seen.count('/devices/{}'.format(FAKE_SWITCH_ON['id'])) == 2
+        assert requests_seen.count('/devices/all') == 1
+
+    run_with_client(client_factory, test)
+
+
+def test_blocking_cache_is_called_off_the_event_loop():
+    async def test(client, requests_seen):
+        await asyncio.to_thread(client.update_from_hubitat_event, HubitatEvent({
+            'deviceId': FAKE_SWITCH_OFF['id'],
+            'displayName': FAKE_SWITCH_OFF['label'],
+            'name': 'switch',
+            'value': 'on',
+            'source': 'DEVICE',
+        }))
+        assert await client.get_on_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+        await client.reconcile()
+        await client.rebuild_cache()
+
+        assert await client.query('Switch', room='Kitchen', attrs={'switch': 'on'}) == {FAKE_SWITCH_ON['label']}
+        assert await client.get_devices_by_attribute_range('Switch', 'switch') == set()
+        assert await client.get_mode() == FAKE_ACTIVE_MODE
+        assert await client.get_last_device_value(FAKE_SWITCH_OFF['label'], 'switch') == 'off'
+        assert client.device_cache.calls_on_loop == []
+
+    run_with_client(make_blocking_caching_client, test)
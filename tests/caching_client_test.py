@@ -1,13 +1,17 @@
 import json
 import mock
+import threading
 import requests_mock
 import pytest
 
 from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.caching_client import CachedDevice
 from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.caching_client import coalesce_hubitat_events
 from hubitat_maker_api_client.constants import HSM_STATE_ARMED_AWAY
 from hubitat_maker_api_client.constants import HSM_STATE_DISARMED
 from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.device_cache import SNAPSHOT_VERSION
 from hubitat_maker_api_client.event_socket import HubitatEvent
 
 
@@ -201,3 +205,334 @@ def test_get_last_device_timestamp(mock_client, mock_time):
 
     assert mock_client.get_last_device_timestamp(device_label, 'switch', 'off') == FAKE_DEVICE_TIMESTAMP
     assert mock_client.get_last_device_timestamp(device_label, 'switch', 'on') == FAKE_DEVICE_TIMESTAMP + 1
+
+
+def test_load_cache_keeps_no_device_snapshot(mock_client):
+    # Only the compact records reconcile() diffs against, and the identity
+    # indexes commands resolve aliases with, outlive the load
+    assert mock_client._device_snapshot is None
+    assert mock_client._cached_devices[0] == CachedDevice(1, 'Kitchen Ceiling', 'Kitchen', ('Switch',), (('switch', 'on'),), FAKE_DEVICE_TIMESTAMP)
+    assert mock_client._identity_snapshot.device_id_to_attributes == {}
+    assert mock_client._get_capability_to_alias_to_device_ids()['Switch'][FAKE_SWITCH_ON['label']] == [1]
+
+
+def test_rebuild_cache(mock_client, mock_requests):
+    seen_during_rebuild = []
+
+    def devices_all_callback(request, context):
+        seen_during_rebuild.append(mock_client.get_on_switches().copy())
+        mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_ON, 'switch', 'off'))
+        return json.dumps(FAKE_DEVICES_ALL)
+
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=devices_all_callback)
+    device_cache = mock_client.device_cache
+
+    mock_client.rebuild_cache()
+
+    assert seen_during_rebuild == [{FAKE_SWITCH_ON['label']}]
+    assert mock_client.device_cache is device_cache
+    assert mock_client.get_on_switches() == set()
+    assert mock_client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+
+def test_rebuild_cache_swap_failure_stops_buffering(mock_client):
+    with mock.patch.object(mock_client.device_cache, 'swap_generation', side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            mock_client.rebuild_cache()
+
+    assert mock_client._events_during_rebuild is None
+
+
+def test_rebuild_cache_in_background(mock_client):
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF, 'switch', 'on'))
+
+    mock_client.rebuild_cache(background=True).join()
+
+    assert mock_client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+
+def test_reconcile_without_changes_writes_nothing(mock_client):
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_1, 'illuminance', FAKE_LUX_1['attributes']['illuminance']))
+
+    with mock.patch.object(mock_client.device_cache, 'apply_mutations', wraps=mock_client.device_cache.apply_mutations) as mock_apply_mutations:
+        mock_client.reconcile()
+
+    mock_apply_mutations.assert_called_once_with([])
+
+
+def test_reconcile(mock_client, mock_requests):
+    moved_switch = {**FAKE_SWITCH_OFF, 'room': 'Garage'}
+    new_switch = {**FAKE_SWITCH_ON, 'id': '5', 'label': 'Attic Fan', 'room': 'Attic'}
+    changed_lux = {**FAKE_LUX_1, 'attributes': {'illuminance': '45'}}
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=json.dumps([moved_switch, new_switch, changed_lux, FAKE_LUX_2]))
+    mock_requests.get(FAKE_URL_MODES, text=json.dumps([{**m, 'active': not m['active']} for m in FAKE_MODES]))
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF, 'switch', 'on'))
+
+    with mock.patch.object(mock_client.device_cache, 'apply_mutations', wraps=mock_client.device_cache.apply_mutations) as mock_apply_mutations:
+        mock_client.reconcile()
+
+    mutations = mock_apply_mutations.call_args[0][0]
+    # Unchanged devices and attributes are left alone
+    assert not [m for m in mutations if 'IlluminanceMeasurement' in m and FAKE_LUX_1['label'] not in m]
+
+    assert mock_client.get_mode() == FAKE_INACTIVE_MODE
+    assert mock_client.get_switches() == {'Porch Light', 'Attic Fan'}
+    assert mock_client.get_on_switches() == {'Attic Fan'}
+    assert mock_client.get_devices_by_capability_and_attribute('Switch', 'switch', 'off') == {'Porch Light'}
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Porch') == set()
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Garage') == {'Porch Light'}
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Kitchen') == set()
+    assert mock_client.get_capabilities_for_device_id(1) == set()
+    assert mock_client.get_capabilities_for_device_id(5) == {'Switch'}
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', lo=40, hi=50) == {'Office'}
+    assert mock_client.get_devices_by_capability_and_attribute('IlluminanceMeasurement', 'illuminance', '30') == set()
+
+
+def test_reconcile_matches_rebuild_after_events(mock_client, mock_requests):
+    # Events update illuminance but don't re-index it, so only reconcile can
+    # drop the entry indexed for the loaded value
+    changed_lux = {**FAKE_LUX_1, 'attributes': {'illuminance': '45'}}
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=json.dumps([FAKE_SWITCH_ON, FAKE_SWITCH_OFF, changed_lux, FAKE_LUX_2]))
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_1, 'illuminance', '45'))
+
+    mock_client.reconcile()
+    reconciled = [
+        mock_client.get_devices_by_capability_and_attribute('IlluminanceMeasurement', 'illuminance', v)
+        for v in ('30', '45')
+    ]
+    mock_client.rebuild_cache()
+    rebuilt = [
+        mock_client.get_devices_by_capability_and_attribute('IlluminanceMeasurement', 'illuminance', v)
+        for v in ('30', '45')
+    ]
+
+    assert reconciled == rebuilt == [set(), {FAKE_LUX_1['label']}]
+
+
+def test_reconcile_replays_events_during_fetch(mock_client, mock_requests):
+    def devices_all_callback(request, context):
+        mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF, 'switch', 'on'))
+        return json.dumps(FAKE_DEVICES_ALL)
+
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=devices_all_callback)
+
+    mock_client.reconcile()
+
+    assert mock_client.get_on_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+
+def test_warm_start_from_snapshot(mock_requests, tmp_path):
+    snapshot_path = str(tmp_path / 'device_cache.json')
+    api_client = HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID)
+
+    HubitatCachingClient(api_client, InMemoryDeviceCache(), snapshot_path=snapshot_path)
+
+    hub_released = threading.Event()
+
+    def devices_all_callback(request, context):
+        hub_released.wait(5)
+        return json.dumps([dict(FAKE_SWITCH_OFF, attributes={'switch': 'on'})])
+
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=devices_all_callback)
+
+    client = HubitatCachingClient(api_client, InMemoryDeviceCache(), snapshot_path=snapshot_path)
+
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert client.get_mode() == FAKE_ACTIVE_MODE
+    assert client.get_last_device_value(FAKE_LUX_1['label'], 'illuminance') == FAKE_LUX_1['attributes']['illuminance']
+    assert client.get_last_device_timestamp(FAKE_SWITCH_OFF['label'], 'switch', 'off') == FAKE_DEVICE_TIMESTAMP
+
+    hub_released.set()
+    client.warm_start_thread.join()
+
+    assert client.get_on_switches() == {FAKE_SWITCH_OFF['label']}
+
+
+def test_warm_start_ignores_unsupported_snapshot(mock_requests, tmp_path):
+    snapshot_path = tmp_path / 'device_cache.json'
+    snapshot_path.write_text(json.dumps({'format': 'hubitat-device-cache', 'version': 0}))
+
+    client = HubitatCachingClient(
+        HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID),
+        InMemoryDeviceCache(),
+        snapshot_path=str(snapshot_path),
+    )
+
+    assert client.warm_start_thread is None
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert json.loads(snapshot_path.read_text())['version'] == SNAPSHOT_VERSION
+
+
+@pytest.mark.parametrize('contents', [
+    '{"format": "hubitat-device-cache", "ver',
+    '[]',
+    json.dumps({'format': 'hubitat-device-cache', 'version': SNAPSHOT_VERSION, 'cap_to_aliases': [1]}),
+])
+def test_warm_start_ignores_corrupt_snapshot(mock_requests, tmp_path, contents):
+    snapshot_path = tmp_path / 'device_cache.json'
+    snapshot_path.write_text(contents)
+
+    client = HubitatCachingClient(
+        HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID),
+        InMemoryDeviceCache(),
+        snapshot_path=str(snapshot_path),
+    )
+
+    assert client.warm_start_thread is None
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+
+def test_warm_start_ignores_unreadable_snapshot(mock_requests, tmp_path):
+    snapshot_path = tmp_path / 'device_cache.json'
+    snapshot_path.write_text('{}')
+    device_cache = InMemoryDeviceCache()
+
+    with mock.patch.object(device_cache, 'load_snapshot', side_effect=PermissionError):
+        client = HubitatCachingClient(
+            HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID),
+            device_cache,
+            snapshot_path=str(snapshot_path),
+        )
+
+    assert client.warm_start_thread is None
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+
+def test_save_cache_snapshot_does_not_block_events(mock_client, tmp_path):
+    lock_held_during_save = []
+    mock_client.snapshot_path = str(tmp_path / 'device_cache.json')
+
+    with mock.patch.object(
+        mock_client.device_cache,
+        'save_snapshot',
+        side_effect=lambda path: lock_held_during_save.append(mock_client._cache_generation_lock.locked()),
+    ):
+        mock_client.rebuild_cache()
+
+    assert lock_held_during_save == [False]
+
+
+def test_coalesce_hubitat_events():
+    events = [
+        make_event(FAKE_LUX_1, 'illuminance', '31'),
+        make_event(FAKE_SWITCH_ON, 'switch', 'off'),
+        make_event(FAKE_LUX_1, 'illuminance', '32'),
+        make_event(FAKE_SWITCH_ON, 'switch', 'on'),
+        make_event(FAKE_SWITCH_ON, 'switch', 'off'),
+        make_event(FAKE_LUX_2, 'illuminance', '71'),
+    ]
+
+    assert coalesce_hubitat_events(events) == [events[2], events[3], events[4], events[5]]
+
+
+def test_update_from_hubitat_events(mock_client, mock_time):
+    mock_time.side_effect = [FAKE_DEVICE_TIMESTAMP + i for i in range(1, 5)]
+    events = [
+        make_event(FAKE_SWITCH_OFF, 'switch', 'on'),
+        make_event(FAKE_LUX_1, 'illuminance', '31'),
+        make_event(FAKE_SWITCH_OFF, 'switch', 'off'),
+        make_event(FAKE_LUX_1, 'illuminance', '32'),
+    ]
+
+    with mock.patch.object(mock_client.device_cache, 'apply_mutations', wraps=mock_client.device_cache.apply_mutations) as mock_apply_mutations:
+        mock_client.update_from_hubitat_events(events)
+
+    assert mock_apply_mutations.call_count == 1
+    assert mock_client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert mock_client.get_last_device_timestamp(FAKE_SWITCH_OFF['label'], 'switch', 'on') == FAKE_DEVICE_TIMESTAMP + 1
+    assert mock_client.get_last_device_timestamp(FAKE_SWITCH_OFF['label'], 'switch', 'off') == FAKE_DEVICE_TIMESTAMP + 3
+    assert mock_client.get_last_device_value(FAKE_LUX_1['label'], 'illuminance') == '32'
+
+
+def test_update_from_hubitat_event_skips_cache_capability_lookup(mock_client):
+    with mock.patch.object(mock_client.device_cache, 'get_capabilities_for_device_id') as mock_get_capabilities:
+        mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_ON, 'switch', 'off'))
+
+    assert not mock_get_capabilities.called
+    assert mock_client.get_on_switches() == set()
+
+
+def test_register_accessor_attr(mock_client):
+    mock_client.register_accessor_attr('IlluminanceMeasurement', 'illuminance', '70')
+    assert mock_client.get_devices_by_capability_and_attribute('IlluminanceMeasurement', 'illuminance', '70') == {FAKE_LUX_2['label']}
+
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_2, 'illuminance', '71'))
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_1, 'illuminance', '70'))
+
+    assert mock_client.get_devices_by_capability_and_attribute('IlluminanceMeasurement', 'illuminance', '70') == {FAKE_LUX_1['label']}
+
+
+def test_get_devices_by_attribute_range_after_event(mock_client):
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_2, 'illuminance', '20'))
+
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', hi=25) == {FAKE_LUX_2['label']}
+
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_2, 'illuminance', 'unknown'))
+
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance') == {FAKE_LUX_1['label']}
+
+
+def test_numbers_are_indexed_once_per_device(mock_requests):
+    meter = {
+        'id': '5',
+        'label': 'Dryer',
+        'capabilities': ['PowerMeter', 'Switch', 'Refresh', 'Actuator', 'Sensor'],
+        'attributes': {'power': '1200', 'switch': 'on'},
+        'date': FAKE_DEVICE_DATE,
+        'room': 'Laundry',
+    }
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=json.dumps([meter]))
+    device_cache = InMemoryDeviceCache()
+    client = HubitatCachingClient(
+        HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID),
+        device_cache,
+    )
+
+    set_number = InMemoryDeviceCache.set_device_attr_number
+    with mock.patch.object(InMemoryDeviceCache, 'set_device_attr_number', autospec=True, side_effect=set_number) as mock_set_number:
+        client.update_from_hubitat_event(make_event(meter, 'power', '40'))
+        client.rebuild_cache()
+
+    assert [c.args[1:] for c in mock_set_number.call_args_list] == [('Dryer', 'power', 40.0), ('Dryer', 'power', 1200.0)]
+    assert client.get_devices_by_attribute_range('PowerMeter', 'power', lo=1000) == {'Dryer'}
+    assert client.get_devices_by_attribute_range('Switch', 'power', lo=1000) == {'Dryer'}
+    assert client.get_devices_by_attribute_range('Battery', 'power') == set()
+    assert list(device_cache._state.cached_attr_to_sorted_numbers) == ['power']
+
+
+def test_concurrent_reads_during_event_updates(mock_client):
+    both_switches = {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            for i in range(500):
+                value = 'on' if i % 2 else 'off'
+                mock_client.update_from_hubitat_events([
+                    make_event(FAKE_SWITCH_ON, 'switch', value),
+                    make_event(FAKE_SWITCH_OFF, 'switch', value),
+                ])
+                mock_client.update_from_hubitat_event(make_event(FAKE_LUX_1, 'illuminance', str(i)))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                assert mock_client.get_on_switches() in (set(), both_switches)
+                assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance') == {FAKE_LUX_1['label'], FAKE_LUX_2['label']}
+        except Exception as e:
+            errors.append(e)
+
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF, 'switch', 'on'))
+    threads = [threading.Thread(target=read) for _ in range(8)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert mock_client.get_on_switches() == both_switches
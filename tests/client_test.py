@@ -1,12 +1,21 @@
 import json
+import mock
+import requests
 import requests_mock
 import pytest
+import threading
+import time
 
 from hubitat_maker_api_client.api_client import HubitatAPIClient
 from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.capabilities import SwitchCapability
+from hubitat_maker_api_client.client import DeviceSnapshot
 from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.client import trim_device
 from hubitat_maker_api_client.constants import HSM_STATE_DISARMED
 from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.errors import DeviceNotFoundError
+from hubitat_maker_api_client.event_socket import HubitatEvent
 
 
 FAKE_APP_ID = 'fake_app_id'
@@ -23,6 +32,11 @@ FAKE_URL_DEVICES_ALL = '{}/devices/all?access_token={}'.format(
     FAKE_ACCESS_TOKEN,
 )
 
+FAKE_URL_DEVICES = '{}/devices?access_token={}'.format(
+    FAKE_URL_PREFIX,
+    FAKE_ACCESS_TOKEN,
+)
+
 FAKE_URL_MODES = '{}/modes?access_token={}'.format(
     FAKE_URL_PREFIX,
     FAKE_ACCESS_TOKEN,
@@ -86,6 +100,26 @@ FAKE_DEVICES_ALL = [
     FAKE_LUX_2,
 ]
 
+# As returned by /devices, which has no capabilities on a real hub
+FAKE_DEVICES_BRIEF = [
+    {'id': d['id'], 'label': d['label'], 'room': d['room']}
+    for d in FAKE_DEVICES_ALL
+]
+
+# As returned by /devices on a hub that includes capabilities in it
+FAKE_DEVICES_BRIEF_WITH_CAPABILITIES = [
+    {**brief, 'capabilities': d['capabilities']}
+    for brief, d in zip(FAKE_DEVICES_BRIEF, FAKE_DEVICES_ALL)
+]
+
+# As returned by /devices/{id}
+FAKE_SWITCH_ON_DETAIL = {
+    'id': FAKE_SWITCH_ON['id'],
+    'label': FAKE_SWITCH_ON['label'],
+    'attributes': [{'name': 'switch', 'currentValue': 'on', 'dataType': 'ENUM', 'values': ['on', 'off']}],
+    'capabilities': ['Switch'],
+}
+
 FAKE_ACTIVE_MODE = 'Day'
 FAKE_INACTIVE_MODE = 'Night'
 FAKE_MODES = [
@@ -123,6 +157,7 @@ def mock_client(request):
 def mock_requests():
     with requests_mock.mock() as req_mock:
         req_mock.get(FAKE_URL_DEVICES_ALL, text=json.dumps(FAKE_DEVICES_ALL))
+        req_mock.get(FAKE_URL_DEVICES, text=json.dumps(FAKE_DEVICES_BRIEF))
         req_mock.get(FAKE_URL_MODES, text=json.dumps(FAKE_MODES))
         req_mock.get(FAKE_URL_HSM, text=json.dumps(FAKE_HSM))
         yield req_mock
@@ -167,3 +202,237 @@ def test_turn_on_switch(mock_client, mock_requests):
 
     assert len(req_adapter.request_history) == 1
     assert req_adapter.request_history[0].url == api_request_url
+
+
+def test_send_commands(mock_client, mock_requests):
+    req_adapters = [
+        mock_requests.get(
+            '{}/devices/{}/{}?access_token={}'.format(FAKE_URL_PREFIX, device['id'], command, FAKE_ACCESS_TOKEN),
+            text='{"fake": "json"}',
+        )
+        for device, command in [(FAKE_SWITCH_ON, 'off'), (FAKE_SWITCH_OFF, 'on')]
+    ]
+
+    results = mock_client.send_commands([
+        (SwitchCapability.name, FAKE_SWITCH_ON['label'], 'off'),
+        (SwitchCapability.name, 'No Such Switch', 'off'),
+        (SwitchCapability.name, FAKE_SWITCH_OFF['label'], 'on'),
+    ])
+
+    assert [r.alias for r in results] == [FAKE_SWITCH_ON['label'], 'No Such Switch', FAKE_SWITCH_OFF['label']]
+    assert results[0].ok and results[0].response == {'fake': 'json'}
+    assert isinstance(results[1].error, DeviceNotFoundError)
+    assert results[2].ok
+    assert [len(a.request_history) for a in req_adapters] == [1, 1]
+
+
+def test_send_commands_request_error(mock_client, mock_requests):
+    mock_requests.get(
+        '{}/devices/{}/off?access_token={}'.format(FAKE_URL_PREFIX, FAKE_SWITCH_ON['id'], FAKE_ACCESS_TOKEN),
+        status_code=500,
+    )
+
+    results = mock_client.turn_off_switches({FAKE_SWITCH_ON['label']})
+
+    assert len(results) == 1
+    assert isinstance(results[0].error, requests.HTTPError)
+
+
+def test_turn_on_switch_not_found(mock_client):
+    with pytest.raises(DeviceNotFoundError):
+        mock_client.turn_on_switch('No Such Switch')
+
+
+def test_device_snapshot_shared(mock_client, mock_requests):
+    mock_requests.get(requests_mock.ANY, text='{"fake": "json"}')
+    mock_requests.get(FAKE_URL_DEVICES_ALL, text=json.dumps(FAKE_DEVICES_ALL))
+
+    mock_client.get_switches()
+    mock_client.get_rooms()
+    mock_client.get_on_switches()
+    mock_client.turn_on_switch(FAKE_SWITCH_OFF['label'])
+
+    devices_all_requests = [r for r in mock_requests.request_history if r.path.endswith('/devices/all')]
+    assert len(devices_all_requests) == 1
+
+
+def test_get_devices_by_attribute_range(mock_client):
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', hi=50) == {FAKE_LUX_1['label']}
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', lo=30, hi=70) == {FAKE_LUX_1['label']}
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', lo=30) == {FAKE_LUX_1['label'], FAKE_LUX_2['label']}
+
+
+def test_query(mock_client):
+    assert mock_client.query('Switch') == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    assert mock_client.query('Switch', room='Kitchen') == {FAKE_SWITCH_ON['label']}
+    assert mock_client.query('Switch', attrs={'switch': 'off'}) == {FAKE_SWITCH_OFF['label']}
+    assert mock_client.query('Switch', room='Porch', attrs={'switch': 'on'}) == set()
+    assert mock_client.query('Switch', attrs={'switch': 'dimmed'}) == set()
+    assert mock_client.query('IlluminanceMeasurement', room='Porch', attrs={'illuminance': (50, None)}) == {FAKE_LUX_2['label']}
+    assert mock_client.query('IlluminanceMeasurement', room='Office', attrs={'illuminance': (50, None)}) == set()
+
+
+def test_get_capabilities_for_device_id(mock_client):
+    assert mock_client.get_capabilities_for_device_id(int(FAKE_LUX_1['id'])) == {'IlluminanceMeasurement'}
+
+
+@pytest.fixture
+def mock_monotonic():
+    with mock.patch('hubitat_maker_api_client.client.time.monotonic') as mock_func:
+        mock_func.return_value = 1000.0
+        yield mock_func
+
+
+def make_event(device_id, display_name, attr_key, attr_value):
+    return HubitatEvent({
+        'deviceId': device_id,
+        'displayName': display_name,
+        'name': attr_key,
+        'value': attr_value,
+        'source': 'DEVICE',
+    })
+
+
+def get_devices_all_request_count(mock_requests):
+    return len([r for r in mock_requests.request_history if r.path.endswith('/devices/all')])
+
+
+def test_update_from_hubitat_event_without_polling(mock_requests, mock_monotonic):
+    client = HubitatClient(
+        HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID),
+        resync_interval=60,
+    )
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+    client.update_from_hubitat_event(make_event(FAKE_SWITCH_ON['id'], FAKE_SWITCH_ON['label'], 'switch', 'off'))
+    client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF['id'], FAKE_SWITCH_OFF['label'], 'switch', 'on'))
+    mock_monotonic.return_value += 30
+
+    assert client.get_on_switches() == {FAKE_SWITCH_OFF['label']}
+    assert get_devices_all_request_count(mock_requests) == 1
+
+    mock_monotonic.return_value += 30
+
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert get_devices_all_request_count(mock_requests) == 2
+
+
+def test_update_from_hubitat_event_unknown_device_resyncs(mock_requests, mock_monotonic):
+    client = HubitatClient(
+        HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID),
+    )
+    client.get_on_switches()
+
+    client.update_from_hubitat_event(make_event('999', 'New Switch', 'switch', 'on'))
+    client.get_on_switches()
+
+    assert get_devices_all_request_count(mock_requests) == 2
+
+    client.mark_event_gap()
+    client.get_on_switches()
+
+    assert get_devices_all_request_count(mock_requests) == 3
+
+
+def test_refresh_device_snapshot_replays_events(mock_requests):
+    client = HubitatClient(HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID))
+    client.get_on_switches()
+    fetching = []
+    max_fetching = []
+
+    def iter_devices():
+        fetching.append(True)
+        max_fetching.append(len(fetching))
+        yield FAKE_SWITCH_ON
+        time.sleep(0.01)
+        client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF['id'], FAKE_SWITCH_OFF['label'], 'switch', 'on'))
+        yield FAKE_SWITCH_OFF
+        fetching.pop()
+
+    with mock.patch.object(client.api_client, 'iter_devices', side_effect=iter_devices):
+        threads = [threading.Thread(target=client.refresh_device_snapshot) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Concurrent refreshes are serialized rather than sharing the buffer
+    assert max(max_fetching) == 1
+    assert client._device_snapshot.device_id_to_attributes[int(FAKE_SWITCH_OFF['id'])]['switch'] == 'on'
+    assert client._events_during_refresh is None
+
+
+def get_request_count(mock_requests, path_suffix):
+    return len([r for r in mock_requests.request_history if r.path.endswith(path_suffix)])
+
+
+def test_get_device_attributes(mock_client, mock_requests, mock_monotonic):
+    device_path = '/devices/{}'.format(FAKE_SWITCH_ON['id'])
+    mock_requests.get(f'{FAKE_URL_PREFIX}{device_path}?access_token={FAKE_ACCESS_TOKEN}', text=json.dumps(FAKE_SWITCH_ON_DETAIL))
+    mock_requests.get(f'{FAKE_URL_PREFIX}{device_path}/off?access_token={FAKE_ACCESS_TOKEN}', text='{}')
+
+    assert mock_client.get_device_attributes(FAKE_SWITCH_ON['label']) == {'switch': 'on'}
+    assert mock_client.get_device_attribute(FAKE_SWITCH_ON['label'], 'switch', capability='Switch') == 'on'
+    assert get_request_count(mock_requests, device_path) == 1
+
+    mock_monotonic.return_value += 5
+    mock_client.get_device_attributes(FAKE_SWITCH_ON['label'])
+    assert get_request_count(mock_requests, device_path) == 2
+
+    mock_client.turn_off_switch(FAKE_SWITCH_ON['label'])
+    mock_client.get_device_attributes(FAKE_SWITCH_ON['label'])
+    assert get_request_count(mock_requests, device_path) == 3
+    assert get_devices_all_request_count(mock_requests) == 1
+
+    with pytest.raises(DeviceNotFoundError):
+        mock_client.get_device_attributes('No Such Device')
+
+
+def test_identity_from_brief_devices(mock_requests):
+    mock_requests.get(FAKE_URL_DEVICES, text=json.dumps(FAKE_DEVICES_BRIEF_WITH_CAPABILITIES))
+    client = HubitatClient(HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID))
+
+    assert client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    assert client.get_rooms() == {d['room'] for d in FAKE_DEVICES_ALL}
+    assert get_devices_all_request_count(mock_requests) == 0
+
+    # Attribute values are only fetched once they are queried
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert get_devices_all_request_count(mock_requests) == 1
+    assert get_request_count(mock_requests, '/devices') == 1
+
+
+def test_identity_falls_back_to_devices_all(mock_requests, mock_monotonic):
+    client = HubitatClient(HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=FAKE_HUB_ID))
+
+    assert client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    assert client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert get_devices_all_request_count(mock_requests) == 1
+
+    # The brief listing lacked capabilities, so later refreshes skip it
+    mock_monotonic.return_value += client.identity_ttl
+    client.get_switches()
+    assert get_devices_all_request_count(mock_requests) == 2
+    assert get_request_count(mock_requests, '/devices') == 1
+
+
+def test_device_snapshot_drops_unused_fields():
+    device = {
+        **FAKE_SWITCH_ON,
+        'type': 'Generic Zigbee Outlet',
+        'commands': ['on', 'off', 'refresh'],
+        'attributes': {'switch': 'on', 'dataType': 'ENUM', 'values': ['on', 'off']},
+    }
+    snapshot = DeviceSnapshot(iter([device]), 'label')
+
+    assert trim_device(device, 'label') == {**FAKE_SWITCH_ON, 'attributes': {'switch': 'on'}}
+    assert snapshot.device_id_to_attributes == {1: {'switch': 'on'}}
+    assert not hasattr(snapshot, 'devices')
+
+
+def test_device_snapshot_without_attributes():
+    snapshot = DeviceSnapshot(FAKE_DEVICES_BRIEF_WITH_CAPABILITIES, 'label')
+
+    assert snapshot.capability_to_alias_to_device_ids['Switch'] == {FAKE_SWITCH_ON['label']: [1], FAKE_SWITCH_OFF['label']: [2]}
+    assert snapshot.device_id_to_attributes == {}
+    assert snapshot.capability_to_alias_to_attributes == {}
@@ -0,0 +1,324 @@
+import random
+import sys
+import threading
+import time
+import pytest
+from contextlib import contextmanager
+
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.device_cache import SortedNumbers
+
+
+@pytest.fixture
+def device_cache():
+    device_cache = InMemoryDeviceCache()
+    device_cache.clear()
+    return device_cache
+
+
+def test_apply_mutations(device_cache):
+    device_cache.apply_mutations([
+        ('add_device_for_capability', 'Switch', 'Lamp'),
+        ('add_device_for_capability_and_attribute', 'Switch', 'switch', 'on', 'Lamp'),
+        ('set_last_device_attr_value', 'Switch', 'Lamp', 'switch', 'on'),
+        ('set_last_device_attr_timestamp', 'Switch', 'Lamp', 'switch', 'on', 1234),
+    ])
+
+    assert device_cache.get_devices_by_capability('Switch') == {'Lamp'}
+    assert device_cache.get_devices_by_capability_and_attribute('Switch', 'switch', 'on') == {'Lamp'}
+    assert device_cache.get_last_device_attr_value('Switch', 'Lamp', 'switch') == 'on'
+    assert device_cache.get_last_device_attr_timestamp('Switch', 'Lamp', 'switch', 'on') == 1234
+
+
+def test_apply_mutations_uses_batch():
+    calls = []
+
+    class RecordingDeviceCache(InMemoryDeviceCache):
+        @contextmanager
+        def batch(self):
+            calls.append('begin')
+            yield
+            calls.append('commit')
+
+        def add_device_for_capability(self, capability, alias):
+            calls.append(alias)
+            super().add_device_for_capability(capability, alias)
+
+    device_cache = RecordingDeviceCache()
+    device_cache.clear()
+    device_cache.apply_mutations([
+        ('add_device_for_capability', 'Switch', 'Lamp'),
+        ('add_device_for_capability', 'Switch', 'Fan'),
+    ])
+
+    assert calls == ['begin', 'Lamp', 'Fan', 'commit']
+    assert device_cache.get_devices_by_capability('Switch') == {'Lamp', 'Fan'}
+
+
+def test_snapshot_round_trip(device_cache, tmp_path):
+    snapshot_path = str(tmp_path / 'device_cache.json')
+    device_cache.apply_mutations([
+        ('set_capabilities_for_device_id', 1, {'Switch'}),
+        ('add_device_for_capability', 'Switch', 'Lamp'),
+        ('add_device_for_capability_and_room', 'Switch', None, 'Lamp'),
+        ('add_device_for_capability_and_attribute', 'Switch', 'switch', 'on', 'Lamp'),
+        ('set_last_device_attr_value', None, 'Home', 'mode', 'Day'),
+        ('set_last_device_attr_timestamp', 'Switch', 'Lamp', 'switch', 'on', 1234),
+        ('add_device_for_capability', 'Battery', 'Lock'),
+        ('set_device_attr_number', 'Lock', 'battery', 12.0),
+    ])
+
+    device_cache.save_snapshot(snapshot_path)
+    restored_cache = InMemoryDeviceCache()
+    restored_cache.load_snapshot(snapshot_path)
+
+    assert restored_cache.get_capabilities_for_device_id(1) == {'Switch'}
+    assert restored_cache.get_devices_by_capability('Switch') == {'Lamp'}
+    assert restored_cache.get_devices_by_capability_and_attribute('Switch', 'switch', 'on') == {'Lamp'}
+    assert restored_cache.get_last_device_attr_value(None, 'Home', 'mode') == 'Day'
+    assert restored_cache.get_last_device_attr_timestamp('Switch', 'Lamp', 'switch', 'on') == 1234
+    assert restored_cache.get_devices_by_attribute_range('Battery', 'battery', None, 15) == {'Lock'}
+
+
+def test_get_devices_by_attribute_range(device_cache):
+    for alias, battery in [('Lock', 12.0), ('Door', 15.0), ('Motion', 80.0), ('Lock 2', 12.0)]:
+        device_cache.add_device_for_capability('Battery', alias)
+        device_cache.set_device_attr_number(alias, 'battery', battery)
+    # Indexed by attribute, so only devices with the capability are returned
+    device_cache.set_device_attr_number('Sensor', 'battery', 10.0)
+
+    assert device_cache.get_devices_by_attribute_range('Battery', 'battery', None, 15) == {'Lock', 'Lock 2'}
+    assert device_cache.get_devices_by_attribute_range('Battery', 'battery', 15, None) == {'Door', 'Motion'}
+    assert device_cache.get_devices_by_attribute_range('Battery', 'battery', None, None) == {'Lock', 'Lock 2', 'Door', 'Motion'}
+    assert device_cache.get_devices_by_attribute_range('Battery', 'temperature', None, None) == set()
+
+    device_cache.set_device_attr_number('Lock', 'battery', 90.0)
+    device_cache.set_device_attr_number('Lock 2', 'battery', None)
+
+    assert device_cache.get_devices_by_attribute_range('Battery', 'battery', None, 15) == set()
+    assert device_cache.get_devices_by_attribute_range('Battery', 'battery', 80, None) == {'Lock', 'Motion'}
+
+
+def test_sorted_numbers_match_sorted_list(monkeypatch):
+    # Small chunks so adds and removes split and drop them
+    monkeypatch.setattr(SortedNumbers, 'CHUNK_SIZE', 2)
+    rng = random.Random(0)
+    entries = {(float(rng.randrange(20)), str(i)) for i in range(30)}
+    numbers = SortedNumbers(entries)
+
+    for _ in range(500):
+        entry = (float(rng.randrange(20)), str(rng.randrange(40)))
+        if entry in entries:
+            entries.remove(entry)
+            numbers.remove(entry)
+        else:
+            entries.add(entry)
+            numbers.add(entry)
+        numbers.remove((100.0, 'missing'))
+
+        assert [e for chunk in numbers.chunks for e in chunk] == sorted(entries)
+        assert all(len(chunk) <= 4 for chunk in numbers.chunks)
+        lo, hi = sorted(rng.sample(range(-1, 22), 2))
+        assert set(numbers.aliases_in_range(lo, hi)) == {alias for n, alias in entries if lo <= n < hi}
+        assert set(numbers.aliases_in_range(None, hi)) == {alias for n, alias in entries if n < hi}
+        assert set(numbers.aliases_in_range(lo, None)) == {alias for n, alias in entries if lo <= n}
+
+
+def test_lookups_do_not_allocate_or_leak(device_cache):
+    device_cache.add_device_for_capability_and_room('Switch', 'Kitchen', 'Lamp')
+    device_cache.add_device_for_capability_and_room('Switch', 'Den', 'Fan')
+
+    assert device_cache.get_devices_by_capability_and_room('Switch', 'Kitchen') == {'Lamp'}
+    assert device_cache.get_devices_by_capability_and_room('Switch', 'Attic') == set()
+    assert device_cache.get_devices_by_capability_and_attribute('Switch', 'switch', 'on') == set()
+    assert device_cache.get_devices_by_capability('Lock') == set()
+    assert len(device_cache._state.cached_cap_and_room_to_aliases) == 2
+    assert device_cache._state.cached_cap_to_attr_to_aliases == {}
+    assert device_cache._state.cached_cap_to_aliases == {}
+
+    device_cache.remove_device_for_capability_and_room('Switch', 'Den', 'Fan')
+    assert len(device_cache._state.cached_cap_and_room_to_aliases) == 1
+
+
+def test_returned_sets_are_read_only(device_cache):
+    device_cache.add_device_for_capability('Switch', 'Lamp')
+    aliases = device_cache.get_devices_by_capability('Switch')
+
+    with pytest.raises(TypeError):
+        aliases.add('Fan')
+    with pytest.raises(TypeError):
+        aliases |= {'Fan'}
+    with pytest.raises(TypeError):
+        device_cache.get_devices_by_capability('Lock').add('Fan')
+
+    aliases_copy = aliases.copy()
+    aliases_copy.add('Fan')
+    device_cache.add_device_for_capability('Switch', 'Heater')
+
+    # Writers replace the set rather than change the one handed out
+    assert aliases == {'Lamp'}
+    assert device_cache.get_devices_by_capability('Switch') == {'Lamp', 'Heater'}
+
+
+def test_batch_publishes_on_exit(device_cache):
+    device_cache.add_device_for_capability('Switch', 'Lamp')
+    assert device_cache.get_devices_by_capability('Switch') == {'Lamp'}
+
+    # Readers in other threads see the whole batch or none of it, even when
+    # it empties an entry on the way
+    seen = []
+    with device_cache.batch():
+        device_cache.remove_device_for_capability('Switch', 'Lamp')
+        reader = threading.Thread(target=lambda: seen.append(device_cache.get_devices_by_capability('Switch')))
+        reader.start()
+        reader.join(0.1)
+        device_cache.add_device_for_capability('Switch', 'Fan')
+        device_cache.add_device_for_capability_and_room('Switch', 'Den', 'Fan')
+    reader.join()
+
+    assert seen == [{'Fan'}]
+    assert device_cache.get_devices_by_capability_and_room('Switch', 'Den') == {'Fan'}
+
+
+def test_alias_sets_are_copied_on_read_not_write(device_cache):
+    for i in range(100):
+        device_cache.add_device_for_capability('Switch', str(i))
+    assert device_cache._state.cached_cap_to_aliases.views == {}
+
+    aliases = device_cache.get_devices_by_capability('Switch')
+    assert device_cache.get_devices_by_capability('Switch') is aliases
+
+    device_cache.remove_device_for_capability('Switch', '0')
+    device_cache.add_device_for_capability('Switch', '100')
+    assert device_cache._state.cached_cap_to_aliases.views == {}
+    assert device_cache.get_devices_by_capability('Switch') == {str(i) for i in range(1, 101)}
+    assert len(aliases) == 100
+
+
+@pytest.fixture
+def fast_thread_switching():
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(switch_interval)
+
+
+def test_concurrent_reads_during_writes(device_cache, tmp_path, fast_thread_switching):
+    # The writer keeps exactly 20 switches, moving them between generations of
+    # aliases in batches and one at a time; readers must only ever see whole
+    # published sets
+    num_devices = 20
+    num_generations = 200
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            for generation in range(1, num_generations):
+                with device_cache.batch():
+                    for i in range(num_devices):
+                        device_cache.remove_device_for_capability('Switch', f'{generation - 1}-{i}')
+                        device_cache.add_device_for_capability('Switch', f'{generation}-{i}')
+                        device_cache.set_device_attr_number(str(i), 'battery', float(generation))
+                device_cache.set_device_attr_number('Lock', 'battery', float(generation % 2))
+                device_cache.add_device_for_capability('Lock', str(generation))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                aliases = device_cache.get_devices_by_capability('Switch')
+                assert len(aliases) == num_devices
+                assert len({alias.split('-')[0] for alias in aliases}) == 1
+
+                batteries = device_cache.get_devices_by_attribute_range('Battery', 'battery', 0, None)
+                assert len(batteries - {'Lock'}) == num_devices
+                assert len(device_cache.get_devices_by_capability('Lock')) <= num_generations
+                device_cache.save_snapshot(str(tmp_path / f'{threading.get_ident()}.json'))
+        except Exception as e:
+            errors.append(e)
+
+    for i in range(num_devices):
+        device_cache.add_device_for_capability('Switch', f'0-{i}')
+        device_cache.add_device_for_capability('Battery', str(i))
+        device_cache.set_device_attr_number(str(i), 'battery', 0.0)
+    device_cache.add_device_for_capability('Battery', 'Lock')
+
+    threads = [threading.Thread(target=read) for _ in range(8)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert device_cache.get_devices_by_capability('Switch') == {f'{num_generations - 1}-{i}' for i in range(num_devices)}
+    assert len(device_cache.get_devices_by_capability('Lock')) == num_generations - 1
+
+
+@pytest.mark.parametrize('write, read, expected', [
+    (
+        lambda c: c.add_device_for_capability('Switch', 'Fan'),
+        lambda c: c.get_devices_by_capability('Switch'),
+        {'Lamp', 'Fan'},
+    ),
+    (
+        lambda c: c.add_device_for_capability_and_room('Switch', 'Den', 'Fan'),
+        lambda c: c.get_devices_by_capability_and_room('Switch', 'Den'),
+        {'Lamp', 'Fan'},
+    ),
+    (
+        lambda c: c.set_device_attr_number('Fan', 'battery', 20.0),
+        lambda c: c.get_devices_by_attribute_range('Battery', 'battery', None, None),
+        {'Lamp', 'Fan'},
+    ),
+    (
+        lambda c: c.set_last_device_attr_value('Switch', 'Fan', 'switch', 'on'),
+        lambda c: {c.get_last_device_attr_value('Switch', 'Fan', 'switch')},
+        {'on'},
+    ),
+])
+def test_write_during_swap_lands_in_new_generation(device_cache, write, read, expected):
+    generation = device_cache.new_generation()
+    generation.add_device_for_capability('Switch', 'Lamp')
+    generation.add_device_for_capability_and_room('Switch', 'Den', 'Lamp')
+    generation.add_device_for_capability('Battery', 'Lamp')
+    generation.add_device_for_capability('Battery', 'Fan')
+    generation.set_device_attr_number('Lamp', 'battery', 10.0)
+
+    # Start the write while a swap holds the lock, so it can only proceed
+    # once the new generation is in place
+    with device_cache._write_lock:
+        writer = threading.Thread(target=write, args=(device_cache,))
+        writer.start()
+        writer.join(0.1)
+        device_cache.swap_generation(generation)
+    writer.join()
+
+    assert read(device_cache) == expected
+
+
+def test_write_cost_does_not_grow_with_hub_size():
+    # Copying an index entry on each write made every event cost time
+    # linear in the number of devices sharing the entry
+    def seconds_per_write(num_devices: int, num_writes: int = 2000) -> float:
+        device_cache = InMemoryDeviceCache()
+        with device_cache.batch():
+            for i in range(num_devices):
+                device_cache.add_device_for_capability_and_attribute('Switch', 'switch', 'on', str(i))
+                device_cache.set_device_attr_number(str(i), 'power', float(i))
+        aliases = [str(i * 7919 % num_devices) for i in range(num_writes)]
+
+        best = float('inf')
+        for repeat in range(5):
+            start = time.perf_counter()
+            for n, alias in enumerate(aliases):
+                device_cache.remove_device_for_capability_and_attribute('Switch', 'switch', 'on', alias)
+                device_cache.add_device_for_capability_and_attribute('Switch', 'switch', 'on', alias)
+                device_cache.set_device_attr_number(alias, 'power', float(repeat * num_writes + n))
+            best = min(best, time.perf_counter() - start)
+        return best / num_writes
+
+    assert seconds_per_write(32000) < 4 * seconds_per_write(500)
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+import requests
+
+from hubitat_maker_api_client.async_api_client import AsyncHubitatAPIClient
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.constants import HSM_STATE_ARMED_AWAY
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.emulator import HubEmulator
+from hubitat_maker_api_client.emulator import make_emulated_devices
+from hubitat_maker_api_client.event_socket_emulator import EventSocketEmulator
+from hubitat_maker_api_client.event_socket_listener import EventSocketListener
+from tests.event_socket_listener_test import wait_until
+
+
+@pytest.fixture
+def hub():
+    with HubEmulator(num_devices=60) as hub:
+        yield hub
+
+
+def test_make_emulated_devices():
+    devices = make_emulated_devices(12)
+
+    assert len({d['label'] for d in devices}) == 12
+    assert devices == make_emulated_devices(12)
+
+
+def test_rejects_bad_access_token(hub):
+    resp = requests.get(f'{hub.host}/apps/api/{hub.app_id}/devices/all?access_token=wrong')
+    assert resp.status_code == 401
+
+
+@pytest.mark.parametrize('client_class', [HubitatClient, HubitatCachingClient])
+def test_serves_clients(hub, client_class):
+    with hub.make_api_client() as api_client:
+        if client_class == HubitatCachingClient:
+            client = HubitatCachingClient(api_client, InMemoryDeviceCache())
+        else:
+            client = HubitatClient(api_client)
+
+        assert len(client.get_switches()) == 20
+        assert client.get_on_switches() == set()
+        assert client.get_mode() == 'Day'
+
+        client.turn_on_switch('Outlet 1')
+        client.set_mode('Night')
+        client.set_hsm(HSM_STATE_ARMED_AWAY)
+
+        assert client.get_device_attributes('Outlet 1')['switch'] == 'on'
+        assert hub.modes[2] == {'id': 3, 'name': 'Night', 'active': True}
+        assert hub.hsm == HSM_STATE_ARMED_AWAY
+        assert hub.request_counts['devices/{id}/{command}'] == 1
+
+
+def test_event_socket_emulator(hub):
+    with hub.make_api_client() as api_client:
+        client = HubitatCachingClient(api_client, InMemoryDeviceCache())
+
+        async def run():
+            async with EventSocketEmulator(hub) as event_socket:
+                listener = EventSocketListener(client, event_socket.uri)
+                task = asyncio.create_task(listener.run())
+                await event_socket.wait_for_clients()
+
+                await event_socket.send_events([(1, 'switch', 'on'), (7, 'switch', 'on'), (1, 'power', '1500')])
+                # Commands sent to the hub come back as events too
+                await asyncio.to_thread(client.turn_on_switch, 'Outlet 13')
+                await asyncio.to_thread(client.set_mode, 'Away')
+                await wait_until(lambda: listener.events_applied == 5)
+
+                await listener.stop()
+                await task
+
+            assert event_socket.events_sent == 5
+            assert client.get_on_switches() == {'Outlet 1', 'Outlet 7', 'Outlet 13'}
+            assert client.get_mode() == 'Away'
+            assert client.get_devices_by_attribute_range('PowerMeter', 'power', lo=1000) == {'Outlet 1'}
+
+        asyncio.run(run())
+
+
+def test_async_timeout_applies_per_read_not_to_whole_body():
+    # /devices/all takes ~0.6s to stream, longer than the timeout, but no
+    # single read waits more than chunk_delay
+    with HubEmulator(num_devices=60, chunk_delay=0.02, chunk_size=512) as hub:
+        async def run():
+            async with AsyncHubitatAPIClient(
+                host=hub.host,
+                app_id=hub.app_id,
+                access_token=hub.access_token,
+                timeout=0.3,
+            ) as api_client:
+                return await api_client.get_devices()
+
+        assert len(asyncio.run(run())) == 60
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import threading
+
+import mock
+import pytest
+from websockets.asyncio.server import serve
+
+from hubitat_maker_api_client.event_socket_listener import EventSocketListener
+from hubitat_maker_api_client.event_socket_listener import OVERFLOW_DROP_NEWEST
+from hubitat_maker_api_client.event_socket_listener import OVERFLOW_DROP_OLDEST
+from hubitat_maker_api_client.event_socket_listener import OVERFLOW_RESYNC
+from tests.caching_client_test import FAKE_SWITCH_OFF
+from tests.caching_client_test import FAKE_SWITCH_ON
+from tests.caching_client_test import mock_client  # noqa
+from tests.caching_client_test import mock_requests  # noqa
+
+
+def make_message(device, attr_key, attr_value):
+    return json.dumps({
+        'deviceId': device['id'],
+        'displayName': device['label'],
+        'name': attr_key,
+        'value': attr_value,
+        'source': 'DEVICE',
+    })
+
+
+async def wait_until(condition, timeout=5.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def run_with_server(connection_handlers, test_coro):
+    # Each connection to the server is handled by the next handler in the list
+    async def run():
+        handlers = iter(connection_handlers)
+
+        async def handler(websocket):
+            await next(handlers)(websocket)
+
+        async with serve(handler, 'localhost', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            await test_coro(f'ws://localhost:{port}/eventsocket')
+    asyncio.run(run())
+
+
+async def serve_forever(websocket):
+    await websocket.wait_closed()
+
+
+def test_applies_events(mock_client):  # noqa
+    async def send_events(websocket):
+        await websocket.send(make_message(FAKE_SWITCH_ON, 'switch', 'off'))
+        await websocket.send('not json')
+        await websocket.send(make_message(FAKE_SWITCH_OFF, 'switch', 'on'))
+        await websocket.wait_closed()
+
+    async def test(uri):
+        listener = EventSocketListener(mock_client, uri)
+        task = asyncio.create_task(listener.run())
+        await wait_until(lambda: listener.events_applied == 2)
+        await listener.stop()
+        await task
+
+        assert listener.events_received == 2
+        assert listener.reconnects == 0
+        assert mock_client.get_on_switches() == {FAKE_SWITCH_OFF['label']}
+
+    run_with_server([send_events], test)
+
+
+def test_resyncs_after_reconnect(mock_client):  # noqa
+    async def send_event_and_disconnect(websocket):
+        await websocket.send(make_message(FAKE_SWITCH_OFF, 'switch', 'on'))
+
+    async def test(uri):
+        listener = EventSocketListener(mock_client, uri, min_reconnect_delay=0.01)
+        with mock.patch.object(mock_client, 'reconcile', wraps=mock_client.reconcile) as mock_reconcile:
+            task = asyncio.create_task(listener.run())
+            await wait_until(lambda: listener.resyncs == 1)
+            await listener.stop()
+            await task
+
+        mock_reconcile.assert_called_once_with()
+        assert listener.reconnects == 1
+        assert mock_client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+
+    run_with_server([send_event_and_disconnect, serve_forever], test)
+
+
+def test_retries_failed_resync(mock_client):  # noqa
+    async def send_event_and_disconnect(websocket):
+        await websocket.send(make_message(FAKE_SWITCH_OFF, 'switch', 'on'))
+
+    async def test(uri):
+        listener = EventSocketListener(mock_client, uri, min_reconnect_delay=0.01)
+        reconcile = mock_client.reconcile
+        failures = [ConnectionError()]
+
+        def fail_once():
+            if failures:
+                raise failures.pop()
+            reconcile()
+
+        with mock.patch.object(mock_client, 'reconcile', side_effect=fail_once) as mock_reconcile:
+            task = asyncio.create_task(listener.run())
+            await wait_until(lambda: mock_reconcile.call_count == 2 and mock_client.get_on_switches() == {FAKE_SWITCH_ON['label']})
+            await listener.stop()
+            await task
+
+        assert listener.resyncs == 2
+        assert isinstance(listener.last_error, ConnectionError)
+
+    run_with_server([send_event_and_disconnect, serve_forever], test)
+
+
+@pytest.mark.parametrize('overflow_policy,expected_on_switches,expected_dropped,expected_resyncs', [
+    (OVERFLOW_DROP_NEWEST, {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}, 2, 0),
+    (OVERFLOW_DROP_OLDEST, {FAKE_SWITCH_OFF['label']}, 2, 0),
+    (OVERFLOW_RESYNC, set(), 3, 1),
+])
+def test_overflow_policy(mock_client, overflow_policy, expected_on_switches, expected_dropped, expected_resyncs):  # noqa
+    writer_started = threading.Event()
+    writer_released = threading.Event()
+    update_from_hubitat_event = mock_client.update_from_hubitat_event
+
+    def slow_update_from_hubitat_event(event):
+        writer_started.set()
+        writer_released.wait(5)
+        update_from_hubitat_event(event)
+
+    async def send_events(websocket):
+        # The first event blocks the writer, the next two fill the queue and
+        # the last two overflow it
+        await websocket.send(make_message(FAKE_SWITCH_OFF, 'switch', 'on'))
+        await wait_until(writer_started.is_set)
+        await websocket.send(make_message(FAKE_SWITCH_ON, 'switch', 'off'))
+        await websocket.send(make_message(FAKE_SWITCH_ON, 'switch', 'on'))
+        await websocket.send(make_message(FAKE_SWITCH_ON, 'switch', 'on'))
+        await websocket.send(make_message(FAKE_SWITCH_ON, 'switch', 'off'))
+        await websocket.wait_closed()
+
+    async def test(uri):
+        listener = EventSocketListener(mock_client, uri, queue_size=2, overflow_policy=overflow_policy)
+        with mock.patch.object(mock_client, 'update_from_hubitat_event', side_effect=slow_update_from_hubitat_event):
+            task = asyncio.create_task(listener.run())
+            await wait_until(lambda: listener.events_received == 5)
+            writer_released.set()
+            await wait_until(lambda: listener.events_applied + listener.events_dropped == 5)
+            await listener.stop()
+            await task
+
+        assert listener.events_dropped == expected_dropped
+        assert listener.resyncs == expected_resyncs
+        assert mock_client.get_on_switches() == expected_on_switches
+
+    run_with_server([send_events], test)
+
+
+def test_unknown_overflow_policy(mock_client):  # noqa
+    with pytest.raises(ValueError):
+        EventSocketListener(mock_client, 'ws://localhost/eventsocket', overflow_policy='spill')
+
+
+def test_batches_events(mock_client):  # noqa
+    async def send_events(websocket):
+        await websocket.send(make_message(FAKE_SWITCH_ON, 'switch', 'off'))
+        await websocket.send(make_message(FAKE_SWITCH_OFF, 'switch', 'on'))
+        await websocket.send(make_message(FAKE_SWITCH_OFF, 'switch', 'off'))
+        await websocket.wait_closed()
+
+    async def test(uri):
+        listener = EventSocketListener(mock_client, uri, batch_size=3, batch_window=5.0)
+        with mock.patch.object(mock_client, 'update_from_hubitat_events', wraps=mock_client.update_from_hubitat_events) as mock_update:
+            task = asyncio.create_task(listener.run())
+            await wait_until(lambda: listener.events_applied == 3)
+            await listener.stop()
+            await task
+
+        assert mock_update.call_count == 1
+        assert mock_client.get_on_switches() == set()
+
+    run_with_server([send_events], test)
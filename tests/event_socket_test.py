@@ -0,0 +1,69 @@
+import json
+
+import mock
+import pytest
+
+from hubitat_maker_api_client.event_socket import HubitatEvent
+
+
+FAKE_EVENT = {
+    'source': 'DEVICE',
+    'name': 'switch',
+    'displayName': 'Kitchen Ceiling',
+    'value': 'on',
+    'type': 'physical',
+    'unit': None,
+    'deviceId': 1,
+    'hubId': 0,
+    'installedAppId': 0,
+    'descriptionText': 'Kitchen Ceiling was turned on',
+}
+
+FAKE_TIMESTAMP = 1575691027
+
+
+@pytest.fixture
+def mock_time():
+    with mock.patch('hubitat_maker_api_client.event_socket.time.time') as mock_func:
+        mock_func.return_value = FAKE_TIMESTAMP + 0.5
+        yield mock_func
+
+
+def test_from_bytes(mock_time):
+    event = HubitatEvent.from_bytes(json.dumps(FAKE_EVENT).encode())
+
+    assert event.device_id == 1
+    assert event.device_label == 'Kitchen Ceiling'
+    assert event.attr_key == 'switch'
+    assert event.attr_value == 'on'
+    assert event.source == 'DEVICE'
+    assert event.timestamp == FAKE_TIMESTAMP
+    assert event.hub_timestamp is None
+    assert event.raw_event is None
+    assert not hasattr(event, '__dict__')
+
+
+def test_keep_raw_event():
+    event = HubitatEvent.from_bytes(json.dumps(FAKE_EVENT), keep_raw_event=True)
+
+    assert event.raw_event == FAKE_EVENT
+
+
+def test_hub_timestamp(mock_time):
+    event = HubitatEvent(dict(FAKE_EVENT, date='2019-12-07T03:57:00+0000'))
+
+    assert event.hub_timestamp == FAKE_TIMESTAMP - 7
+    assert event.timestamp == FAKE_TIMESTAMP - 7
+
+
+def test_unparseable_hub_timestamp(mock_time):
+    event = HubitatEvent(dict(FAKE_EVENT, date='yesterday'))
+
+    assert event.hub_timestamp is None
+    assert event.timestamp == FAKE_TIMESTAMP
+
+
+def test_location_event():
+    event = HubitatEvent(dict(FAKE_EVENT, deviceId=None, source='LOCATION', name='mode', value='Night'))
+
+    assert event.device_id is None
@@ -0,0 +1,238 @@
+import inspect
+import json
+import re
+import threading
+import time
+import requests_mock
+import pytest
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.constants import HSM_ACTION_ARM_AWAY
+from hubitat_maker_api_client.constants import HSM_STATE_ARMED_AWAY
+from hubitat_maker_api_client.constants import HSM_STATE_DISARMED
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.errors import DeviceNotFoundError
+from hubitat_maker_api_client.event_socket import HubitatEvent
+from hubitat_maker_api_client.federated_client import FederatedHubitatClient
+
+
+FAKE_APP_ID = 'fake_app_id'
+FAKE_ACCESS_TOKEN = 'fake_access_token'
+FAKE_DEVICE_DATE = '2019-12-07T03:57:07+0000'
+
+FAKE_HUB_DEVICES = {
+    'house': [
+        {
+            'id': '1',
+            'label': 'Kitchen Ceiling',
+            'capabilities': ['Switch'],
+            'attributes': {'switch': 'on'},
+            'date': FAKE_DEVICE_DATE,
+            'room': 'Kitchen',
+        },
+        {
+            'id': '2',
+            'label': 'Porch Light',
+            'capabilities': ['Switch'],
+            'attributes': {'switch': 'off'},
+            'date': FAKE_DEVICE_DATE,
+            'room': 'Porch',
+        },
+    ],
+    'garage': [
+        {
+            'id': '1',
+            'label': 'Porch Light',
+            'capabilities': ['Switch'],
+            'attributes': {'switch': 'on'},
+            'date': FAKE_DEVICE_DATE,
+            'room': 'Porch',
+        },
+        {
+            'id': '2',
+            'label': 'Garage Door',
+            'capabilities': ['ContactSensor'],
+            'attributes': {'contact': 'open'},
+            'date': FAKE_DEVICE_DATE,
+            'room': 'Garage',
+        },
+    ],
+}
+
+
+def url_prefix(hub):
+    return f'https://cloud.hubitat.com/api/{hub}/apps/{FAKE_APP_ID}'
+
+
+def make_api_client(hub):
+    return HubitatAPIClient(app_id=FAKE_APP_ID, access_token=FAKE_ACCESS_TOKEN, hub_id=hub)
+
+
+@pytest.fixture(autouse=True)
+def mock_requests():
+    with requests_mock.mock() as req_mock:
+        for hub, devices in FAKE_HUB_DEVICES.items():
+            req_mock.get(f'{url_prefix(hub)}/devices/all?access_token={FAKE_ACCESS_TOKEN}', text=json.dumps(devices))
+            req_mock.get(f'{url_prefix(hub)}/devices?access_token={FAKE_ACCESS_TOKEN}', text=json.dumps([
+                {'id': d['id'], 'label': d['label'], 'room': d['room']} for d in devices
+            ]))
+            req_mock.get(f'{url_prefix(hub)}/modes?access_token={FAKE_ACCESS_TOKEN}', text=json.dumps([
+                {'active': True, 'id': 1, 'name': 'Day'},
+                {'active': False, 'id': 2, 'name': 'Night'},
+            ]))
+            req_mock.get(f'{url_prefix(hub)}/hsm?access_token={FAKE_ACCESS_TOKEN}', text=json.dumps({'hsm': HSM_STATE_DISARMED}))
+        yield req_mock
+
+
+@pytest.fixture
+def mock_client():
+    with FederatedHubitatClient({
+        'house': HubitatCachingClient(make_api_client('house'), InMemoryDeviceCache()),
+        'garage': HubitatClient(make_api_client('garage')),
+    }) as client:
+        yield client
+
+
+def test_merges_hubs_with_qualified_aliases(mock_client):
+    assert mock_client.get_switches() == {'house/Kitchen Ceiling', 'house/Porch Light', 'garage/Porch Light'}
+    assert mock_client.get_on_switches() == {'house/Kitchen Ceiling', 'garage/Porch Light'}
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Porch') == {'house/Porch Light', 'garage/Porch Light'}
+    assert mock_client.query('Switch', room='Porch', attrs={'switch': 'on'}) == {'garage/Porch Light'}
+    assert mock_client.get_open_doors() == {'garage/Garage Door'}
+    assert mock_client.get_capabilities() == {'Switch', 'ContactSensor'}
+    assert mock_client.get_rooms() == {'Kitchen', 'Porch', 'Garage'}
+    assert mock_client.get_capabilities_for_device_id(2, hub='garage') == {'ContactSensor'}
+
+
+def test_send_commands_routes_to_owning_hub(mock_client, mock_requests):
+    for hub, device_id in [('house', 2), ('garage', 1)]:
+        mock_requests.get(
+            f'{url_prefix(hub)}/devices/{device_id}/on?access_token={FAKE_ACCESS_TOKEN}',
+            text=json.dumps({'hub': hub}),
+        )
+
+    results = mock_client.send_commands([
+        ('Switch', 'garage/Porch Light', 'on'),
+        ('Switch', 'attic/Fan', 'on'),
+        ('Switch', 'house/Porch Light', 'on'),
+    ])
+
+    assert [result.alias for result in results] == ['garage/Porch Light', 'attic/Fan', 'house/Porch Light']
+    assert results[0].response == {'hub': 'garage'}
+    assert isinstance(results[1].error, DeviceNotFoundError)
+    assert results[2].response == {'hub': 'house'}
+
+    with pytest.raises(DeviceNotFoundError):
+        mock_client.turn_on_switch('Porch Light')
+
+
+def test_mode_and_hsm_across_hubs(mock_client, mock_requests):
+    assert mock_client.get_mode() == 'Day'
+
+    for hub in FAKE_HUB_DEVICES:
+        mock_requests.get(f'{url_prefix(hub)}/hsm/{HSM_ACTION_ARM_AWAY}?access_token={FAKE_ACCESS_TOKEN}', text='{}')
+    mock_client.set_hsm(HSM_STATE_ARMED_AWAY)
+
+    assert {r.url.split('/')[4] for r in mock_requests.request_history if HSM_ACTION_ARM_AWAY in r.url} == {'house', 'garage'}
+
+    mock_requests.get(f'{url_prefix("garage")}/hsm?access_token={FAKE_ACCESS_TOKEN}', text=json.dumps({'hsm': HSM_STATE_ARMED_AWAY}))
+    assert mock_client.get_hsm() is None
+
+
+def test_update_from_hubitat_event_for_hub(mock_client):
+    event = HubitatEvent({
+        'deviceId': '1',
+        'displayName': 'Kitchen Ceiling',
+        'name': 'switch',
+        'value': 'off',
+        'source': 'DEVICE',
+    })
+    mock_client.update_from_hubitat_event(event, hub='house')
+
+    assert mock_client.get_on_switches() == {'garage/Porch Light'}
+    assert mock_client.get_last_device_value('house/Kitchen Ceiling', 'switch') == 'off'
+    with pytest.raises(ValueError):
+        mock_client.update_from_hubitat_event(event)
+    with pytest.raises(TypeError):
+        mock_client.get_last_device_value('garage/Porch Light', 'switch')
+
+
+def test_create_loads_hubs_in_parallel():
+    # Each factory only returns once every hub has started loading
+    barrier = threading.Barrier(len(FAKE_HUB_DEVICES), timeout=5)
+
+    def make_factory(hub):
+        def factory():
+            barrier.wait()
+            return HubitatCachingClient(make_api_client(hub), InMemoryDeviceCache())
+        return factory
+
+    with FederatedHubitatClient.create({hub: make_factory(hub) for hub in FAKE_HUB_DEVICES}) as client:
+        assert client.get_on_switches() == {'house/Kitchen Ceiling', 'garage/Porch Light'}
+
+
+def test_hub_name_may_not_contain_separator():
+    with pytest.raises(ValueError):
+        FederatedHubitatClient({'main/house': HubitatClient(make_api_client('house'))})
+
+
+class BarrierClient(HubitatClient):
+    # Only answers once `barrier.parties` calls are waiting at once
+    def __init__(self, barrier):
+        super().__init__(make_api_client('barrier'))
+        self.barrier = barrier
+
+    def get_devices_by_capability(self, capability):
+        self.barrier.wait()
+        return {'Lamp'}
+
+
+def test_concurrent_callers_do_not_queue():
+    num_callers = 3
+    barrier = threading.Barrier(num_callers * 2, timeout=5)
+    results = []
+
+    with FederatedHubitatClient({'house': BarrierClient(barrier), 'garage': BarrierClient(barrier)}) as client:
+        threads = [threading.Thread(target=lambda: results.append(client.get_switches())) for _ in range(num_callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == [{'house/Lamp', 'garage/Lamp'}] * num_callers
+
+
+def test_fan_out_error_waits_for_other_hubs(mock_client):
+    garage_done = threading.Event()
+
+    def set_mode(client):
+        if client is mock_client.hub_clients['house']:
+            raise DeviceNotFoundError('house')
+        time.sleep(0.1)
+        garage_done.set()
+
+    with pytest.raises(DeviceNotFoundError):
+        mock_client._fan_out(set_mode)
+    assert garage_done.is_set()
+
+
+def test_inherited_methods_work_or_are_blocked(mock_client):
+    # Every HubitatClient method left to inheritance only uses what a
+    # FederatedHubitatClient has, since HubitatClient.__init__ isn't called
+    for name, method in vars(HubitatClient).items():
+        if name.startswith('__') or name in vars(FederatedHubitatClient) or not callable(method):
+            continue
+        for attr in re.findall(r'self\.(\w+)', inspect.getsource(method)):
+            assert hasattr(mock_client, attr), (name, attr)
+
+    with pytest.raises(NotImplementedError):
+        mock_client._get_mode_from_api()
+
+
+def test_has_no_device_snapshot_of_its_own(mock_client):
+    with pytest.raises(NotImplementedError):
+        mock_client.refresh_device_snapshot()
+    with pytest.raises(NotImplementedError):
+        mock_client.refresh_identity_snapshot()
@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import time
+
+import pytest
+
+from hubitat_maker_api_client.async_api_client import AsyncHubitatAPIClient
+from hubitat_maker_api_client.async_client import AsyncHubitatClient
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.client import HubitatClient
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.emulator import HubEmulator
+from hubitat_maker_api_client.emulator import format_hub_date
+from hubitat_maker_api_client.event_socket import HubitatEvent
+from hubitat_maker_api_client.instrumentation import CACHE_HITS
+from hubitat_maker_api_client.instrumentation import CACHE_MISSES
+from hubitat_maker_api_client.instrumentation import CompositeInstrumentation
+from hubitat_maker_api_client.instrumentation import EVENT_APPLY_SECONDS
+from hubitat_maker_api_client.instrumentation import EVENT_LAG_SECONDS
+from hubitat_maker_api_client.instrumentation import EVENTS_APPLIED
+from hubitat_maker_api_client.instrumentation import LOAD_CACHE_SECONDS
+from hubitat_maker_api_client.instrumentation import OpenTelemetrySpanAdapter
+from hubitat_maker_api_client.instrumentation import PrometheusInstrumentation
+from hubitat_maker_api_client.instrumentation import REQUEST_SECONDS
+from hubitat_maker_api_client.instrumentation import RESPONSE_BYTES
+from hubitat_maker_api_client.instrumentation import endpoint_template
+
+
+class FakeTracer:
+    def __init__(self):
+        self.spans = []
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        self.spans.append((name, attributes))
+        yield
+
+
+@pytest.fixture
+def hub():
+    with HubEmulator(num_devices=12) as hub:
+        yield hub
+
+
+@pytest.mark.parametrize('endpoint, template', [
+    ('/devices/all', '/devices/all'),
+    ('/devices', '/devices'),
+    ('/devices/12', '/devices/{id}'),
+    ('/devices/12/events', '/devices/{id}/events'),
+    ('/devices/12/setLevel/50', '/devices/{id}/{command}'),
+    ('/modes/3', '/modes/{id}'),
+    ('/hsm', '/hsm'),
+    ('/hsm/armAway', '/hsm/{command}'),
+])
+def test_endpoint_template(endpoint, template):
+    assert endpoint_template(endpoint) == template
+
+
+def test_prometheus_render():
+    metrics = PrometheusInstrumentation(buckets={REQUEST_SECONDS: (0.1, 1.0)})
+    metrics.observe(REQUEST_SECONDS, 0.05, {'endpoint': '/devices/all'})
+    metrics.observe(REQUEST_SECONDS, 0.5, {'endpoint': '/devices/all'})
+    metrics.increment(CACHE_HITS, labels={'cache': 'say "hi"\n'})
+
+    assert metrics.render() == '\n'.join([
+        '# TYPE hubitat_cache_hits_total counter',
+        'hubitat_cache_hits_total{cache="say \\"hi\\"\\n"} 1',
+        '# TYPE hubitat_request_seconds histogram',
+        'hubitat_request_seconds_bucket{endpoint="/devices/all",le="0.1"} 1',
+        'hubitat_request_seconds_bucket{endpoint="/devices/all",le="1"} 2',
+        'hubitat_request_seconds_bucket{endpoint="/devices/all",le="+Inf"} 2',
+        'hubitat_request_seconds_sum{endpoint="/devices/all"} 0.55',
+        'hubitat_request_seconds_count{endpoint="/devices/all"} 2',
+    ]) + '\n'
+
+
+def test_instruments_requests_caches_and_events(hub):
+    metrics = PrometheusInstrumentation()
+    tracer = FakeTracer()
+    instrumentation = CompositeInstrumentation(metrics, OpenTelemetrySpanAdapter(tracer))
+    with hub.make_api_client(instrumentation=instrumentation) as api_client:
+        client = HubitatCachingClient(api_client, InMemoryDeviceCache())
+
+        assert metrics.get_histogram_count(REQUEST_SECONDS, {'endpoint': '/devices/all'}) == 1
+        assert metrics.get_counter(RESPONSE_BYTES, {'endpoint': '/devices/all'}) > 1000
+        assert metrics.get_histogram_count(LOAD_CACHE_SECONDS) == 1
+
+        client.get_device_attributes('Outlet 1')
+        client.get_device_attributes('Outlet 1')
+        assert metrics.get_counter(CACHE_MISSES, {'cache': 'device_attributes'}) == 1
+        assert metrics.get_counter(CACHE_HITS, {'cache': 'device_attributes'}) == 1
+
+        client.update_from_hubitat_events([
+            HubitatEvent({'deviceId': 1, 'displayName': 'Outlet 1', 'name': 'switch', 'value': 'on', 'source': 'DEVICE', 'date': format_hub_date(time.time() - 3)}),
+            HubitatEvent({'deviceId': 2, 'displayName': 'Outlet 2', 'name': 'switch', 'value': 'on', 'source': 'DEVICE'}),
+        ])
+        assert metrics.get_histogram_count(EVENT_APPLY_SECONDS) == 1
+        assert metrics.get_counter(EVENTS_APPLIED) == 2
+        # Only events that carry a hub date have a lag
+        assert metrics.get_histogram_count(EVENT_LAG_SECONDS) == 1
+        assert 'hubitat_event_lag_seconds_bucket{le="2"} 0' in metrics.render()
+        assert 'hubitat_event_lag_seconds_bucket{le="5"} 1' in metrics.render()
+
+    assert ('hubitat.load_cache', None) in tracer.spans
+    assert ('hubitat.api_get', {'endpoint': '/devices/{id}'}) in tracer.spans
+    assert ('hubitat.apply_events', {'events': 2}) in tracer.spans
+
+
+def test_snapshot_cache_hits(hub):
+    metrics = PrometheusInstrumentation()
+    with hub.make_api_client(instrumentation=metrics) as api_client:
+        client = HubitatClient(api_client)
+        client.get_switches()
+        client.get_switches()
+
+    assert metrics.get_counter(CACHE_MISSES, {'cache': 'identity_snapshot'}) == 1
+    assert metrics.get_counter(CACHE_HITS, {'cache': 'identity_snapshot'}) == 1
+
+
+def test_async_client(hub):
+    metrics = PrometheusInstrumentation()
+
+    async def run():
+        async with AsyncHubitatAPIClient(hub.app_id, hub.access_token, host=hub.host, instrumentation=metrics) as api_client:
+            client = AsyncHubitatClient(api_client)
+            assert len(await client.get_switches()) == 4
+            await client.get_device_attributes('Outlet 1')
+            await client.get_device_attributes('Outlet 1')
+
+    asyncio.run(run())
+
+    assert metrics.get_histogram_count(REQUEST_SECONDS, {'endpoint': '/devices/all'}) == 1
+    assert metrics.get_counter(RESPONSE_BYTES, {'endpoint': '/devices/{id}'}) > 0
+    assert metrics.get_counter(CACHE_MISSES, {'cache': 'device_attributes'}) == 1
+    assert metrics.get_counter(CACHE_HITS, {'cache': 'device_attributes'}) == 1
+
+
+def test_disabled_by_default(hub):
+    with hub.make_api_client() as api_client:
+        assert not api_client.instrumentation.enabled
+        assert not CompositeInstrumentation(api_client.instrumentation).enabled
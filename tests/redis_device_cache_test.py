@@ -0,0 +1,217 @@
+import fakeredis
+import json
+import mock
+import pytest
+import redis
+import threading
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.redis_device_cache import RedisDeviceCache
+from tests.caching_client_test import FAKE_ACCESS_TOKEN
+from tests.caching_client_test import FAKE_APP_ID
+from tests.caching_client_test import FAKE_DEVICE_TIMESTAMP
+from tests.caching_client_test import FAKE_HUB_ID
+from tests.caching_client_test import FAKE_LUX_1
+from tests.caching_client_test import FAKE_LUX_2
+from tests.caching_client_test import FAKE_SWITCH_OFF
+from tests.caching_client_test import FAKE_SWITCH_ON
+from tests.caching_client_test import make_event
+from tests.caching_client_test import mock_requests  # noqa
+
+
+@pytest.fixture(params=[True, False])
+def redis_client(request):
+    return fakeredis.FakeRedis(decode_responses=request.param)
+
+
+@pytest.fixture
+def device_cache(redis_client):
+    return RedisDeviceCache(redis_client, namespace='test')
+
+
+@pytest.fixture
+def mock_client(device_cache):
+    return HubitatCachingClient(
+        HubitatAPIClient(
+            app_id=FAKE_APP_ID,
+            access_token=FAKE_ACCESS_TOKEN,
+            hub_id=FAKE_HUB_ID,
+        ),
+        device_cache,
+    )
+
+
+@pytest.fixture
+def pipeline_executes():
+    with mock.patch.object(redis.client.Pipeline, 'execute', autospec=True, side_effect=redis.client.Pipeline.execute) as mock_execute:
+        yield mock_execute
+
+
+def test_load_cache(mock_client):
+    assert mock_client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    assert mock_client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Kitchen') == {FAKE_SWITCH_ON['label']}
+    assert mock_client.get_capabilities_for_device_id(int(FAKE_LUX_1['id'])) == {'IlluminanceMeasurement'}
+    assert mock_client.get_last_device_value(FAKE_LUX_1['label'], 'illuminance') == FAKE_LUX_1['attributes']['illuminance']
+    assert mock_client.get_last_device_timestamp(FAKE_SWITCH_OFF['label'], 'switch', 'off') == FAKE_DEVICE_TIMESTAMP
+    assert mock_client.get_last_device_timestamp(FAKE_SWITCH_OFF['label'], 'switch', 'on') is None
+
+
+def test_get_devices_by_attribute_range(mock_client):
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', hi=70) == {FAKE_LUX_1['label']}
+
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_1, 'illuminance', '90'))
+
+    assert mock_client.get_devices_by_attribute_range('IlluminanceMeasurement', 'illuminance', lo=70) == {FAKE_LUX_1['label'], FAKE_LUX_2['label']}
+
+
+def test_query(mock_client):
+    assert mock_client.query('Switch', room='Kitchen', attrs={'switch': 'on'}) == {FAKE_SWITCH_ON['label']}
+    assert mock_client.query('IlluminanceMeasurement', attrs={'illuminance': (None, 50)}) == {FAKE_LUX_1['label']}
+
+
+def test_update_from_hubitat_event(mock_client):
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_ON, 'switch', 'off'))
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF, 'switch', 'on'))
+
+    assert mock_client.get_on_switches() == {FAKE_SWITCH_OFF['label']}
+
+
+def test_writes_are_pipelined(mock_client, pipeline_executes):
+    mock_client.load_cache()
+
+    assert pipeline_executes.call_count == 1
+
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_ON, 'switch', 'off'))
+
+    assert pipeline_executes.call_count == 2
+
+
+def test_none_values(device_cache):
+    device_cache.add_device_for_capability_and_room('Switch', None, 'Unassigned')
+    device_cache.set_last_device_attr_value(None, 'Home', 'mode', None)
+
+    assert device_cache.get_devices_by_capability_and_room('Switch', None) == {'Unassigned'}
+    assert device_cache.get_last_device_attr_value(None, 'Home', 'mode') is None
+
+
+def test_clear(mock_client, device_cache, redis_client):
+    device_cache.clear()
+
+    assert mock_client.get_switches() == set()
+    assert redis_client.keys('test:*') == []
+
+
+def test_namespaces_are_isolated(redis_client):
+    cache_a = RedisDeviceCache(redis_client, namespace='a')
+    cache_b = RedisDeviceCache(redis_client, namespace='b')
+
+    cache_a.add_device_for_capability('Switch', 'Lamp')
+    cache_b.clear()
+
+    assert cache_a.get_devices_by_capability('Switch') == {'Lamp'}
+    assert cache_b.get_devices_by_capability('Switch') == set()
+
+
+def test_apply_mutations_is_transactional(device_cache, redis_client):
+    with mock.patch.object(redis_client, 'pipeline', wraps=redis_client.pipeline) as mock_pipeline:
+        device_cache.apply_mutations([
+            ('add_device_for_capability', 'Switch', 'Lamp'),
+            ('set_last_device_attr_value', 'Switch', 'Lamp', 'switch', 'on'),
+        ])
+
+    mock_pipeline.assert_called_once_with(transaction=True)
+    assert device_cache.get_devices_by_capability('Switch') == {'Lamp'}
+    assert device_cache.get_last_device_attr_value('Switch', 'Lamp', 'switch') == 'on'
+
+
+def test_rebuild_cache(mock_client, device_cache, redis_client):
+    mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_OFF, 'switch', 'on'))
+    device_cache.add_device_for_capability('Switch', 'Removed Switch')
+
+    mock_client.rebuild_cache()
+
+    assert mock_client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    assert mock_client.get_on_switches() == {FAKE_SWITCH_ON['label']}
+    assert mock_client.get_last_device_value(FAKE_LUX_1['label'], 'illuminance') == FAKE_LUX_1['attributes']['illuminance']
+    assert redis_client.keys('test:gen:*') == []
+
+    device_cache.clear()
+
+    assert redis_client.keys('test:*') == []
+
+
+def test_generations_do_not_share_keys(device_cache):
+    generation_a = device_cache.new_generation()
+    generation_b = device_cache.new_generation()
+    generation_a.add_device_for_capability('Switch', 'Lamp')
+
+    assert generation_a.namespace != generation_b.namespace
+    assert generation_b.get_devices_by_capability('Switch') == set()
+
+
+def test_failed_rebuild_deletes_generation_keys(mock_client, device_cache, redis_client):
+    with mock.patch.object(device_cache, 'swap_generation', side_effect=redis.ConnectionError):
+        with pytest.raises(redis.ConnectionError):
+            mock_client.rebuild_cache()
+
+    assert redis_client.keys('test:gen:*') == []
+    assert mock_client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+
+
+def test_rebuild_cache_replays_emptying_event(mock_client, device_cache, redis_client):
+    # The only on switch turns off during the rebuild, which empties the
+    # generation's switch=on set before the swap
+    def load_cache_into(generation):
+        snapshot = load_cache_into.original(generation)
+        mock_client.update_from_hubitat_event(make_event(FAKE_SWITCH_ON, 'switch', 'off'))
+        return snapshot
+    load_cache_into.original = mock_client._load_cache_into
+
+    with mock.patch.object(mock_client, '_load_cache_into', side_effect=load_cache_into):
+        mock_client.rebuild_cache()
+
+    assert mock_client.get_switches() == {FAKE_SWITCH_ON['label'], FAKE_SWITCH_OFF['label']}
+    assert mock_client.get_on_switches() == set()
+    assert mock_client.get_last_device_value(FAKE_SWITCH_ON['label'], 'switch') == 'off'
+    assert redis_client.keys('test:gen:*') == []
+
+
+def test_reconcile(mock_client, device_cache, mock_requests):  # noqa
+    mock_requests.get(
+        f'https://cloud.hubitat.com/api/{FAKE_HUB_ID}/apps/{FAKE_APP_ID}/devices/all?access_token={FAKE_ACCESS_TOKEN}',
+        text=json.dumps([FAKE_SWITCH_ON, {**FAKE_SWITCH_OFF, 'room': 'Garage'}, FAKE_LUX_1, FAKE_LUX_2]),
+    )
+
+    with mock.patch.object(device_cache, 'apply_mutations', wraps=device_cache.apply_mutations) as mock_apply_mutations:
+        mock_client.reconcile()
+
+    assert mock_apply_mutations.call_args[0][0] == [
+        ('remove_device_for_capability_and_room', 'Switch', 'Porch', FAKE_SWITCH_OFF['label']),
+        ('add_device_for_capability_and_room', 'Switch', 'Garage', FAKE_SWITCH_OFF['label']),
+    ]
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Garage') == {FAKE_SWITCH_OFF['label']}
+    assert mock_client.get_devices_by_capability_and_room('Switch', 'Porch') == set()
+
+
+def test_batches_are_per_thread(device_cache):
+    # A batch open in one thread must not pick up another thread's writes
+    batch_open = threading.Event()
+    other_written = threading.Event()
+
+    def write_in_batch():
+        with device_cache.batch():
+            device_cache.add_device_for_capability('Switch', 'Lamp')
+            batch_open.set()
+            other_written.wait(5)
+            assert device_cache.get_devices_by_capability('Switch') == {'Fan'}
+
+    thread = threading.Thread(target=write_in_batch)
+    thread.start()
+    batch_open.wait(5)
+    device_cache.add_device_for_capability('Switch', 'Fan')
+    other_written.set()
+    thread.join()
+
+    assert device_cache.get_devices_by_capability('Switch') == {'Lamp', 'Fan'}
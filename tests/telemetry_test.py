@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from hubitat_maker_api_client.api_client import HubitatAPIClient
+from hubitat_maker_api_client.caching_client import HubitatCachingClient
+from hubitat_maker_api_client.device_cache import InMemoryDeviceCache
+from hubitat_maker_api_client.telemetry import AGG_MAX
+from hubitat_maker_api_client.telemetry import AGG_MEAN
+from hubitat_maker_api_client.telemetry import TelemetryStore
+from tests.caching_client_test import FAKE_ACCESS_TOKEN
+from tests.caching_client_test import FAKE_APP_ID
+from tests.caching_client_test import FAKE_DEVICE_TIMESTAMP
+from tests.caching_client_test import FAKE_HUB_ID
+from tests.caching_client_test import FAKE_LUX_1
+from tests.caching_client_test import FAKE_SWITCH_ON
+from tests.caching_client_test import make_event
+from tests.caching_client_test import mock_requests  # noqa
+from tests.caching_client_test import mock_time  # noqa
+
+
+@pytest.fixture
+def telemetry_store():
+    return TelemetryStore(capacity=4)
+
+
+@pytest.fixture
+def mock_client(telemetry_store):
+    return HubitatCachingClient(
+        HubitatAPIClient(
+            app_id=FAKE_APP_ID,
+            access_token=FAKE_ACCESS_TOKEN,
+            hub_id=FAKE_HUB_ID,
+        ),
+        InMemoryDeviceCache(),
+        telemetry_store=telemetry_store,
+    )
+
+
+def test_records_numeric_events(mock_client, telemetry_store, mock_time):  # noqa
+    mock_time.side_effect = [FAKE_DEVICE_TIMESTAMP + i for i in range(3)]
+
+    mock_client.update_from_hubitat_event(make_event(FAKE_LUX_1, 'illuminance', '31'))
+    mock_client.update_from_hubitat_events([
+        make_event(FAKE_LUX_1, 'illuminance', 'n/a'),
+        make_event(FAKE_SWITCH_ON, 'switch', 'off'),
+    ])
+
+    timestamps, values = telemetry_store.get_samples(FAKE_LUX_1['label'], 'illuminance')
+    assert timestamps.tolist() == [FAKE_DEVICE_TIMESTAMP]
+    assert values.tolist() == [31.0]
+    assert telemetry_store.get_samples(FAKE_SWITCH_ON['label'], 'switch')[0].tolist() == []
+
+
+def test_ring_buffer_keeps_latest_samples(telemetry_store):
+    for t in range(10):
+        telemetry_store.record('Meter', 'power', t, t * 10)
+
+    assert not telemetry_store.record('Meter', 'power', 5, 0)
+
+    timestamps, values = telemetry_store.get_samples('Meter', 'power')
+    assert timestamps.tolist() == [6, 7, 8, 9]
+    assert values.tolist() == [60.0, 70.0, 80.0, 90.0]
+    assert telemetry_store.get_samples('Meter', 'power', start=7, end=9)[0].tolist() == [7, 8]
+
+
+def test_stats_and_windows():
+    store = TelemetryStore()
+    for t, v in [(0, 1), (30, 3), (60, 10), (90, 20), (150, 5)]:
+        store.record('Meter', 'power', t, v)
+
+    assert store.get_stats('Meter', 'power') == {'count': 5, 'min': 1.0, 'max': 20.0, 'mean': 7.8}
+    assert store.get_stats('Meter', 'power', start=1000) is None
+
+    window_starts, means = store.get_windowed('Meter', 'power', 60, AGG_MEAN)
+    assert window_starts.tolist() == [0, 60, 120]
+    assert means.tolist() == [2.0, 15.0, 5.0]
+    assert store.get_windowed('Meter', 'power', 60, AGG_MAX)[1].tolist() == [3.0, 20.0, 5.0]
+
+    with pytest.raises(ValueError):
+        store.get_windowed('Meter', 'power', 60, 'median')
+
+
+def test_rates():
+    store = TelemetryStore()
+    for t, v in [(0, 100), (3600, 101), (3600, 101.5), (7200, 103)]:
+        store.record('Meter', 'energy', t, v)
+
+    assert store.get_rate('Meter', 'energy') * 3600 == pytest.approx(1.5)
+    assert store.get_rate('Meter', 'energy', end=1) is None
+
+    timestamps, rates = store.get_rates('Meter', 'energy')
+    assert timestamps.tolist() == [3600, 7200]
+    assert np.allclose(rates * 3600, [1.0, 1.5])